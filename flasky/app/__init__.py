@@ -1,31 +1,45 @@
 from flask import Flask
-from flask_bootstrap import Bootstrap
-from flask_mail import Mail
-from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from config import config
+from .cache import UserCache
+from .database import FlaskySQLAlchemy
+from .hashing import PasswordHasher
+from .tokens import TokenService
+from .ledger import TokenLedger
+from .ratelimit import RateLimiter
+from .instrumentation import Instrumentation
+from .sessions import ServerSessions
+from .pagecache import PageCache
+from .lazy import LazyExtension, LazyViews
+from .templating import TemplateCache
+from .audit import AuditLog
 
-bootstrap = Bootstrap()
-mail = Mail()
-moment = Moment()
-db = SQLAlchemy()
+# These are only imported when they are first used, which with lazy loading
+# is after the application has started.
+bootstrap = LazyExtension('flask_bootstrap.Bootstrap')
+mail = LazyExtension('flask_mail.Mail')
+moment = LazyExtension('flask_moment.Moment')
+
+db = FlaskySQLAlchemy()
+user_cache = UserCache()
+password_hasher = PasswordHasher()
+tokens = TokenService()
+token_ledger = TokenLedger()
+rate_limiter = RateLimiter()
+instrumentation = Instrumentation()
+server_sessions = ServerSessions()
+page_cache = PageCache()
+template_cache = TemplateCache()
+audit_log = AuditLog()
 
 login_manager = LoginManager()
 login_manager.session_protection = 'strong'
 login_manager.login_view = 'auth.login'
 
 
-def create_app(config_name):
-    app = Flask(__name__)
-    app.config.from_object(config[config_name])
-    config[config_name].init_app(app)
-
+def load_views(app):
     bootstrap.init_app(app)
-    mail.init_app(app)
     moment.init_app(app)
-    db.init_app(app)
-    login_manager.init_app(app)
 
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
@@ -33,4 +47,38 @@ def create_app(config_name):
     from .auth import auth as auth_blueprint
     app.register_blueprint(auth_blueprint, url_prefix='/auth')
 
+
+def create_app(config_name, lazy=None):
+    app = Flask(__name__)
+    app.config.from_object(config[config_name])
+    config[config_name].init_app(app)
+    if lazy is None:
+        lazy = app.config['FLASKY_LAZY_LOADING']
+
+    template_cache.init_app(app)
+    db.init_app(app)
+    user_cache.init_app(app)
+    password_hasher.init_app(app)
+    tokens.init_app(app)
+    token_ledger.init_app(app)
+    rate_limiter.init_app(app)
+    audit_log.init_app(app)
+    # Instrumentation puts its own handler in front of the page cache.
+    page_cache.init_app(app)
+    instrumentation.init_app(app)
+    server_sessions.init_app(app)
+    login_manager.init_app(app)
+
+    from . import models
+
+    # Mail is set up by the first delivery when loading lazily.
+    if lazy:
+        LazyViews(app, load_views)
+    else:
+        from .email import init_mail
+        init_mail(app)
+        load_views(app)
+        if app.config['FLASKY_TEMPLATE_WARMUP']:
+            template_cache.warm_up(app)
+
     return app
@@ -0,0 +1,128 @@
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8')
+        .decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': (scope.get('client') or ('127.0.0.1', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        if name in environ:
+            # Cookies are joined as one Cookie header would list them.
+            separator = '; ' if name == 'HTTP_COOKIE' else ','
+            value = environ[name] + separator + value
+        environ[name] = value
+    # The body has been read in full, which a chunked request does not
+    # announce with a Content-Length; Werkzeug would otherwise read it as
+    # empty.
+    environ['CONTENT_LENGTH'] = str(len(body))
+    environ['wsgi.input_terminated'] = True
+    return environ
+
+
+# Flask 0.12 views are synchronous, so under an ASGI server the event loop
+# owns the connections and each request, once its body has fully arrived,
+# runs on a bounded pool of threads. A slow or idle client then costs a
+# coroutine instead of a worker thread. Password hashing is still sent to
+# the FLASKY_HASH_WORKERS processes and email is only queued, so a request
+# thread spends its time on the view itself. Since bodies are read into
+# memory, one longer than max_body_size (MAX_CONTENT_LENGTH) is answered
+# with 413 as soon as it is known to be too long.
+class ASGIAdapter:
+    def __init__(self, wsgi_app, max_workers=None, max_body_size=None):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported ASGI scope %r' % scope['type'])
+        if self.too_large(dict(scope.get('headers', [])).get(
+                b'content-length', b'0')):
+            return await self.reject(send)
+        body = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if self.too_large(size):
+                return await self.reject(send)
+            body.append(chunk)
+            if not message.get('more_body'):
+                break
+        environ = _environ(scope, b''.join(body))
+        status, headers, content = await asyncio.get_running_loop() \
+            .run_in_executor(self.executor, self.run_wsgi, environ)
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    def too_large(self, size):
+        if self.max_body_size is None:
+            return False
+        try:
+            return int(size) > self.max_body_size
+        except ValueError:
+            return False
+
+    @staticmethod
+    async def reject(send):
+        await send({'type': 'http.response.start', 'status': 413,
+                    'headers': [(b'content-type', b'text/plain'),
+                                (b'connection', b'close')]})
+        await send({'type': 'http.response.body',
+                    'body': b'Request Entity Too Large'})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def run_wsgi(self, environ):
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = [int(status.split(' ', 1)[0]),
+                           [(name.lower().encode('latin-1'),
+                             value.encode('latin-1'))
+                            for name, value in headers]]
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response[0], response[1], content
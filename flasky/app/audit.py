@@ -0,0 +1,239 @@
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from flask import current_app, has_request_context, request
+from .metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+audit_dropped = Counter('flasky_audit_events_dropped_total',
+                        'Audit events dropped because the buffer was full '
+                        'or they could not be written.')
+audit_written = Counter('flasky_audit_events_written_total',
+                        'Audit events written.')
+audit_buffered = Gauge('flasky_audit_events_buffered',
+                       'Audit events waiting to be written.')
+
+
+class DatabaseSink:
+    """Writes to the application's engine, or to bind, an engine or
+    connection of its own."""
+    def __init__(self, app, bind=None):
+        self.app = app
+        self.bind = bind
+
+    def write(self, events):
+        from . import db
+        from .models import AuditEvent
+        bind = self.bind if self.bind is not None else db.get_engine(self.app)
+        # One executemany() and commit per batch.
+        with bind.connect() as conn, conn.begin():
+            conn.execute(AuditEvent.__table__.insert(), events)
+
+
+class JSONLSink:
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, events):
+        lines = ''.join(
+            json.dumps(dict(event, created_at=event['created_at']
+                            .isoformat())) + '\n' for event in events)
+        # A single append, so lines from several processes do not mix.
+        with open(self.path, 'a') as f:
+            f.write(lines)
+
+
+class _AuditState:
+    def __init__(self, sink, size, batch_size, interval, background):
+        self.sink = sink
+        self.size = size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.background = background
+        self.buffer = deque()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+        self.dropped = 0
+        self.written = 0
+
+    def put(self, event):
+        with self.lock:
+            if len(self.buffer) >= self.size:
+                self.dropped += 1
+                audit_dropped.inc()
+                return False
+            self.buffer.append(event)
+            pending = len(self.buffer)
+        audit_buffered.set(pending)
+        if self.background:
+            self.start_writer()
+            if pending >= self.batch_size:
+                self.wakeup.set()
+        return True
+
+    def start_writer(self):
+        # A forked server worker starts a writer of its own.
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run,
+                                               name='audit-writer',
+                                               daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            while True:
+                with self.lock:
+                    batch = [self.buffer.popleft() for i in
+                             range(min(self.batch_size, len(self.buffer)))]
+                    pending = len(self.buffer)
+                audit_buffered.set(pending)
+                if not batch:
+                    return
+                try:
+                    self.sink.write(batch)
+                except Exception:
+                    logger.exception('Could not write %d audit events',
+                                     len(batch))
+                    with self.lock:
+                        self.dropped += len(batch)
+                    audit_dropped.inc(len(batch))
+                else:
+                    self.written += len(batch)
+                    audit_written.inc(len(batch))
+
+
+def _normalize(email):
+    return email.strip().lower() if email else None
+
+
+# Recording an event only appends it to a bounded in-process buffer, so the
+# auth views do not wait for another write. A background thread writes the
+# buffer every FLASKY_AUDIT_FLUSH_INTERVAL seconds, or as soon as
+# FLASKY_AUDIT_BATCH_SIZE events are waiting, with one executemany() INSERT
+# and commit per batch into the audit_events table, or appended to a JSONL
+# file with FLASKY_AUDIT_BACKEND = 'jsonl'. When FLASKY_AUDIT_BUFFER_SIZE events are
+# already waiting, new ones are dropped and counted rather than slowing the
+# request down; batches that cannot be written are dropped the same way.
+# Events still buffered when the process exits are written by an atexit
+# handler. The lookups below read the table, so they see an event once its
+# batch has been written.
+class AuditLog:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_AUDIT_BACKEND', 'database')
+        app.config.setdefault('FLASKY_AUDIT_JSONL_PATH', 'audit.jsonl')
+        app.config.setdefault('FLASKY_AUDIT_BUFFER_SIZE', 10000)
+        app.config.setdefault('FLASKY_AUDIT_BATCH_SIZE', 500)
+        app.config.setdefault('FLASKY_AUDIT_FLUSH_INTERVAL', 1.0)
+        app.config.setdefault('FLASKY_AUDIT_BACKGROUND', True)
+        backend = app.config['FLASKY_AUDIT_BACKEND']
+        if backend == 'database':
+            sink = DatabaseSink(app)
+        elif backend == 'jsonl':
+            sink = JSONLSink(app.config['FLASKY_AUDIT_JSONL_PATH'])
+        elif backend == 'null':
+            sink = None
+        else:
+            raise ValueError('Unknown audit backend %r' % backend)
+        app.extensions['audit_log'] = _AuditState(
+            sink, app.config['FLASKY_AUDIT_BUFFER_SIZE'],
+            app.config['FLASKY_AUDIT_BATCH_SIZE'],
+            app.config['FLASKY_AUDIT_FLUSH_INTERVAL'],
+            app.config['FLASKY_AUDIT_BACKGROUND'])
+
+    @property
+    def _state(self):
+        return current_app.extensions['audit_log']
+
+    def record(self, event, success=True, user=None, email=None,
+               detail=None):
+        """Buffer an event about user, or about the account email when no
+        user is known. Returns False if the event was dropped."""
+        state = self._state
+        if state.sink is None:
+            return False
+        if user is not None and email is None:
+            email = user.email
+        return state.put({
+            'created_at': datetime.utcnow(),
+            'event': event,
+            'success': success,
+            'user_id': user.id if user is not None else None,
+            'email': _normalize(email),
+            'ip': request.remote_addr if has_request_context() else None,
+            'detail': detail[:128] if detail else None,
+        })
+
+    def flush(self):
+        """Write every buffered event now, in the calling thread."""
+        self._state.flush()
+
+    def stats(self):
+        state = self._state
+        return {'buffered': len(state.buffer), 'dropped': state.dropped,
+                'written': state.written}
+
+
+def recent_events(email=None, ip=None, success=None, event=None,
+                  within=24 * 3600, limit=50):
+    """Return the newest events for an account or address from the last
+    within seconds."""
+    from .models import AuditEvent
+    query = AuditEvent.query.filter(
+        AuditEvent.created_at >= datetime.utcnow() -
+        timedelta(seconds=within))
+    if email is not None:
+        query = query.filter(AuditEvent.email == _normalize(email))
+    if ip is not None:
+        query = query.filter(AuditEvent.ip == ip)
+    if success is not None:
+        query = query.filter(AuditEvent.success == success)
+    if event is not None:
+        query = query.filter(AuditEvent.event == event)
+    return query.order_by(AuditEvent.created_at.desc()).limit(limit).all()
+
+
+def recent_failures(email=None, ip=None, within=3600, limit=20):
+    return recent_events(email=email, ip=ip, success=False, within=within,
+                         limit=limit)
+
+
+def prune(days, batch_size=1000):
+    """Delete events older than days, batch_size at a time, and return how
+    many were deleted."""
+    from . import db
+    from .models import AuditEvent
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = 0
+    while True:
+        ids = db.session.query(AuditEvent.id) \
+            .filter(AuditEvent.created_at < cutoff) \
+            .order_by(AuditEvent.created_at).limit(batch_size).subquery()
+        count = AuditEvent.query.filter(AuditEvent.id.in_(ids)) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        deleted += count
+        if count < batch_size:
+            return deleted
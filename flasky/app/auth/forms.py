@@ -5,6 +5,23 @@ from wtforms import ValidationError
 from ..models import User
 
 
+# Uniqueness checks for several fields are collected and resolved in one
+# query once the other validators have run, instead of one query per field.
+class UniqueUserFieldsMixin(object):
+    # Maps field names to the error shown when the value is already in use.
+    unique_user_fields = {}
+
+    def validate(self):
+        valid = super(UniqueUserFieldsMixin, self).validate()
+        values = dict((name, self[name].data)
+                      for name in self.unique_user_fields
+                      if not self[name].errors)
+        for name in User.taken(**values):
+            self[name].errors.append(self.unique_user_fields[name])
+            valid = False
+        return valid
+
+
 class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Length(1, 64),
                                              Email()])
@@ -13,7 +30,7 @@ class LoginForm(FlaskForm):
     submit = SubmitField('Log In')
 
 
-class RegistrationForm(FlaskForm):
+class RegistrationForm(UniqueUserFieldsMixin, FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Length(1, 64),
                                            Email()])
     username = StringField('Username', validators=[
@@ -25,13 +42,8 @@ class RegistrationForm(FlaskForm):
     password2 = PasswordField('Confirm password', validators=[DataRequired()])
     submit = SubmitField('Register')
 
-    def validate_email(self, field):
-        if User.query.filter_by(email=field.data).first():
-            raise ValidationError('Email already registered.')
-
-    def validate_username(self, field):
-        if User.query.filter_by(username=field.data).first():
-            raise ValidationError('Username already in use.')
+    unique_user_fields = {'email': 'Email already registered.',
+                          'username': 'Username already in use.'}
 
 
 class ChangePasswordForm(FlaskForm):
@@ -57,16 +69,14 @@ class PasswordResetForm(FlaskForm):
     submit = SubmitField('Reset Password')
 
     def validate_email(self, field):
-        if User.query.filter_by(email=field.data).first() is None:
+        if not User.taken(email=field.data):
             raise ValidationError('Unknown email address.')
 
 
-class ChangeEmailForm(FlaskForm):
+class ChangeEmailForm(UniqueUserFieldsMixin, FlaskForm):
     email = StringField('New Email', validators=[DataRequired(), Length(1, 64),
                                                  Email()])
     password = PasswordField('Password', validators=[DataRequired()])
     submit = SubmitField('Update Email Address')
 
-    def validate_email(self, field):
-        if User.query.filter_by(email=field.data).first():
-            raise ValidationError('Email already registered.')
+    unique_user_fields = {'email': 'Email already registered.'}
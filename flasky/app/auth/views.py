@@ -1,24 +1,65 @@
-from flask import render_template, redirect, request, url_for, flash
+from flask import render_template, redirect, request, url_for, flash, \
+    current_app
 from flask_login import login_user, logout_user, login_required, \
     current_user
+from sqlalchemy.exc import IntegrityError
 from . import auth
-from .. import db
+from .. import db, rate_limiter, audit_log
+from ..claims import refresh_claims, session_claims
 from ..models import User
 from ..email import send_email
 from .forms import LoginForm, RegistrationForm, ChangePasswordForm,\
     PasswordResetRequestForm, PasswordResetForm, ChangeEmailForm
 
 
+# Unconfirmed users can still reach the auth pages and static files. The
+# decision is made from the session claims, so it costs no query, and only
+# for requests outside the exempt endpoints, which are collected once the
+# blueprint is registered (see the end of this module).
 @auth.before_app_request
 def before_request():
-    if current_user.is_authenticated \
-            and not current_user.confirmed \
-            and request.endpoint \
-            and request.endpoint[:5] != 'auth.' \
-            and request.endpoint != 'static':
+    endpoint = request.endpoint
+    if endpoint is None or \
+            endpoint in current_app.extensions['unconfirmed_endpoints']:
+        return
+    claims = session_claims()
+    if claims is not None and not claims['confirmed']:
         return redirect(url_for('auth.unconfirmed'))
 
 
+# Login and password reset attempts are counted per client address and per
+# account before the form is even parsed, so a client over its limit costs
+# neither a database query nor a password hash.
+RATE_LIMITED_ENDPOINTS = frozenset(['auth.login',
+                                    'auth.password_reset_request'])
+
+
+@auth.before_request
+def limit_attempts():
+    config = current_app.config
+    if request.method != 'POST' or \
+            request.endpoint not in RATE_LIMITED_ENDPOINTS or \
+            not config['FLASKY_RATELIMIT_ENABLED']:
+        return
+    limited = rate_limiter.hit('ip:%s:%s' % (request.endpoint,
+                                             request.remote_addr),
+                               config['FLASKY_RATELIMIT_PER_IP'])
+    email = request.form.get('email', '')
+    if email.strip():
+        limited = rate_limiter.hit(account_key(request.endpoint, email),
+                                   config['FLASKY_RATELIMIT_PER_ACCOUNT']) \
+            or limited
+    if limited:
+        return render_template('429.html'), 429, \
+            {'Retry-After': str(config['FLASKY_RATELIMIT_WINDOW'])}
+
+
+# Emails are normalized here, so the key counted before the form is parsed
+# is the one reset after a successful login.
+def account_key(endpoint, email):
+    return 'account:%s:%s' % (endpoint, email.strip().lower())
+
+
 @auth.route('/unconfirmed')
 def unconfirmed():
     if current_user.is_anonymous or current_user.confirmed:
@@ -32,8 +73,16 @@ def login():
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         if user is not None and user.verify_password(form.password.data):
+            # Hashes made with older settings are upgraded on the next
+            # successful login, while the plain password is at hand.
+            if user.password_needs_rehash():
+                user.password = form.password.data
+                db.session.add(user)
             login_user(user, form.remember_me.data)
+            rate_limiter.reset(account_key('auth.login', form.email.data))
+            audit_log.record('login', user=user)
             return redirect(request.args.get('next') or url_for('main.index'))
+        audit_log.record('login', False, user=user, email=form.email.data)
         flash('Invalid username or password.')
     return render_template('auth/login.html', form=form)
 
@@ -54,7 +103,14 @@ def register():
                     username=form.username.data,
                     password=form.password.data)
         db.session.add(user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another registration took the email or username after the
+            # form was validated; the unique indexes have the last word.
+            db.session.rollback()
+            flash('Email or username already registered.')
+            return render_template('auth/register.html', form=form)
         token = user.generate_confirmation_token()
         send_email(user.email, 'Confirm Your Account',
                    'auth/email/confirm', user=user, token=token)
@@ -69,6 +125,8 @@ def confirm(token):
     if current_user.confirmed:
         return redirect(url_for('main.index'))
     if current_user.confirm(token):
+        db.session.commit()
+        refresh_claims(current_user)
         flash('You have confirmed your account. Thanks!')
     else:
         flash('The confirmation link is invalid or has expired.')
@@ -93,9 +151,11 @@ def change_password():
         if current_user.verify_password(form.old_password.data):
             current_user.password = form.password.data
             db.session.add(current_user)
+            audit_log.record('password_change', user=current_user)
             flash('Your password has been updated.')
             return redirect(url_for('main.index'))
         else:
+            audit_log.record('password_change', False, user=current_user)
             flash('Invalid password.')
     return render_template("auth/change_password.html", form=form)
 
@@ -113,6 +173,8 @@ def password_reset_request():
                        'auth/email/reset_password',
                        user=user, token=token,
                        next=request.args.get('next'))
+        audit_log.record('password_reset_request', user is not None,
+                         user=user, email=form.email.data)
         flash('An email with instructions to reset your password has been '
               'sent to you.')
         return redirect(url_for('auth.login'))
@@ -127,11 +189,14 @@ def password_reset(token):
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         if user is None:
+            audit_log.record('password_reset', False, email=form.email.data)
             return redirect(url_for('main.index'))
         if user.reset_password(token, form.password.data):
+            audit_log.record('password_reset', user=user)
             flash('Your password has been updated.')
             return redirect(url_for('auth.login'))
         else:
+            audit_log.record('password_reset', False, user=user)
             return redirect(url_for('main.index'))
     return render_template('auth/reset_password.html', form=form)
 
@@ -147,10 +212,14 @@ def change_email_request():
             send_email(new_email, 'Confirm your email address',
                        'auth/email/change_email',
                        user=current_user, token=token)
+            audit_log.record('email_change_request', user=current_user,
+                             detail=new_email)
             flash('An email with instructions to confirm your new email '
                   'address has been sent to you.')
             return redirect(url_for('main.index'))
         else:
+            audit_log.record('email_change_request', False,
+                             user=current_user, detail=form.email.data)
             flash('Invalid email or password.')
     return render_template("auth/change_email.html", form=form)
 
@@ -158,8 +227,22 @@ def change_email_request():
 @auth.route('/change-email/<token>')
 @login_required
 def change_email(token):
+    old_email = current_user.email
     if current_user.change_email(token):
+        db.session.commit()
+        refresh_claims(current_user)
+        audit_log.record('email_change', user=current_user, email=old_email,
+                         detail=current_user.email)
         flash('Your email address has been updated.')
     else:
+        audit_log.record('email_change', False, user=current_user)
         flash('Invalid request.')
     return redirect(url_for('main.index'))
+
+
+@auth.record_once
+def collect_unconfirmed_endpoints(state):
+    app = state.app
+    app.extensions['unconfirmed_endpoints'] = frozenset(
+        [endpoint for endpoint in app.view_functions
+         if endpoint.startswith(auth.name + '.')] + ['static'])
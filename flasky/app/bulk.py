@@ -0,0 +1,151 @@
+import csv
+import json
+import time
+from itertools import islice
+from flask import current_app
+from . import db, password_hasher
+from .models import User, Role, role_table
+
+EXPORT_FIELDS = ('email', 'username', 'role', 'confirmed', 'password_hash')
+
+
+def guess_format(path):
+    return 'csv' if path.endswith('.csv') else 'jsonl'
+
+
+def read_rows(stream, fmt):
+    if fmt == 'csv':
+        return csv.DictReader(stream)
+    return (json.loads(line) for line in stream if line.strip())
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+class _Progress:
+    def __init__(self, callback):
+        self.callback = callback
+        self.start = time.time()
+        self.count = 0
+
+    def add(self, count):
+        self.count += count
+        if self.callback is not None:
+            elapsed = time.time() - self.start
+            self.callback(self.count, self.count / elapsed if elapsed else 0)
+
+
+def _check(row, role_ids):
+    if not row.get('email'):
+        return 'no email'
+    if not row.get('password') and not row.get('password_hash'):
+        return 'no password'
+    if row.get('role') and row['role'] not in role_ids:
+        return 'unknown role %r' % row['role']
+
+
+def _taken(column, values):
+    values = set(value for value in values if value)
+    if not values:
+        return set()
+    return set(value for value, in
+               db.session.query(column).filter(column.in_(values)))
+
+
+# Rows carry email, username, and optionally role (by name), confirmed and
+# either password or an existing password_hash, as written by export_users.
+# Roles are looked up once, the passwords of each batch are hashed across
+# the hasher's worker processes, and every batch is inserted with a single
+# executemany and committed. Earlier batches are committed by the time a
+# later row is read, so a row that cannot be inserted (no email or
+# password, an unknown role, or an email or username that is already
+# taken, by a user or an earlier row) is passed to skip with the reason
+# and its number, counting from 1, and left out instead of stopping the
+# import halfway. Taken names are looked up once per batch.
+def import_users(stream, fmt='jsonl', batch_size=1000, progress=None,
+                 skip=None):
+    role_ids = dict(db.session.query(Role.name, Role.id))
+    roles = role_table()
+    admin_email = current_app.config['FLASKY_ADMIN']
+    insert = User.__table__.insert()
+    rows = enumerate(read_rows(stream, fmt), 1)
+    tracker = _Progress(progress)
+    while True:
+        numbered = list(islice(rows, batch_size))
+        if not numbered:
+            break
+        emails = _taken(User.email, [row.get('email') for n, row in numbered])
+        usernames = _taken(User.username,
+                           [row.get('username') for n, row in numbered])
+        batch = []
+        for number, row in numbered:
+            reason = _check(row, role_ids)
+            if reason is None and row['email'] in emails:
+                reason = 'email %r already registered' % row['email']
+            if reason is None and row.get('username') and \
+                    row['username'] in usernames:
+                reason = 'username %r already taken' % row['username']
+            if reason is not None:
+                if skip is not None:
+                    skip(number, reason)
+                continue
+            emails.add(row['email'])
+            if row.get('username'):
+                usernames.add(row['username'])
+            batch.append(row)
+        if not batch:
+            continue
+        plain = [row for row in batch if not row.get('password_hash')]
+        for row, password_hash in zip(plain, password_hasher.hash_many(
+                [row['password'] for row in plain])):
+            row['password_hash'] = password_hash
+        values = []
+        for row in batch:
+            if row.get('role'):
+                role_id = role_ids[row['role']]
+            elif row['email'] == admin_email:
+                role_id = roles.admin_role
+            else:
+                role_id = roles.default_role
+            values.append({'email': row['email'],
+                           'username': row.get('username') or None,
+                           'role_id': role_id,
+                           'password_hash': row['password_hash'],
+                           'confirmed': _flag(row.get('confirmed', False))})
+        db.session.execute(insert, values)
+        db.session.commit()
+        tracker.add(len(values))
+    return tracker.count
+
+
+# Rows are streamed from a server-side cursor where the driver supports one
+# and fetched batch_size at a time, so memory use does not grow with the
+# number of users.
+def export_users(stream, fmt='jsonl', batch_size=1000, progress=None):
+    query = db.session.query(User.email, User.username,
+                             Role.name.label('role'), User.confirmed,
+                             User.password_hash) \
+        .outerjoin(Role, User.role_id == Role.id) \
+        .order_by(User.id) \
+        .execution_options(stream_results=True) \
+        .yield_per(batch_size)
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, EXPORT_FIELDS)
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(row):
+            stream.write(json.dumps(row) + '\n')
+    tracker = _Progress(progress)
+    pending = 0
+    for row in query:
+        write(dict(zip(EXPORT_FIELDS, row)))
+        pending += 1
+        if pending == batch_size:
+            tracker.add(pending)
+            pending = 0
+    tracker.add(pending)
+    return tracker.count
@@ -0,0 +1,179 @@
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import current_app
+from .metrics import Counter
+
+cache_hits = Counter('flasky_user_cache_hits_total',
+                     'User cache lookups answered from the cache.')
+cache_misses = Counter('flasky_user_cache_misses_total',
+                       'User cache lookups that missed.')
+
+
+# Backends only need get(), set(), delete() and clear(). Values are plain
+# dictionaries of column values, never ORM instances, so they can be shared
+# between requests (and between processes, for the Redis backend).
+class SimpleBackend:
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisBackend:
+    def __init__(self, url, ttl=300, prefix='flasky:'):
+        import redis
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis = redis.StrictRedis.from_url(url)
+
+    def get(self, key):
+        value = self._redis.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self._redis.setex(self.prefix + key, self.ttl,
+                          pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def delete(self, *keys):
+        if keys:
+            self._redis.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        for key in self._redis.scan_iter(self.prefix + '*'):
+            self._redis.delete(key)
+
+
+class NullBackend:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+class _CacheState:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.versions = {}
+
+
+# The cache is an extension like the others in app/__init__.py. Each
+# application gets its own backend and hit/miss counters, so the counters
+# can be used to check how many database round-trips the cache saves.
+class UserCache:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_USER_CACHE_TYPE', 'simple')
+        app.config.setdefault('FLASKY_USER_CACHE_SIZE', 1024)
+        app.config.setdefault('FLASKY_USER_CACHE_TTL', 300)
+        app.config.setdefault('FLASKY_USER_CACHE_REDIS_URL', None)
+        app.extensions['user_cache'] = _CacheState(self._make_backend(app))
+
+    @staticmethod
+    def _make_backend(app):
+        cache_type = app.config['FLASKY_USER_CACHE_TYPE']
+        ttl = app.config['FLASKY_USER_CACHE_TTL']
+        if cache_type == 'simple':
+            return SimpleBackend(app.config['FLASKY_USER_CACHE_SIZE'], ttl)
+        if cache_type == 'redis':
+            return RedisBackend(app.config['FLASKY_USER_CACHE_REDIS_URL'], ttl)
+        if cache_type == 'null':
+            return NullBackend()
+        raise ValueError('Unknown user cache type %r' % cache_type)
+
+    @property
+    def _state(self):
+        return current_app.extensions['user_cache']
+
+    def get(self, key):
+        state = self._state
+        value = state.backend.get(key)
+        if value is None:
+            state.misses += 1
+            cache_misses.inc()
+        else:
+            state.hits += 1
+            cache_hits.inc()
+        return value
+
+    def set(self, key, value):
+        self._state.backend.set(key, value)
+
+    def invalidate(self, *keys):
+        self._state.backend.delete(*keys)
+
+    # Version stamps let processes that share a backend agree on when data
+    # kept outside the cache, such as the role permission table, is stale.
+    # They are not counted as hits or misses. The last stamp seen is also
+    # kept in the process, and stored again when the backend has lost it
+    # (or, like the null backend, never keeps one), so a stamp only changes
+    # when bump_version() is called.
+    def version(self, name):
+        state = self._state
+        value = state.backend.get('version:' + name)
+        if value is None:
+            value = state.versions.get(name)
+            if value is None:
+                return self.bump_version(name)
+            state.backend.set('version:' + name, value)
+        state.versions[name] = value
+        return value
+
+    def bump_version(self, name):
+        state = self._state
+        value = state.versions[name] = uuid.uuid4().hex
+        state.backend.set('version:' + name, value)
+        return value
+
+    def clear(self):
+        state = self._state
+        state.backend.clear()
+        state.versions.clear()
+        state.hits = state.misses = 0
+
+    def stats(self):
+        state = self._state
+        return {'hits': state.hits, 'misses': state.misses}
@@ -0,0 +1,84 @@
+from flask import current_app, request, session
+from flask_login import current_user, user_logged_in, user_logged_out
+from . import db, user_cache
+from .models import User, permission_table, version_key
+
+CLAIMS_KEY = '_claims'
+
+
+def make_claims(user):
+    permissions = permission_table().get(user.role_id, 0)
+    return {'id': user.id, 'version': user.version,
+            'confirmed': bool(user.confirmed), 'role': user.role_id,
+            'permissions': permissions,
+            'roles': user_cache.version('roles')}
+
+
+def refresh_claims(user):
+    """Rebuild the claims of the logged in user after a committed change
+    to it, so the next request does not have to find out."""
+    session[CLAIMS_KEY] = make_claims(user)
+
+
+def _stale(claims, user_id):
+    if claims is None or claims['id'] != user_id:
+        return True
+    version = user_cache.get(version_key(user_id))
+    if version is None:
+        version = db.session.query(User.version).filter_by(id=user_id) \
+            .scalar()
+        if version is None:
+            return True
+        user_cache.set(version_key(user_id), version)
+    return version != claims['version']
+
+
+# What the confirmation gate and permission_required need to know about the
+# logged in user (whether it is confirmed, and the permission bits of its
+# role) is kept in the signed session, so they can decide without loading
+# the user. The claims are checked against the version counter of the user
+# row, which is kept in the user cache whenever a change to the row is
+# committed; when the cache has no version, e.g. with the null cache, the
+# counter alone is read from the database. Only stale claims cause the user
+# to be loaded. Views that change the logged in user rebuild the claims
+# with refresh_claims() once the change is committed. The permission bits follow the roles version stamp, so a change
+# to the roles is picked up from the permission table.
+def session_claims():
+    user_id = session.get('user_id')
+    if user_id is None:
+        remember = current_app.config.get('REMEMBER_COOKIE_NAME',
+                                          'remember_token')
+        if remember not in request.cookies or \
+                not current_user.is_authenticated:
+            return None
+        user_id = session['user_id']
+    user_id = int(user_id)
+    claims = session.get(CLAIMS_KEY)
+    if _stale(claims, user_id):
+        if not current_user.is_authenticated:
+            return None
+        claims = session[CLAIMS_KEY] = make_claims(current_user)
+    elif claims['roles'] != user_cache.version('roles'):
+        claims = dict(claims, roles=user_cache.version('roles'),
+                      permissions=permission_table().get(claims['role'], 0))
+        session[CLAIMS_KEY] = claims
+    return claims
+
+
+def has_permission(permissions):
+    claims = session_claims()
+    return claims is not None and \
+        (claims['permissions'] & permissions) == permissions
+
+
+# The user has just been read to check the password, so its version is
+# current and saves the first request the lookup.
+@user_logged_in.connect
+def _set_claims(app, user):
+    session[CLAIMS_KEY] = make_claims(user)
+    user_cache.set(version_key(user.id), user.version)
+
+
+@user_logged_out.connect
+def _clear_claims(app, user):
+    session.pop(CLAIMS_KEY, None)
@@ -0,0 +1,151 @@
+import random
+import time
+from flask import has_request_context, session as http_session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.expression import Select
+from sqlalchemy.pool import QueuePool, StaticPool
+from .metrics import Histogram
+
+pool_checkout_wait = Histogram('flasky_db_pool_checkout_wait_seconds',
+                               'Time spent waiting for a pooled connection.')
+
+
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.time()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            pool_checkout_wait.observe(time.time() - start)
+
+
+def _set_sqlite_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+    return on_connect
+
+
+# Reads go to one of the FLASKY_DB_REPLICAS, chosen at random, and everything
+# else goes to the primary. Once a session has written, it keeps reading from
+# the primary so a request always sees its own writes. The following
+# requests from the same client also stay on the primary for
+# FLASKY_DB_REPLICA_STICKY_SECONDS, to cover replication lag.
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.config['FLASKY_DB_REPLICAS']
+        if replicas and not self.uses_primary(mapper, clause):
+            return get_state(self.app).db.get_engine(
+                self.app, bind='replica%d' % random.randrange(len(replicas)))
+        if clause is not None and not isinstance(clause, Select):
+            self.info['primary'] = True
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    def uses_primary(self, mapper, clause):
+        if self._flushing or self.info.get('primary'):
+            return True
+        if clause is None or not isinstance(clause, Select):
+            return True
+        if mapper is not None and \
+                mapper.persist_selectable.info.get('bind_key') is not None:
+            return True
+        return has_request_context() and \
+            http_session.get('_db_primary_until', 0) > time.time()
+
+
+# Engines are built from the FLASKY_DB_POOL profile of the config class,
+# using a queue pool that records how long checkouts wait. SQLite files get
+# the same pool plus the FLASKY_SQLITE_PRAGMAS, which are run on every new
+# connection. In-memory SQLite keeps the single static connection that
+# Flask-SQLAlchemy sets up for it.
+class FlaskySQLAlchemy(SQLAlchemy):
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_DB_POOL', {})
+        app.config.setdefault('FLASKY_SQLITE_PRAGMAS', {})
+        app.config.setdefault('FLASKY_DB_REPLICAS', [])
+        app.config.setdefault('FLASKY_DB_REPLICA_STICKY_SECONDS', 5)
+        # Replicas are registered as ordinary binds so their engines get the
+        # same options as the primary. No tables are bound to them.
+        if app.config['FLASKY_DB_REPLICAS']:
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            for i, uri in enumerate(app.config['FLASKY_DB_REPLICAS']):
+                binds['replica%d' % i] = uri
+            app.config['SQLALCHEMY_BINDS'] = binds
+            app.after_request(self.stick_to_primary)
+        super(FlaskySQLAlchemy, self).init_app(app)
+        app.teardown_appcontext(self.commit_if_dirty)
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        super(FlaskySQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+        if options.get('poolclass') is StaticPool:
+            return
+        options['poolclass'] = TimedQueuePool
+        options.update(app.config['FLASKY_DB_POOL'])
+        if sa_url.drivername.startswith('sqlite'):
+            connect_args = options.setdefault('connect_args', {})
+            connect_args['check_same_thread'] = False
+            options['sqlite_pragmas'] = app.config['FLASKY_SQLITE_PRAGMAS']
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop('sqlite_pragmas', None)
+        engine = super(FlaskySQLAlchemy, self).create_engine(sa_url,
+                                                             engine_opts)
+        if pragmas:
+            event.listen(engine, 'connect', _set_sqlite_pragmas(pragmas))
+        return engine
+
+    # Called before forking workers and again in each worker, so every
+    # process builds its own engines and never uses a pooled connection
+    # opened by another process.
+    def dispose_engines(self, app):
+        state = get_state(app)
+        with self._engine_lock:
+            connectors = list(state.connectors.values())
+            state.connectors.clear()
+        for connector in connectors:
+            engine = getattr(connector, '_engine', None)
+            if engine is not None:
+                engine.dispose()
+
+    def stick_to_primary(self, response):
+        if self.session.registry.has():
+            session = self.session()
+            if session.info.get('primary') or session.new or \
+                    session.dirty or session.deleted:
+                http_session['_db_primary_until'] = time.time() + \
+                    session.app.config['FLASKY_DB_REPLICA_STICKY_SECONDS']
+        return response
+
+    # Replaces SQLALCHEMY_COMMIT_ON_TEARDOWN, which committed after every
+    # request. Only sessions that were used and hold changes are committed,
+    # so read-only requests end without a COMMIT.
+    def commit_if_dirty(self, exc):
+        if exc is not None or not self.session.registry.has():
+            return
+        session = self.session()
+        if session.info.get('has_writes') or session.new or \
+                session.dirty or session.deleted:
+            session.commit()
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_writes(session, flush_context):
+    session.info['has_writes'] = True
+    session.info['primary'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _clear_writes(session):
+    session.info.pop('has_writes', None)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_writes(session, previous_transaction):
+    session.info.pop('has_writes', None)
@@ -2,17 +2,21 @@ from functools import wraps
 
 from flask import abort
 from flask_login import current_user
+from .claims import has_permission
 from .models import Permission
 
 # For cases in which an entire view function needs to be made available only
 # to users with certain permissions, a custom decorator can be used.
 # First one for generic permission checks and second one that checks
-# specifically for administrator permission.
+# specifically for administrator permission. Both check the permission bits
+# in the session claims once Flask-Login has loaded the user, so its session
+# protection and the user loader still have their say.
 def permission_required(permission):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if not current_user.can(permission):
+            if not current_user.is_authenticated or \
+                    not has_permission(permission):
                 abort(403)
             return f(*args, **kwargs)
         return decorated_function
@@ -1,20 +1,73 @@
-from threading import Thread
-from flask import current_app, render_template
-from flask_mail import Message
-from . import mail
+import json
+import time
+from flask import current_app, request, has_request_context
+from . import db, mail
+from .metrics import Histogram
+from .models import OutgoingMail
 
+EMAIL_TEMPLATE_PREFIXES = ('auth/email/', 'mail/')
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+
+# All email templates are compiled when mail is set up, and rendering
+# happens in the mail workers rather than in the request. The request only
+# queues the template name and a JSON copy of its arguments; the workers in
+# mail_queue.py render and deliver the message. The queued row is committed
+# with the rest of the request's changes, by the caller or at the end of
+# the request, so no mail goes out for changes that are rolled back.
+def load_templates(app):
+    names = app.jinja_env.list_templates(
+        filter_func=lambda name: name.startswith(EMAIL_TEMPLATE_PREFIXES))
+    app.extensions['email_templates'] = dict(
+        (name, app.jinja_env.get_template(name)) for name in names)
+    return app.extensions['email_templates']
+
+
+# Runs in create_app, or before the first delivery with lazy loading.
+def init_mail(app):
+    if 'mail' not in app.extensions:
+        mail.init_app(app)
+    if 'email_templates' not in app.extensions:
+        load_templates(app)
+
+
+def _render(template, context):
+    timer = Histogram.labelled('flasky_email_render_seconds',
+                               'Time spent rendering email templates.',
+                               template=template.name)
+    start = time.time()
+    context = dict(context)
+    current_app.update_template_context(context)
+    result = template.render(context)
+    timer.observe(time.time() - start)
+    return result
+
+
+def render_email(template, context, base_url=None):
+    templates = current_app.extensions.get('email_templates') or \
+        load_templates(current_app)
+    with current_app.test_request_context(base_url=base_url):
+        return (_render(templates[template + '.txt'], context),
+                _render(templates[template + '.html'], context))
+
+
+# Model instances such as the user are stored as a dictionary of their
+# columns, which the templates can read like the instance itself. Password
+# hashes are left out.
+def _plain(value):
+    if hasattr(value, '__mapper__'):
+        return dict((attr.key, getattr(value, attr.key))
+                    for attr in value.__mapper__.column_attrs
+                    if not attr.key.startswith('password'))
+    return value
 
 
 def send_email(to, subject, template, **kwargs):
     app = current_app._get_current_object()
-    msg = Message(app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
-                  sender=app.config['FLASKY_MAIL_SENDER'], recipients=[to])
-    msg.body = render_template(template + '.txt', **kwargs)
-    msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    context = dict((key, _plain(value)) for key, value in kwargs.items())
+    row = OutgoingMail(
+        sender=app.config['FLASKY_MAIL_SENDER'], recipients=to,
+        subject=app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
+        template=template, context=json.dumps(context),
+        base_url=request.url_root if has_request_context() else None)
+    db.session.add(row)
+    return row
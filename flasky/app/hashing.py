@@ -0,0 +1,95 @@
+import os
+import threading
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+from .metrics import Counter, Gauge
+
+hash_queue_depth = Gauge('flasky_password_hash_queue_depth',
+                         'Password hashing jobs waiting or running.')
+hash_rejected = Counter('flasky_password_hash_rejected_total',
+                        'Password hashing jobs rejected because the queue '
+                        'was full.')
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full. Views answer it with a 503."""
+
+
+class _HasherState:
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.executor = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        # The pool is started on first use, so commands that never hash a
+        # password (migrations, the shell) do not fork worker processes. A
+        # forked server worker starts a pool of its own.
+        with self.lock:
+            if self.executor is None or self.pid != os.getpid():
+                self.executor = ProcessPoolExecutor(self.workers)
+                self.pid = os.getpid()
+            return self.executor
+
+
+# Password hashing is CPU bound and deliberately slow, so it runs in a pool
+# of worker processes instead of the request thread. At most
+# FLASKY_HASH_QUEUE_SIZE jobs can be waiting or running at once; beyond that
+# HashingBusy is raised immediately instead of queueing more work.
+# With FLASKY_HASH_WORKERS set to 0 the hashes are computed inline.
+class PasswordHasher:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_PASSWORD_HASH_METHOD',
+                              'pbkdf2:sha256:150000')
+        app.config.setdefault('FLASKY_PASSWORD_SALT_LENGTH', 8)
+        app.config.setdefault('FLASKY_HASH_WORKERS', os.cpu_count())
+        app.config.setdefault('FLASKY_HASH_QUEUE_SIZE', 32)
+        app.extensions['password_hasher'] = _HasherState(
+            app.config['FLASKY_HASH_WORKERS'],
+            app.config['FLASKY_HASH_QUEUE_SIZE'])
+
+    def _run(self, func, *args):
+        state = current_app.extensions['password_hasher']
+        if not state.slots.acquire(blocking=False):
+            hash_rejected.inc()
+            raise HashingBusy()
+        hash_queue_depth.inc()
+        try:
+            if not state.workers:
+                return func(*args)
+            return state.get_executor().submit(func, *args).result()
+        finally:
+            hash_queue_depth.dec()
+            state.slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password,
+                         current_app.config['FLASKY_PASSWORD_HASH_METHOD'],
+                         current_app.config['FLASKY_PASSWORD_SALT_LENGTH'])
+
+    def hash_many(self, passwords, chunksize=64):
+        """Hash a batch of passwords across all the worker processes. Meant
+        for bulk jobs, so it does not take slots in the request queue."""
+        state = current_app.extensions['password_hasher']
+        args = (passwords,
+                repeat(current_app.config['FLASKY_PASSWORD_HASH_METHOD']),
+                repeat(current_app.config['FLASKY_PASSWORD_SALT_LENGTH']))
+        if not state.workers:
+            return list(map(generate_password_hash, *args))
+        return list(state.get_executor().map(generate_password_hash, *args,
+                                             chunksize=chunksize))
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        method = password_hash.split('$', 1)[0]
+        return method != current_app.config['FLASKY_PASSWORD_HASH_METHOD']
@@ -0,0 +1,172 @@
+import cProfile
+import json
+import os
+import pstats
+import random
+import time
+from flask import Response, abort, current_app, g, request, \
+    has_app_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .metrics import Counter, Histogram, generate_text
+
+_sql_listening = False
+
+REDACTED = 'redacted'
+REDACTED_EMAIL = 'redacted@example.com'
+
+
+def _labelled(cls, name, documentation):
+    return cls.labelled(name, documentation, endpoint=request.endpoint)
+
+
+# Database time is collected with engine events, which fire for every
+# engine in the process. They only record anything inside an instrumented
+# request, where _start_request has put the counters on g.
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_start', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.time() - conn.info['query_start'].pop()
+    stats = g.get('request_stats') if has_app_context() else None
+    if stats is not None:
+        stats['sql_count'] += 1
+        stats['sql_time'] += elapsed
+
+
+def _before_render(sender, template, context, **extra):
+    stats = g.get('request_stats')
+    if stats is not None:
+        stats['render_start'].append(time.time())
+
+
+def _after_render(sender, template, context, **extra):
+    stats = g.get('request_stats')
+    if stats is not None and stats['render_start']:
+        stats['render_time'] += time.time() - stats['render_start'].pop()
+
+
+# Opt-in (FLASKY_INSTRUMENTATION) per-endpoint wall time, database query
+# count and time, and template render time, exported at /metrics. A sample
+# of requests (FLASKY_PROFILE_SAMPLE_RATE) run under cProfile, and their
+# profile is written to FLASKY_PROFILE_DIR when they take longer than
+# FLASKY_SLOW_REQUEST_THRESHOLD seconds. When FLASKY_REQUEST_LOG is set,
+# requests are also appended to that file so 'manage.py profile' can replay
+# them later. /metrics only answers clients in FLASKY_METRICS_ALLOWED_IPS,
+# and is a 404 for everybody else.
+class Instrumentation:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        global _sql_listening
+        app.config.setdefault('FLASKY_INSTRUMENTATION', False)
+        app.config.setdefault('FLASKY_SLOW_REQUEST_THRESHOLD', 0.5)
+        app.config.setdefault('FLASKY_PROFILE_SAMPLE_RATE', 0.0)
+        app.config.setdefault('FLASKY_PROFILE_DIR', 'profiles')
+        app.config.setdefault('FLASKY_REQUEST_LOG', None)
+        app.config.setdefault('FLASKY_METRICS_ALLOWED_IPS',
+                              ['127.0.0.1', '::1'])
+        if not app.config['FLASKY_INSTRUMENTATION']:
+            return
+        # Timing starts before any other before_request handler runs.
+        app.before_request_funcs.setdefault(None, []).insert(
+            0, self._start_request)
+        app.after_request(self._finish_request)
+        before_render_template.connect(_before_render, app)
+        template_rendered.connect(_after_render, app)
+        if not _sql_listening:
+            event.listen(Engine, 'before_cursor_execute',
+                         _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute',
+                         _after_cursor_execute)
+            _sql_listening = True
+        app.add_url_rule('/metrics', 'metrics', self.metrics)
+
+    @staticmethod
+    def metrics():
+        if request.remote_addr not in \
+                current_app.config['FLASKY_METRICS_ALLOWED_IPS']:
+            abort(404)
+        return Response(generate_text(),
+                        mimetype='text/plain; version=0.0.4')
+
+    def _start_request(self):
+        g.request_stats = {'start': time.time(), 'sql_count': 0,
+                           'sql_time': 0.0, 'render_time': 0.0,
+                           'render_start': []}
+        if random.random() < current_app.config['FLASKY_PROFILE_SAMPLE_RATE']:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+        if current_app.config['FLASKY_REQUEST_LOG']:
+            self._record(current_app.config['FLASKY_REQUEST_LOG'])
+
+    def _finish_request(self, response):
+        stats = g.pop('request_stats', None)
+        if stats is None or request.endpoint is None:
+            return response
+        elapsed = time.time() - stats['start']
+        _labelled(Histogram, 'flasky_request_duration_seconds',
+                  'Wall time per request.').observe(elapsed)
+        _labelled(Counter, 'flasky_request_sql_queries_total',
+                  'SQL statements executed.').inc(stats['sql_count'])
+        _labelled(Histogram, 'flasky_request_sql_seconds',
+                  'Time spent in SQL per request.').observe(stats['sql_time'])
+        _labelled(Histogram, 'flasky_request_render_seconds',
+                  'Time spent rendering templates per request.').observe(
+            stats['render_time'])
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if elapsed >= current_app.config['FLASKY_SLOW_REQUEST_THRESHOLD']:
+                self._dump(profiler, current_app.config['FLASKY_PROFILE_DIR'])
+        return response
+
+    @staticmethod
+    def _dump(profiler, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        profiler.dump_stats(os.path.join(directory, '%s-%d.prof' % (
+            request.endpoint, time.time() * 1000)))
+
+    # The log keeps the shape of each request but none of what was typed:
+    # password fields and the CSRF token are left out and other values are
+    # replaced, with an address that still passes validation for email
+    # fields, so the replayed requests take the same paths. Tokens in the
+    # URL are replaced as well, and the query string is left out.
+    @staticmethod
+    def _record(path):
+        rule = request.url_rule
+        if rule is None:
+            url = request.path
+        else:
+            values = dict((key, REDACTED if 'token' in key else value)
+                          for key, value in (request.view_args or {}).items())
+            url = request.script_root + rule.build(values)[1]
+        form = {}
+        for key in request.form:
+            if 'password' in key or key == 'csrf_token':
+                continue
+            form[key] = REDACTED_EMAIL if 'email' in key else REDACTED
+        with open(path, 'a') as f:
+            f.write(json.dumps({'method': request.method, 'path': url,
+                                'form': form}) + '\n')
+
+
+def replay(app, path, repeat=1):
+    """Run the requests recorded in path against app under cProfile and
+    return the collected statistics."""
+    with open(path) as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+    client = app.test_client()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    for i in range(repeat):
+        for r in requests:
+            client.open(r['path'], method=r['method'], data=r['form'])
+    profiler.disable()
+    return pstats.Stats(profiler)
@@ -0,0 +1,61 @@
+import importlib
+import threading
+from flask import url_for
+
+
+class LazyExtension:
+    """Stands in for an extension object whose module is only imported, and
+    the object created, the first time one of its attributes is used."""
+    def __init__(self, import_name):
+        self._import_name = import_name
+        self._obj = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._obj is None:
+            with self._lock:
+                if self._obj is None:
+                    module, name = self._import_name.rsplit('.', 1)
+                    self._obj = getattr(importlib.import_module(module),
+                                        name)()
+        return self._obj
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+
+# With FLASKY_LAZY_LOADING the views are set up by load (blueprints and the
+# extensions only templates need) when the application handles its first
+# request, or when a URL is built for one of their endpoints outside a
+# request, e.g. while rendering an email. Commands that never serve a page
+# don't pay for them.
+class LazyViews:
+    def __init__(self, app, load):
+        self.app = app
+        self.load = load
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.wsgi_app = app.wsgi_app
+        app.wsgi_app = self
+        app.url_build_error_handlers.append(self.build_url)
+        app.extensions['lazy_views'] = self
+
+    def ensure_loaded(self):
+        if self.loaded:
+            return False
+        with self.lock:
+            if self.loaded:
+                return False
+            self.load(self.app)
+            self.app.wsgi_app = self.wsgi_app
+            self.loaded = True
+        return True
+
+    def __call__(self, environ, start_response):
+        self.ensure_loaded()
+        return self.wsgi_app(environ, start_response)
+
+    def build_url(self, error, endpoint, values):
+        if not self.ensure_loaded():
+            raise error
+        return url_for(endpoint, **values)
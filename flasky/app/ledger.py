@@ -0,0 +1,182 @@
+import hashlib
+import math
+import threading
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from .metrics import Counter
+
+LOOKUPS_HELP = 'Single-use token lookups, by what answered them.'
+filter_lookups = Counter('flasky_token_ledger_lookups_total', LOOKUPS_HELP,
+                         {'source': 'filter'})
+database_lookups = Counter('flasky_token_ledger_lookups_total', LOOKUPS_HELP,
+                           {'source': 'database'})
+
+
+class BloomFilter:
+    """A set of strings that may report false positives, at about the given
+    error rate while it holds no more than capacity of them, but never false
+    negatives."""
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        bits = -self.capacity * math.log(error_rate) / math.log(2) ** 2
+        self.size = max(int(math.ceil(bits / 8.0)), 1) * 8
+        self.hashes = max(int(round(bits / self.capacity * math.log(2))), 1)
+        self.bits = bytearray(self.size // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # k positions from two halves of one digest (Kirsch-Mitzenmacher).
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+
+class _LedgerState:
+    def __init__(self, capacity, error_rate, rebuild_interval,
+                 compact_interval):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rebuild_interval = rebuild_interval
+        self.compact_interval = compact_interval
+        self.lock = threading.Lock()
+        self.filter = None
+        self.built_at = 0
+        self.compacted_at = 0
+
+
+def _now():
+    return current_app.extensions['tokens'].clock()
+
+
+# Single-use tokens are recorded here by their 'jti' when they are used.
+# Nearly every token checked has never been used before, so a Bloom filter
+# of the recorded ids is kept in memory, and the table is only read when
+# the filter reports a possible match. The filter is built from the table
+# on first use and rebuilt every FLASKY_TOKEN_LEDGER_REBUILD_INTERVAL
+# seconds, which drops expired ids and picks up those recorded by other
+# processes, or sooner once it holds more ids than it was sized for. A
+# filter that has not seen a token used by another process only lets the
+# request get as far as the insert, which the primary key then refuses.
+#
+# Rows are only needed until the token expires. The first token recorded
+# by a process, and then one every FLASKY_TOKEN_LEDGER_COMPACT_INTERVAL
+# seconds, also deletes the expired rows. Times come from the token service
+# clock, as the expiry times in the tokens do.
+class TokenLedger:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_TOKEN_LEDGER_CAPACITY', 100000)
+        app.config.setdefault('FLASKY_TOKEN_LEDGER_ERROR_RATE', 0.01)
+        app.config.setdefault('FLASKY_TOKEN_LEDGER_REBUILD_INTERVAL', 600)
+        app.config.setdefault('FLASKY_TOKEN_LEDGER_COMPACT_INTERVAL', 3600)
+        app.extensions['token_ledger'] = _LedgerState(
+            app.config['FLASKY_TOKEN_LEDGER_CAPACITY'],
+            app.config['FLASKY_TOKEN_LEDGER_ERROR_RATE'],
+            app.config['FLASKY_TOKEN_LEDGER_REBUILD_INTERVAL'],
+            app.config['FLASKY_TOKEN_LEDGER_COMPACT_INTERVAL'])
+
+    @property
+    def _state(self):
+        return current_app.extensions['token_ledger']
+
+    def _filter(self):
+        state = self._state
+        f = state.filter
+        if f is None or len(f) > state.capacity or \
+                _now() - state.built_at >= state.rebuild_interval:
+            f = self.rebuild()
+        return f
+
+    def rebuild(self):
+        """Build the filter again from the unexpired rows of the table."""
+        from . import db
+        from .models import ConsumedToken
+        state = self._state
+        now = _now()
+        jtis = [jti for jti, in db.session.query(ConsumedToken.jti).filter(
+            ConsumedToken.expires_at > datetime.utcfromtimestamp(now))]
+        # Leave room to grow until the next rebuild.
+        f = BloomFilter(max(state.capacity, 2 * len(jtis)), state.error_rate)
+        for jti in jtis:
+            f.add(jti)
+        with state.lock:
+            state.capacity = f.capacity
+            state.filter = f
+            state.built_at = now
+        return f
+
+    def is_consumed(self, jti):
+        if jti not in self._filter():
+            filter_lookups.inc()
+            return False
+        from . import db
+        from .models import ConsumedToken
+        database_lookups.inc()
+        return db.session.query(ConsumedToken.jti).filter_by(jti=jti) \
+            .first() is not None
+
+    def consume(self, jti, expires):
+        """Record that the token with this jti, which expires at the given
+        timestamp, has been used, in the current transaction. Returns False
+        if it was used before or has no jti. A token recorded concurrently
+        by another request makes the insert fail, in which case the session
+        is rolled back."""
+        from . import db
+        from .models import ConsumedToken
+        if not jti or expires is None or self.is_consumed(jti):
+            return False
+        db.session.add(ConsumedToken(
+            jti=jti, expires_at=datetime.utcfromtimestamp(expires)))
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return False
+        state = self._state
+        with state.lock:
+            if state.filter is not None:
+                state.filter.add(jti)
+        if _now() - state.compacted_at >= state.compact_interval:
+            self.compact()
+        return True
+
+    def compact(self):
+        """Delete the rows of tokens that have expired, and return how many
+        were deleted."""
+        from .models import ConsumedToken
+        state = self._state
+        now = _now()
+        state.compacted_at = now
+        count = ConsumedToken.query.filter(
+            ConsumedToken.expires_at <= datetime.utcfromtimestamp(now)) \
+            .delete(synchronize_session=False)
+        # The filter cannot forget ids, so it is rebuilt on next use.
+        state.filter = None
+        return count
+
+    def stats(self):
+        f = self._state.filter
+        if f is None:
+            return {'ids': 0, 'bytes': 0, 'hashes': 0}
+        return {'ids': len(f), 'bytes': len(f.bits), 'hashes': f.hashes}
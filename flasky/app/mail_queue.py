@@ -0,0 +1,260 @@
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from smtplib import SMTPException, SMTPServerDisconnected
+from flask import current_app
+from flask_mail import Message
+from . import db, mail
+from .email import init_mail, render_email
+from .metrics import Counter
+from .models import OutgoingMail, DeadMail
+
+logger = logging.getLogger(__name__)
+
+mail_sent = Counter('flasky_mail_sent_total', 'Messages delivered.')
+mail_failed = Counter('flasky_mail_failed_total',
+                      'Delivery attempts that failed.')
+mail_dead = Counter('flasky_mail_dead_total',
+                    'Messages moved to the dead letter table.')
+
+
+def to_message(row):
+    body, html = row.body, row.html
+    if row.template is not None:
+        body, html = render_email(row.template, json.loads(row.context),
+                                  row.base_url)
+    return Message(row.subject, sender=row.sender,
+                   recipients=row.recipients.split(','),
+                   body=body, html=html)
+
+
+# Claiming stamps a batch of due rows with the worker's id in one UPDATE.
+# The conditions are repeated outside the subquery so that two workers
+# racing for the same rows cannot both claim them. A claim older than
+# FLASKY_MAIL_QUEUE_LEASE seconds belongs to a worker that died and can be
+# taken over.
+def claim_batch(worker_id, batch_size):
+    now = datetime.utcnow()
+    expired = now - timedelta(
+        seconds=current_app.config['FLASKY_MAIL_QUEUE_LEASE'])
+    available = db.and_(OutgoingMail.next_attempt_at <= now,
+                        db.or_(OutgoingMail.claimed_by.is_(None),
+                               OutgoingMail.claimed_at < expired))
+    due = db.session.query(OutgoingMail.id).filter(available) \
+        .order_by(OutgoingMail.id).limit(batch_size).subquery()
+    OutgoingMail.query.filter(OutgoingMail.id.in_(due), available) \
+        .update({'claimed_by': worker_id, 'claimed_at': now},
+                synchronize_session=False)
+    db.session.commit()
+    return OutgoingMail.query.filter_by(claimed_by=worker_id) \
+        .order_by(OutgoingMail.id).all()
+
+
+def record_failure(row, error):
+    config = current_app.config
+    row.attempts = (row.attempts or 0) + 1
+    row.last_error = str(error)
+    row.claimed_by = None
+    mail_failed.inc()
+    if row.attempts >= config['FLASKY_MAIL_QUEUE_MAX_ATTEMPTS']:
+        db.session.add(DeadMail(sender=row.sender,
+                                recipients=row.recipients,
+                                subject=row.subject, body=row.body,
+                                html=row.html, template=row.template,
+                                context=row.context, base_url=row.base_url,
+                                attempts=row.attempts,
+                                last_error=row.last_error,
+                                created_at=row.created_at))
+        db.session.delete(row)
+        mail_dead.inc()
+        logger.error('Giving up on mail %d to %s: %s',
+                     row.id, row.recipients, error)
+    else:
+        delay = config['FLASKY_MAIL_QUEUE_RETRY_DELAY'] * \
+            2 ** (row.attempts - 1)
+        row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+
+def requeue_dead():
+    count = 0
+    for dead in DeadMail.query.all():
+        db.session.add(OutgoingMail(sender=dead.sender,
+                                    recipients=dead.recipients,
+                                    subject=dead.subject, body=dead.body,
+                                    html=dead.html, template=dead.template,
+                                    context=dead.context,
+                                    base_url=dead.base_url,
+                                    created_at=dead.created_at))
+        db.session.delete(dead)
+        count += 1
+    db.session.commit()
+    return count
+
+
+def queue_status():
+    now = datetime.utcnow()
+    return {
+        'queued': OutgoingMail.query.count(),
+        'due': OutgoingMail.query.filter(
+            OutgoingMail.next_attempt_at <= now).count(),
+        'claimed': OutgoingMail.query.filter(
+            OutgoingMail.claimed_by.isnot(None)).count(),
+        'dead': DeadMail.query.count()
+    }
+
+
+# Each worker thread keeps its own SMTP connection open between batches and
+# only closes it after FLASKY_MAIL_QUEUE_IDLE_TIMEOUT seconds without work,
+# or when a send fails and the connection can no longer be trusted. Every
+# message is committed on its own, so an error while handling one of them
+# is recorded as a failed attempt of that message and the worker carries on
+# with the rest of the batch.
+class MailWorker(threading.Thread):
+    def __init__(self, app, pool):
+        super(MailWorker, self).__init__()
+        self.daemon = True
+        self.app = app
+        self.pool = pool
+        self.worker_id = uuid.uuid4().hex
+        self.connection = None
+        self.last_used = 0
+
+    def run(self):
+        with self.app.app_context():
+            try:
+                self.work()
+            finally:
+                self.close()
+                db.session.remove()
+
+    def work(self):
+        config = self.app.config
+        while not self.pool.stopping.is_set():
+            try:
+                batch = claim_batch(self.worker_id,
+                                    config['FLASKY_MAIL_QUEUE_BATCH_SIZE'])
+            except Exception:
+                logger.exception('Could not claim mail')
+                db.session.rollback()
+                batch = []
+            if batch:
+                self.deliver(batch)
+                continue
+            if self.pool.once:
+                break
+            if time.time() - self.last_used > \
+                    config['FLASKY_MAIL_QUEUE_IDLE_TIMEOUT']:
+                self.close()
+            self.pool.stopping.wait(config['FLASKY_MAIL_QUEUE_POLL_INTERVAL'])
+
+    def deliver(self, batch):
+        for row in batch:
+            row_id = row.id
+            try:
+                sent = self.deliver_one(row)
+            except Exception as e:
+                # Marking the row failed, e.g. on a database error. It still
+                # counts as an attempt, so a message that keeps failing ends
+                # up in the dead letter table instead of stopping the worker.
+                logger.exception('Could not deliver mail %d', row_id)
+                db.session.rollback()
+                try:
+                    record_failure(row, e)
+                    db.session.commit()
+                except Exception:
+                    logger.exception('Could not record failure of mail %d',
+                                     row_id)
+                    db.session.rollback()
+            else:
+                if sent:
+                    mail_sent.inc()
+                    self.pool.count_sent()
+        self.last_used = time.time()
+
+    def deliver_one(self, row):
+        sent = False
+        try:
+            msg = to_message(row)
+        except Exception as e:
+            logger.exception('Could not render mail %d', row.id)
+            record_failure(row, e)
+        else:
+            try:
+                self.send(msg)
+            except (SMTPException, socket.error) as e:
+                self.close()
+                record_failure(row, e)
+            except Exception as e:
+                # e.g. flask_mail's BadHeaderError, raised before anything
+                # is sent, so the connection can be kept.
+                logger.exception('Could not send mail %d', row.id)
+                record_failure(row, e)
+            else:
+                db.session.delete(row)
+                sent = True
+        db.session.commit()
+        return sent
+
+    def send(self, msg):
+        try:
+            self.connect().send(msg)
+        except SMTPServerDisconnected:
+            # The server dropped an idle connection; try once more on a
+            # fresh one before counting it as a failure.
+            self.close()
+            self.connect().send(msg)
+
+    def connect(self):
+        if self.connection is None:
+            init_mail(self.app)
+            self.connection = mail.connect().__enter__()
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.__exit__(None, None, None)
+            except (SMTPException, socket.error):
+                pass
+            self.connection = None
+
+
+class MailWorkerPool:
+    def __init__(self, app, workers=None, once=False):
+        self.app = app
+        self.workers = workers or app.config['FLASKY_MAIL_QUEUE_WORKERS']
+        self.once = once
+        self.stopping = threading.Event()
+        self.threads = []
+        self.sent = 0
+        self.lock = threading.Lock()
+
+    def count_sent(self):
+        with self.lock:
+            self.sent += 1
+
+    def start(self):
+        self.threads = [MailWorker(self.app, self)
+                        for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def join(self):
+        for thread in self.threads:
+            while thread.is_alive():
+                thread.join(0.5)
+
+    def run(self):
+        self.start()
+        try:
+            self.join()
+        except KeyboardInterrupt:
+            self.stop()
+            self.join()
@@ -11,6 +11,10 @@ from ..models import Permission
 # To avoid having to add a template argument in every render_template() call,
 # a context processor can be used. Context processors make variables globally
 # available to all templates.
+# The dictionary never changes, so it is built once instead of per render.
+_permission_context = dict(Permission=Permission)
+
+
 @main.app_context_processor
 def inject_permissions():
-    return dict(Permission=Permission)
\ No newline at end of file
+    return _permission_context
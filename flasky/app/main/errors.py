@@ -1,5 +1,6 @@
 from flask import render_template
 from . import main
+from ..hashing import HashingBusy
 
 
 @main.app_errorhandler(404)
@@ -10,3 +11,8 @@ def page_not_found(e):
 @main.app_errorhandler(500)
 def internal_server_error(e):
     return render_template('500.html'), 500
+
+
+@main.app_errorhandler(HashingBusy)
+def service_unavailable(e):
+    return render_template('503.html'), 503, {'Retry-After': '1'}
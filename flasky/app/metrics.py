@@ -0,0 +1,119 @@
+import threading
+
+
+# A minimal metrics registry. Metrics are created once at import time by the
+# modules that own them and updated from request handlers, so every update
+# takes a lock rather than relying on the GIL. Metrics that share a name but
+# differ in their labels are registered separately.
+registry = {}
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels or {}
+        self._lock = threading.Lock()
+        registry[(name, tuple(sorted(self.labels.items())))] = self
+
+    @classmethod
+    def labelled(cls, name, documentation, **labels):
+        metric = registry.get((name, tuple(sorted(labels.items()))))
+        if metric is None:
+            metric = cls(name, documentation, labels)
+        return metric
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=None):
+        super(Counter, self).__init__(name, documentation, labels)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labels=None):
+        super(Gauge, self).__init__(name, documentation, labels)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    default_buckets = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labels=None, buckets=None):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(buckets or self.default_buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('"', '\\"'))
+                             for key, value in sorted(labels.items()))
+
+
+def generate_text():
+    """Render every registered metric in the Prometheus text format."""
+    lines = []
+    seen = set()
+    for key in sorted(registry):
+        metric = registry[key]
+        if metric.name not in seen:
+            seen.add(metric.name)
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+        if metric.type == 'histogram':
+            with metric._lock:
+                counts = list(metric.counts)
+                count, total = metric.count, metric.sum
+            for bound, value in zip(metric.buckets, counts):
+                labels = dict(metric.labels, le=repr(float(bound)))
+                lines.append('%s_bucket%s %d' % (
+                    metric.name, _format_labels(labels), value))
+            labels = dict(metric.labels, le='+Inf')
+            lines.append('%s_bucket%s %d' % (metric.name,
+                                             _format_labels(labels), count))
+            lines.append('%s_sum%s %r' % (metric.name,
+                                          _format_labels(metric.labels),
+                                          total))
+            lines.append('%s_count%s %d' % (metric.name,
+                                            _format_labels(metric.labels),
+                                            count))
+        else:
+            lines.append('%s%s %r' % (metric.name,
+                                      _format_labels(metric.labels),
+                                      metric.value))
+    return '\n'.join(lines) + '\n'
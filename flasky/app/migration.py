@@ -0,0 +1,127 @@
+import logging
+import time
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger('flasky.migration')
+
+DEFAULT_BATCH_SIZE = 5000
+REPORT_INTERVAL = 5
+
+
+# Helpers for migrations that touch large tables such as users, e.g.
+#
+#     from app.migration import backfill, create_index_online
+#
+#     def upgrade():
+#         op.add_column('users', sa.Column('email_lower', sa.String(64)))
+#         users = sa.table('users', sa.column('id'), sa.column('email'),
+#                          sa.column('email_lower'))
+#         backfill(users, {'email_lower': sa.func.lower(users.c.email)},
+#                  where=users.c.email_lower.is_(None))
+#         create_index_online('ix_users_email_lower', 'users',
+#                             ['email_lower'])
+#
+# Progress is logged to 'flasky.migration', which alembic.ini sends to the
+# console, and the batch size can be given on the command line with
+# 'manage.py db upgrade -x batch_size=1000'.
+
+
+def _batch_size(batch_size):
+    if batch_size is None:
+        batch_size = op.get_context().opts.get('backfill_batch_size',
+                                               DEFAULT_BATCH_SIZE)
+    return batch_size
+
+
+def _duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '%dh%02dm' % (hours, minutes)
+    return '%dm%02ds' % (minutes, seconds)
+
+
+class _Progress:
+    def __init__(self, name, total, callback):
+        self.name = name
+        self.total = total
+        self.callback = callback
+        self.start = self.last_report = time.time()
+        self.done = 0
+
+    def add(self, count, final=False):
+        self.done += count
+        now = time.time()
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed else 0
+        eta = (self.total - self.done) / rate if rate else 0
+        if self.callback is not None:
+            self.callback(self.done, self.total, rate, eta)
+        if final or now - self.last_report >= REPORT_INTERVAL:
+            self.last_report = now
+            logger.info('%s: %d/%d rows (%.1f%%), %.0f rows/s, ETA %s',
+                        self.name, self.done, self.total,
+                        100.0 * self.done / self.total if self.total else 100,
+                        rate, _duration(eta))
+
+
+# The rows to change are walked in primary key order, batch_size at a time,
+# and every batch is updated and committed on its own connection, so no
+# lock is held for longer than one batch and an interrupted backfill can
+# simply be run again when it has a where clause that skips the rows it
+# already did. The migration's own transaction is committed first, so the
+# new columns are visible to that connection. progress, if given, is called
+# after every batch with the rows done, the total, the rate and the ETA.
+def backfill(table, values, where=None, key='id', batch_size=None,
+             progress=None):
+    batch_size = _batch_size(batch_size)
+    key = table.c[key]
+    condition = where if where is not None else sa.true()
+    with op.get_context().autocommit_block():
+        engine = op.get_bind().engine
+        with engine.connect() as conn:
+            total = conn.scalar(sa.select([sa.func.count()])
+                                .select_from(table).where(condition))
+            tracker = _Progress('backfill %s' % table.name, total, progress)
+            last = None
+            while True:
+                batch = sa.select([key]).where(condition) \
+                    .order_by(key).limit(batch_size)
+                if last is not None:
+                    batch = batch.where(key > last)
+                ids = [row[0] for row in conn.execute(batch)]
+                if not ids:
+                    break
+                bounds = [key <= ids[-1], condition]
+                if last is not None:
+                    bounds.append(key > last)
+                with conn.begin():
+                    conn.execute(table.update().where(sa.and_(*bounds))
+                                 .values(values))
+                last = ids[-1]
+                tracker.add(len(ids))
+            tracker.add(0, final=True)
+    return tracker.done
+
+
+# PostgreSQL builds the index without blocking writes to the table, which
+# needs to happen outside of a transaction. Other backends build it the
+# usual way; MySQL's InnoDB already does so online, and SQLite has no such
+# option.
+def create_index_online(name, table, columns, **kw):
+    if op.get_bind().dialect.name != 'postgresql':
+        op.create_index(name, table, columns, **kw)
+        return
+    logger.info('creating index %s concurrently', name)
+    with op.get_context().autocommit_block():
+        op.create_index(name, table, columns, postgresql_concurrently=True,
+                        **kw)
+
+
+def drop_index_online(name, table):
+    if op.get_bind().dialect.name != 'postgresql':
+        op.drop_index(name, table_name=table)
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -1,8 +1,15 @@
-from werkzeug.security import generate_password_hash, check_password_hash
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from flask import current_app
+from collections import namedtuple
+from datetime import datetime
+from types import MappingProxyType
+from flask import current_app, g
 from flask_login import UserMixin, AnonymousUserMixin
-from . import db, login_manager
+from sqlalchemy import event, exists
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
+from . import db, login_manager, user_cache, password_hasher, tokens, \
+    token_ledger
 
 class Permission:
     FOLLOW = 0x01
@@ -45,6 +52,40 @@ class Role(db.Model):
         return '<Role %r>' % self.name
 
 
+# Roles change rarely, so their permissions are kept in a read-only map keyed
+# by role id, and User.can() never goes through the role relationship. The
+# ids of the default and administrator roles, which new users are given,
+# are kept alongside. The table is rebuilt when the 'roles' version stamp in
+# the user cache changes, which happens whenever a change to the roles table
+# is committed, e.g. by Role.insert_roles(). The stamp is read once per
+# request and the table is then kept in g.
+PermissionTable = namedtuple('PermissionTable', ['version', 'permissions',
+                                                 'default_role',
+                                                 'admin_role'])
+
+
+def role_table():
+    table = g.get('role_table')
+    if table is None:
+        version = user_cache.version('roles')
+        table = current_app.extensions.get('permission_table')
+        if table is None or table.version != version:
+            rows = db.session.query(Role.id, Role.permissions,
+                                    Role.default).all()
+            table = PermissionTable(
+                version,
+                MappingProxyType(dict((id, p) for id, p, d in rows)),
+                next((id for id, p, d in rows if d), None),
+                next((id for id, p, d in rows if p == 0xFF), None))
+            current_app.extensions['permission_table'] = table
+        g.role_table = table
+    return table
+
+
+def permission_table():
+    return role_table().permissions
+
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -53,18 +94,37 @@ class User(UserMixin, db.Model):
     role_id = db.Column(db.Integer, db.ForeignKey('roles.id'))
     password_hash = db.Column(db.String(128))
     confirmed = db.Column(db.Boolean, default=False)
+    # Incremented whenever the row changes; see app/claims.py.
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
-        if self.role is None:
+        if self.role is None and self.role_id is None:
+            table = role_table()
             if self.email == current_app.config['FLASKY_ADMIN']:
-                self.role = Role.query.filter_by(permissions=0xFF).first()
-            if self.role is None:
-                self.role = Role.query.filter_by(default=True).first()
+                self.role_id = table.admin_role
+            if self.role_id is None:
+                self.role_id = table.default_role
+
+    @staticmethod
+    def taken(**values):
+        """Return the names of the given columns whose value is already used
+        by a user. All values are checked with EXISTS in a single query."""
+        if not values:
+            return set()
+        checks = [exists().where(getattr(User, name) == value).label(name)
+                  for name, value in values.items()]
+        row = db.session.query(*checks).one()
+        return set(name for name in values if getattr(row, name))
 
     def can(self, permissions):
-        return self.role is not None and \
-               (self.role.permissions & permissions) == permissions
+        role_id = self.role_id
+        if role_id is None and self.role is not None:
+            role_id = self.role.id
+        role_permissions = permission_table().get(role_id)
+        return role_permissions is not None and \
+               (role_permissions & permissions) == permissions
 
     def is_administrator(self):
         return self.can(Permission.ADMINISTER)
@@ -75,67 +135,151 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password_hash)
 
     def generate_confirmation_token(self, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
-        return s.dumps({'confirm': self.id})
+        return tokens.dumps({'confirm': self.id}, expiration)
 
     def confirm(self, token):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
-            return False
-        if data.get('confirm') != self.id:
+        result = tokens.loads(token)
+        if not result.valid or result.data.get('confirm') != self.id:
             return False
         self.confirmed = True
         db.session.add(self)
         return True
 
     def generate_reset_token(self, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
-        return s.dumps({'reset': self.id})
+        return tokens.dumps({'reset': self.id}, expiration, single_use=True)
 
     def reset_password(self, token, new_password):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
+        result = tokens.loads(token)
+        if not result.valid or result.data.get('reset') != self.id:
             return False
-        if data.get('reset') != self.id:
+        if not token_ledger.consume(result.data.get('jti'), result.expires):
             return False
         self.password = new_password
         db.session.add(self)
         return True
 
     def generate_email_change_token(self, new_email, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
-        return s.dumps({'change_email': self.id, 'new_email': new_email})
+        return tokens.dumps({'change_email': self.id, 'new_email': new_email},
+                            expiration, single_use=True)
 
     def change_email(self, token):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
-            return False
-        if data.get('change_email') != self.id:
+        result = tokens.loads(token)
+        if not result.valid or result.data.get('change_email') != self.id:
             return False
-        new_email = data.get('new_email')
+        new_email = result.data.get('new_email')
         if new_email is None:
             return False
-        if self.query.filter_by(email=new_email).first() is not None:
+        if User.taken(email=new_email):
+            return False
+        if not token_ledger.consume(result.data.get('jti'), result.expires):
             return False
         self.email = new_email
         db.session.add(self)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # Another change took the address after the check above; the
+            # unique index has the last word, as in register().
+            db.session.rollback()
+            return False
         return True
 
     def __repr__(self):
         return '<User %r>' % self.username
 
+# Outgoing mail is stored in the database until a worker started with
+# 'manage.py mail run' delivers it. Messages that keep failing are moved to
+# the dead letter table, where they can be inspected and requeued.
+class OutgoingMail(db.Model):
+    __tablename__ = 'mail_queue'
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(128))
+    recipients = db.Column(db.Text)
+    subject = db.Column(db.String(256))
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    template = db.Column(db.String(128))
+    context = db.Column(db.Text)
+    base_url = db.Column(db.String(256))
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow,
+                                index=True)
+    claimed_by = db.Column(db.String(64), index=True)
+    claimed_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return '<OutgoingMail %r>' % self.subject
+
+
+class DeadMail(db.Model):
+    __tablename__ = 'mail_dead_letters'
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(128))
+    recipients = db.Column(db.Text)
+    subject = db.Column(db.String(256))
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    template = db.Column(db.String(128))
+    context = db.Column(db.Text)
+    base_url = db.Column(db.String(256))
+    attempts = db.Column(db.Integer)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    failed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<DeadMail %r>' % self.subject
+
+
+# Security events from the auth views, written in batches by app/audit.py.
+# Lookups are for one account or address over a recent stretch of time, so
+# the indexes end with created_at and such a query reads only the newest
+# slice of one index range.
+class AuditEvent(db.Model):
+    __tablename__ = 'audit_events'
+    __table_args__ = (
+        db.Index('ix_audit_events_email_created', 'email', 'success',
+                 'created_at'),
+        db.Index('ix_audit_events_ip_created', 'ip', 'success',
+                 'created_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    event = db.Column(db.String(32))
+    success = db.Column(db.Boolean)
+    user_id = db.Column(db.Integer)
+    email = db.Column(db.String(64))
+    ip = db.Column(db.String(45))
+    detail = db.Column(db.String(128))
+
+    def __repr__(self):
+        return '<AuditEvent %r %r>' % (self.event, self.email)
+
+
+# The ids of single-use tokens that have been used, kept until the token
+# would have expired anyway. The primary key makes recording a token a
+# unique insert, so of two requests racing with the same token only one
+# can commit. See app/ledger.py.
+class ConsumedToken(db.Model):
+    __tablename__ = 'consumed_tokens'
+    jti = db.Column(db.String(24), primary_key=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return '<ConsumedToken %r>' % self.jti
+
+
 # For consistency, a custom AnonymousUser class that implements the can()
 # and is_administrator() methods is created. This object inherits from Flask-Login's
 # AnonymousUserMixin class and is registered as the class of the object that is assigned
@@ -151,6 +295,90 @@ class AnonymousUser(AnonymousUserMixin):
 
 login_manager.anonymous_user = AnonymousUser
 
+
+
+# The user loader runs on every authenticated request. The user row is
+# cached as a plain column dictionary, and rebuilt into a persistent
+# instance with merge(load=False), which attaches it to the session without
+# emitting a SELECT. Only its role_id is needed: can() finds the permissions
+# in the role table, so user.role is left to load lazily if it is used.
+def _cache_key(obj):
+    return '%s:%d' % (obj.__tablename__, obj.id)
+
+
+def version_key(user_id):
+    return 'user-version:%d' % user_id
+
+
+def _snapshot(obj):
+    return dict((attr.key, getattr(obj, attr.key))
+                for attr in obj.__mapper__.column_attrs)
+
+
+def _restore(model, row):
+    obj = model.__mapper__.class_manager.new_instance()
+    for key, value in row.items():
+        set_committed_value(obj, key, value)
+    make_transient_to_detached(obj)
+    return db.session.merge(obj, load=False)
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    row = user_cache.get('users:%d' % user_id)
+    if row is None:
+        user = User.query.get(user_id)
+        if user is not None:
+            user_cache.set(_cache_key(user), _snapshot(user))
+            user_cache.set(version_key(user.id), user.version)
+        return user
+    return _restore(User, row)
+
+
+@event.listens_for(Session, 'before_flush')
+def _bump_user_versions(session, flush_context, instances):
+    for obj in session.dirty:
+        if isinstance(obj, User) and \
+                session.is_modified(obj, include_collections=False):
+            obj.version = (obj.version or 0) + 1
+
+
+# Cached rows are invalidated once a change to them is committed, so
+# confirm(), change_email(), reset_password() and role edits are all seen
+# by the next request. Keys are collected at flush time and only dropped
+# after the commit succeeds, when the new version of each changed user is
+# stored for the session claims to be checked against.
+@event.listens_for(Session, 'after_flush')
+def _collect_stale_keys(session, flush_context):
+    stale = session.info.setdefault('user_cache_stale', set())
+    versions = session.info.setdefault('user_versions', {})
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            stale.add(_cache_key(obj))
+            versions[obj.id] = obj.version if obj in session.dirty else None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Role):
+            session.info['roles_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_stale_keys(session):
+    stale = session.info.pop('user_cache_stale', None)
+    if stale:
+        user_cache.invalidate(*stale)
+    for user_id, version in session.info.pop('user_versions', {}).items():
+        if version is None:
+            user_cache.invalidate(version_key(user_id))
+        else:
+            user_cache.set(version_key(user_id), version)
+    if session.info.pop('roles_changed', False):
+        user_cache.bump_version('roles')
+        g.pop('role_table', None)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_stale_keys(session, previous_transaction):
+    session.info.pop('user_cache_stale', None)
+    session.info.pop('user_versions', None)
+    session.info.pop('roles_changed', None)
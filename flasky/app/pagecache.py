@@ -0,0 +1,176 @@
+import hashlib
+import os
+import time
+from flask import current_app, g, request, session
+from flask_wtf.csrf import generate_csrf
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+from .cache import SimpleBackend
+from .metrics import Counter
+
+page_cache_hits = Counter('flasky_page_cache_hits_total',
+                          'Pages served from the page cache.')
+page_cache_misses = Counter('flasky_page_cache_misses_total',
+                            'Cacheable pages that had to be rendered.')
+
+# Stands in for the CSRF token in cached pages; every response gets a fresh
+# token in its place.
+CSRF_PLACEHOLDER = b'<!--flasky-csrf-token-->'
+
+
+class CachedPage:
+    __slots__ = ('body', 'status', 'mimetype', 'etag', 'last_modified',
+                 'has_csrf')
+
+    def __init__(self, body, status, mimetype, has_csrf):
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.has_csrf = has_csrf
+        self.etag = hashlib.md5(body).hexdigest()
+        self.last_modified = int(time.time())
+
+
+def _is_anonymous():
+    # Decided from the session alone, without loading the user. Pages with
+    # flashed messages are personal too.
+    config = current_app.config
+    return 'user_id' not in session and '_flashes' not in session and \
+        config.get('REMEMBER_COOKIE_NAME', 'remember_token') \
+        not in request.cookies
+
+
+def _cache_key():
+    if request.method not in ('GET', 'HEAD') or not _is_anonymous():
+        return None
+    if request.endpoint in current_app.config['FLASKY_PAGE_CACHE_ENDPOINTS']:
+        return 'page:' + request.full_path
+    if isinstance(request.routing_exception, NotFound):
+        return 'status:404'
+    return None
+
+
+# Whole pages for anonymous visitors to FLASKY_PAGE_CACHE_ENDPOINTS, and the
+# 404 page, are kept for FLASKY_PAGE_CACHE_TTL seconds. The lookup runs
+# before every other before_request handler, so a cached page is served
+# without the confirmation check in auth or loading the user. The CSRF
+# token in a cached form is replaced by a fresh one per response; those
+# pages are not answered with 304, so the browser never reuses an old token.
+#
+# Static files are linked with a hash of their content in the URL, which
+# lets them be cached by browsers for FLASKY_STATIC_MAX_AGE seconds.
+class PageCache:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_PAGE_CACHE', False)
+        app.config.setdefault('FLASKY_PAGE_CACHE_TTL', 60)
+        app.config.setdefault('FLASKY_PAGE_CACHE_SIZE', 256)
+        app.config.setdefault('FLASKY_PAGE_CACHE_ENDPOINTS',
+                              ['main.index', 'auth.login', 'auth.register'])
+        app.config.setdefault('FLASKY_STATIC_MAX_AGE', 0)
+        if app.config['FLASKY_STATIC_MAX_AGE']:
+            app.extensions['static_hashes'] = {}
+            app.url_defaults(self.static_version)
+            app.after_request(self.cache_static)
+        if not app.config['FLASKY_PAGE_CACHE']:
+            return
+        app.extensions['page_cache'] = SimpleBackend(
+            app.config['FLASKY_PAGE_CACHE_SIZE'],
+            app.config['FLASKY_PAGE_CACHE_TTL'])
+        app.before_request_funcs.setdefault(None, []).insert(
+            0, self.serve_cached)
+        app.after_request(self.store_page)
+
+    @property
+    def backend(self):
+        return current_app.extensions['page_cache']
+
+    def clear(self):
+        self.backend.clear()
+
+    def serve_cached(self):
+        key = _cache_key()
+        if key is None:
+            return
+        page = self.backend.get(key)
+        if page is None:
+            g.page_cache_key = key
+            page_cache_misses.inc()
+            return
+        page_cache_hits.inc()
+        response = current_app.response_class(status=page.status,
+                                              mimetype=page.mimetype)
+        if page.has_csrf:
+            response.set_data(page.body.replace(CSRF_PLACEHOLDER,
+                                                generate_csrf().encode()))
+            response.cache_control.no_cache = True
+            return response
+        response.set_data(page.body)
+        response.set_etag(page.etag)
+        response.last_modified = page.last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = 0
+        return response.make_conditional(request)
+
+    def store_page(self, response):
+        key = g.pop('page_cache_key', None)
+        if key is None or response.status_code not in (200, 404) or \
+                response.direct_passthrough or '_flashes' in session:
+            return response
+        body = response.get_data()
+        token = g.get('csrf_token')
+        has_csrf = token is not None and token.encode() in body
+        if has_csrf:
+            body = body.replace(token.encode(), CSRF_PLACEHOLDER)
+        page = CachedPage(body, response.status_code, response.mimetype,
+                          has_csrf)
+        self.backend.set(key, page)
+        if not has_csrf:
+            response.set_etag(page.etag)
+            response.last_modified = page.last_modified
+        return response
+
+    @staticmethod
+    def static_hash(filename):
+        """Return the version of a static file, which is a hash of its
+        content, or None if there is no such file. Hashes are kept until
+        the file is modified."""
+        hashes = current_app.extensions['static_hashes']
+        path = safe_join(current_app.static_folder, filename)
+        try:
+            mtime = os.stat(path).st_mtime
+        except (TypeError, OSError):
+            return None
+        entry = hashes.get(filename)
+        if entry is None or entry[0] != mtime:
+            try:
+                with open(path, 'rb') as f:
+                    entry = hashes[filename] = \
+                        (mtime, hashlib.md5(f.read()).hexdigest()[:12])
+            except IOError:
+                return None
+        return entry[1]
+
+    @classmethod
+    def static_version(cls, endpoint, values):
+        if endpoint != 'static' or 'filename' not in values:
+            return
+        version = cls.static_hash(values['filename'])
+        if version is not None:
+            values.setdefault('v', version)
+
+    # Only a URL carrying the current version may be cached for good; an
+    # old or made up one could otherwise pin whatever is served today.
+    @classmethod
+    def cache_static(cls, response):
+        if request.endpoint == 'static' and 'v' in request.args and \
+                response.status_code in (200, 304) and \
+                request.args['v'] == cls.static_hash(
+                    request.view_args['filename']):
+            response.cache_control.public = True
+            response.cache_control.max_age = \
+                current_app.config['FLASKY_STATIC_MAX_AGE']
+        return response
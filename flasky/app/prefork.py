@@ -0,0 +1,281 @@
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from werkzeug.serving import BaseWSGIServer
+
+FD_ENV = 'FLASKY_SERVE_FD'
+OLD_WORKERS_ENV = 'FLASKY_SERVE_OLD_WORKERS'
+
+
+def log(message, *args):
+    sys.stderr.write('[%s] [%d] %s\n' % (time.strftime('%H:%M:%S'),
+                                         os.getpid(), message % args))
+    sys.stderr.flush()
+
+
+def memory_usage(pid):
+    """Return the rss, pss, shared and private memory of a process in kB,
+    from /proc/<pid>/smaps_rollup, or None if it cannot be read."""
+    usage = {}
+    try:
+        with open('/proc/%d/smaps_rollup' % pid) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 3 and fields[2] == 'kB':
+                    usage[fields[0].rstrip(':')] = int(fields[1])
+    except (IOError, OSError):
+        return None
+    return {'rss': usage.get('Rss', 0), 'pss': usage.get('Pss', 0),
+            'shared': usage.get('Shared_Clean', 0) +
+            usage.get('Shared_Dirty', 0),
+            'private': usage.get('Private_Clean', 0) +
+            usage.get('Private_Dirty', 0)}
+
+
+def check_config(settings, workers):
+    """Raise ValueError if settings keep state that the workers would need
+    to share in each process, where it is lost when a worker is replaced or
+    goes stale when another worker changes it."""
+    if settings.FLASKY_SESSION_BACKEND == 'sqlite' and \
+            settings.FLASKY_SESSION_SQLITE_PATH == ':memory:':
+        raise ValueError('Sessions in an in-memory SQLite database are not '
+                         'shared between workers; set '
+                         'FLASKY_SESSION_SQLITE_PATH to a file or use the '
+                         'redis backend')
+    # A cached user is only invalidated in the worker that changed it.
+    if workers > 1 and settings.FLASKY_USER_CACHE_TYPE == 'simple':
+        raise ValueError('The simple user cache is not shared between '
+                         'workers; set FLASKY_USER_CACHE_TYPE to redis, or '
+                         'to null to cache no users, or serve with one '
+                         'worker')
+    # Each worker would count attempts on its own, so a client gets the
+    # configured number of attempts once per worker.
+    if workers > 1 and settings.FLASKY_RATELIMIT_ENABLED and \
+            settings.FLASKY_RATELIMIT_BACKEND == 'local':
+        log('WARNING: the local rate limiter counts in each worker, so the '
+            'limits are %d times the configured ones; set '
+            'FLASKY_RATELIMIT_BACKEND to redis to share the counts', workers)
+
+
+# The hashing processes, FLASKY_HASH_WORKERS in all, are divided between
+# the workers.
+def share_between_workers(app, workers):
+    from . import password_hasher
+    if workers < 2:
+        return
+    if app.config['FLASKY_HASH_WORKERS']:
+        app.config['FLASKY_HASH_WORKERS'] = \
+            max(1, app.config['FLASKY_HASH_WORKERS'] // workers)
+        password_hasher.init_app(app)
+
+
+def load_app(config_name, workers=1):
+    """Build the application with every blueprint registered and every
+    template compiled, as the master does before forking."""
+    from . import create_app, db, template_cache
+    app = create_app(config_name, lazy=False)
+    share_between_workers(app, workers)
+    template_cache.warm_up(app)
+    db.dispose_engines(app)
+    return app
+
+
+class _WorkerServer(BaseWSGIServer):
+    served = 0
+
+    def finish_request(self, request, client_address):
+        try:
+            BaseWSGIServer.finish_request(self, request, client_address)
+        finally:
+            self.served += 1
+
+
+class Worker:
+    def __init__(self, server, app):
+        self.server = server
+        self.app = app
+        self.alive = True
+        self.max_requests = server.max_requests + \
+            random.randint(0, server.max_requests_jitter)
+
+    def stop(self, signum, frame):
+        self.alive = False
+
+    def run(self):
+        from . import audit_log, db
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        app = self.app
+        if app is None:
+            app = load_app(self.server.config_name, self.server.num_workers)
+        db.dispose_engines(app)
+        httpd = _WorkerServer(self.server.host, self.server.port, app,
+                              fd=self.server.socket.fileno())
+        # Woken up at least once a second to notice signals.
+        httpd.timeout = 1.0
+        while self.alive and httpd.served < self.max_requests:
+            httpd.handle_request()
+        httpd.socket.close()
+        # Workers leave with os._exit(), which skips atexit handlers.
+        with app.app_context():
+            audit_log.flush()
+        if self.alive:
+            log('served %d requests, recycling', httpd.served)
+
+
+# The master builds the application once, registers every blueprint,
+# compiles every template and freezes the garbage collector before forking,
+# so the workers share those pages with it copy-on-write instead of each
+# holding its own copy. With preload=False every worker builds its own
+# application, which is what the shared pages are measured against. No
+# database connection is open at fork time, and each worker builds its own
+# engines.
+#
+# A worker exits after max_requests requests (plus a random jitter, so they
+# do not all restart together) and is replaced. SIGTERM or SIGINT stop the
+# server once every worker has finished its current request. SIGHUP reloads
+# the code by executing the master again: the listening socket is passed on,
+# the new workers start serving, and only then are the old ones stopped, so
+# no connection is refused. SIGUSR1 prints the memory of every worker.
+class PreforkServer:
+    def __init__(self, config_name, host='127.0.0.1', port=5000, workers=None,
+                 max_requests=1000, max_requests_jitter=50, preload=True,
+                 memory_report=0):
+        self.config_name = config_name
+        self.host = host
+        self.port = port
+        self.num_workers = workers or os.cpu_count()
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.preload = preload
+        self.memory_report = memory_report
+        self.workers = {}
+        self.app = None
+        self.socket = None
+        self.signals = []
+
+    def listen(self):
+        fd = os.environ.pop(FD_ENV, None)
+        if fd is not None:
+            self.socket = socket.socket(fileno=int(fd))
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind((self.host, self.port))
+            self.socket.listen(128)
+        # Idle workers all wait on the socket; those that lose the race for
+        # a connection go back to waiting instead of blocking in accept().
+        self.socket.setblocking(False)
+        self.host, self.port = self.socket.getsockname()[:2]
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.time()
+            return pid
+        status = 0
+        try:
+            Worker(self, self.app).run()
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            status = 1
+        finally:
+            os._exit(status)
+
+    def run(self):
+        from config import config
+        check_config(config[self.config_name], self.num_workers)
+        self.listen()
+        if self.preload:
+            self.app = load_app(self.config_name, self.num_workers)
+            gc.collect()
+            gc.freeze()
+        old_workers = [int(pid) for pid in
+                       os.environ.pop(OLD_WORKERS_ENV, '').split(',') if pid]
+        for name in ('SIGTERM', 'SIGINT', 'SIGHUP', 'SIGUSR1'):
+            signal.signal(getattr(signal, name), self.handle_signal)
+        log('listening on http://%s:%d with %d workers%s', self.host,
+            self.port, self.num_workers, '' if self.preload else
+            ' (no preload)')
+        for i in range(self.num_workers):
+            self.spawn()
+        for pid in old_workers:
+            self.kill(pid, signal.SIGTERM)
+        last_report = time.time()
+        while True:
+            while self.signals:
+                signum = self.signals.pop(0)
+                if signum == signal.SIGHUP:
+                    self.reload()
+                elif signum == signal.SIGUSR1:
+                    self.report()
+                else:
+                    return self.stop()
+            self.reap()
+            while len(self.workers) < self.num_workers:
+                self.spawn()
+            if self.memory_report and \
+                    time.time() - last_report >= self.memory_report:
+                last_report = time.time()
+                self.report()
+            time.sleep(0.5)
+
+    def handle_signal(self, signum, frame):
+        self.signals.append(signum)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            self.workers.pop(pid, None)
+
+    @staticmethod
+    def kill(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def stop(self, timeout=30):
+        log('stopping %d workers', len(self.workers))
+        for pid in self.workers:
+            self.kill(pid, signal.SIGTERM)
+        deadline = time.time() + timeout
+        while self.workers and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in self.workers:
+            self.kill(pid, signal.SIGKILL)
+        self.socket.close()
+
+    def reload(self):
+        log('reloading')
+        os.set_inheritable(self.socket.fileno(), True)
+        os.environ[FD_ENV] = str(self.socket.fileno())
+        os.environ[OLD_WORKERS_ENV] = ','.join(str(pid)
+                                               for pid in self.workers)
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def report(self):
+        rows = [(pid, memory_usage(pid)) for pid in sorted(self.workers)]
+        rows = [(pid, usage) for pid, usage in rows if usage is not None]
+        if not rows:
+            return
+        log('%8s %10s %10s %10s %10s', 'pid', 'rss kB', 'pss kB',
+            'shared kB', 'private kB')
+        for pid, usage in rows:
+            log('%8d %10d %10d %10d %10d', pid, usage['rss'], usage['pss'],
+                usage['shared'], usage['private'])
+        log('%8s %10d %10d', 'total', sum(u['rss'] for p, u in rows),
+            sum(u['pss'] for p, u in rows))
@@ -0,0 +1,139 @@
+import time
+from flask import current_app
+from .metrics import Counter
+
+ratelimit_rejected = Counter('flasky_ratelimit_rejected_total',
+                             'Requests rejected by the rate limiter.')
+
+
+# Both backends implement a sliding window counter: the count for the
+# previous fixed window is weighted by how much of it still overlaps the
+# sliding window and added to the count for the current one. Each key
+# needs only two counters, however many requests it sees.
+def _estimate(previous, current, now, window):
+    return previous * (1 - (now % window) / window) + current
+
+
+class LocalBackend:
+    """Counters kept in sharded dictionaries inside the process.
+
+    Updates take no locks. Under contention an increment can be lost, which
+    only makes the limiter slightly more lenient; in exchange, checking a
+    key never blocks the request. Each shard drops stale keys when it grows
+    past max_keys.
+    """
+    def __init__(self, shards=64, max_keys=10000):
+        self.max_keys = max_keys
+        self._shards = [{} for i in range(shards)]
+
+    def _entry(self, key, window, now):
+        shard = self._shards[hash(key) % len(self._shards)]
+        index = int(now // window)
+        entry = shard.get(key)
+        if entry is None or entry[0] < index - 1:
+            if len(shard) >= self.max_keys:
+                self._sweep(shard, index)
+            entry = shard[key] = [index, 0, 0]
+        elif entry[0] == index - 1:
+            entry[:] = [index, entry[2], 0]
+        return entry
+
+    @staticmethod
+    def _sweep(shard, index):
+        for key, entry in list(shard.items()):
+            if entry[0] < index - 1:
+                shard.pop(key, None)
+
+    def hit(self, key, window):
+        now = time.time()
+        entry = self._entry(key, window, now)
+        entry[2] += 1
+        return _estimate(entry[1], entry[2], now, window)
+
+    def count(self, key, window):
+        now = time.time()
+        entry = self._entry(key, window, now)
+        return _estimate(entry[1], entry[2], now, window)
+
+    def reset(self, key, window):
+        self._shards[hash(key) % len(self._shards)].pop(key, None)
+
+    def clear(self):
+        for shard in self._shards:
+            shard.clear()
+
+
+class RedisBackend:
+    def __init__(self, url, prefix='flasky:ratelimit:'):
+        import redis
+        self.prefix = prefix
+        self._redis = redis.StrictRedis.from_url(url)
+
+    def _counts(self, key, window, increment):
+        now = time.time()
+        index = int(now // window)
+        current = '%s%s:%d' % (self.prefix, key, index)
+        pipe = self._redis.pipeline()
+        pipe.get('%s%s:%d' % (self.prefix, key, index - 1))
+        if increment:
+            pipe.incr(current)
+            pipe.expire(current, 2 * window)
+        else:
+            pipe.get(current)
+        result = pipe.execute()
+        return _estimate(int(result[0] or 0), int(result[1] or 0), now,
+                         window)
+
+    def hit(self, key, window):
+        return self._counts(key, window, True)
+
+    def count(self, key, window):
+        return self._counts(key, window, False)
+
+    def reset(self, key, window):
+        # Only the current and the previous window can hold a count.
+        index = int(time.time() // window)
+        self._redis.delete('%s%s:%d' % (self.prefix, key, index),
+                           '%s%s:%d' % (self.prefix, key, index - 1))
+
+    def clear(self):
+        for key in self._redis.scan_iter(self.prefix + '*'):
+            self._redis.delete(key)
+
+
+class RateLimiter:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_RATELIMIT_ENABLED', True)
+        app.config.setdefault('FLASKY_RATELIMIT_BACKEND', 'local')
+        app.config.setdefault('FLASKY_RATELIMIT_REDIS_URL', None)
+        app.config.setdefault('FLASKY_RATELIMIT_WINDOW', 60)
+        app.config.setdefault('FLASKY_RATELIMIT_PER_IP', 20)
+        app.config.setdefault('FLASKY_RATELIMIT_PER_ACCOUNT', 5)
+        if app.config['FLASKY_RATELIMIT_BACKEND'] == 'redis':
+            backend = RedisBackend(app.config['FLASKY_RATELIMIT_REDIS_URL'])
+        else:
+            backend = LocalBackend()
+        app.extensions['ratelimit'] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions['ratelimit']
+
+    def hit(self, key, limit):
+        """Count a request for key and return True if it is over the limit."""
+        window = current_app.config['FLASKY_RATELIMIT_WINDOW']
+        if self.backend.hit(key, window) > limit:
+            ratelimit_rejected.inc()
+            return True
+        return False
+
+    def reset(self, key):
+        window = current_app.config['FLASKY_RATELIMIT_WINDOW']
+        self.backend.reset(key, window)
+
+    def clear(self):
+        self.backend.clear()
@@ -0,0 +1,243 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from flask import session as current_session
+from flask.sessions import SessionInterface, SessionMixin
+from flask_login import user_logged_in, user_logged_out
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+from .cache import NullBackend, SimpleBackend
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, expires=None):
+        def on_update(self):
+            self.modified = True
+        super(ServerSession, self).__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires = expires
+        self.modified = False
+        self.previous_sid = None
+
+
+# Stores keep pickled session data with an absolute expiry time, and need
+# get(), set(), delete() and sweep(). A store is shared when other processes
+# can change it: the SQLite store is local to the machine but a file is
+# shared by every worker on it, and the Redis store can be shared by
+# several servers.
+class SQLiteStore:
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if path != ':memory:' and directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.shared = path != ':memory:'
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connect()
+
+    def _connect(self):
+        self._pid = os.getpid()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False,
+                                     isolation_level=None)
+        if self.path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, '
+            'data BLOB NOT NULL, expires REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS '
+                           'ix_sessions_expires ON sessions (expires)')
+
+    # Used with the lock held. A forked worker opens its own connection
+    # instead of sharing the one it inherited.
+    @property
+    def conn(self):
+        if self._pid != os.getpid():
+            self._connect()
+        return self._conn
+
+    def get(self, sid):
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT data, expires FROM sessions WHERE id = ?',
+                (sid,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0], row[1]
+
+    def set(self, sid, data, expires):
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO sessions (id, data, expires) '
+                'VALUES (?, ?, ?)', (sid, data, expires))
+
+    def delete(self, sid):
+        with self._lock:
+            self.conn.execute('DELETE FROM sessions WHERE id = ?', (sid,))
+
+    def sweep(self, now):
+        with self._lock:
+            return self.conn.execute(
+                'DELETE FROM sessions WHERE expires < ?', (now,)).rowcount
+
+
+class RedisStore:
+    shared = True
+
+    def __init__(self, url, prefix='flasky:session:'):
+        import redis
+        self.prefix = prefix
+        self._redis = redis.StrictRedis.from_url(url)
+
+    def get(self, sid):
+        pipe = self._redis.pipeline()
+        pipe.get(self.prefix + sid)
+        pipe.ttl(self.prefix + sid)
+        data, ttl = pipe.execute()
+        if data is None:
+            return None
+        return data, time.time() + ttl
+
+    def set(self, sid, data, expires):
+        self._redis.setex(self.prefix + sid,
+                          max(1, int(expires - time.time())), data)
+
+    def delete(self, sid):
+        self._redis.delete(self.prefix + sid)
+
+    def sweep(self, now):
+        # Redis expires the keys itself.
+        return 0
+
+
+# Only a signed, random session id is sent to the client. The session data
+# is pickled into the store. With a store no other process writes to,
+# recently used sessions are also kept in an in-process LRU cache for
+# FLASKY_SESSION_CACHE_TTL seconds; in front of a shared store the cache
+# could keep serving a session another process has logged out, so there is
+# none. A session is only written when it changes, or when less than half
+# of its lifetime is left, and a changed session is only written back if
+# the store still has it. Logging in or out moves the session to a new id
+# and deletes the old record, so an id known before either stops working.
+# Expired sessions are swept from the store every
+# FLASKY_SESSION_SWEEP_INTERVAL seconds by whichever request saves a
+# session next.
+class ServerSessionInterface(SessionInterface):
+    salt = 'flasky-session'
+
+    def __init__(self, store, cache, sweep_interval):
+        self.store = store
+        self.cache = cache
+        self.sweep_interval = sweep_interval
+        self.last_sweep = time.time()
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(app.session_cookie_name)
+        if cookie:
+            try:
+                sid = Signer(app.secret_key, salt=self.salt).unsign(
+                    cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid is not None:
+                record = self.cache.get(sid) or self.store.get(sid)
+                if record is not None and record[1] >= time.time():
+                    self.cache.set(sid, record)
+                    return ServerSession(pickle.loads(record[0]), sid=sid,
+                                         expires=record[1])
+        return ServerSession(sid=uuid.uuid4().hex, new=True)
+
+    @staticmethod
+    def rotate(session):
+        if not session.new:
+            session.previous_sid = session.sid
+        session.sid = uuid.uuid4().hex
+        session.new = True
+        session.modified = True
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+            self.cache.delete(session.previous_sid)
+        if not session.new and session.modified and \
+                self.store.get(session.sid) is None:
+            # Deleted by another request, such as a logout, since it was
+            # opened: writing it back would bring it back to life.
+            self.cache.delete(session.sid)
+            response.delete_cookie(app.session_cookie_name,
+                                   domain=domain, path=path)
+            return
+        if not session:
+            if session.modified:
+                if not session.new:
+                    self.store.delete(session.sid)
+                    self.cache.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
+            return
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        if session.modified or session.expires is None or \
+                session.expires - now < lifetime / 2:
+            session.expires = now + lifetime
+            record = (pickle.dumps(dict(session), pickle.HIGHEST_PROTOCOL),
+                      session.expires)
+            self.store.set(session.sid, *record)
+            self.cache.set(session.sid, record)
+            if now - self.last_sweep > self.sweep_interval:
+                self.last_sweep = now
+                self.store.sweep(now)
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                app.session_cookie_name,
+                Signer(app.secret_key, salt=self.salt).sign(
+                    session.sid.encode()).decode(),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app), domain=domain,
+                path=path, secure=self.get_cookie_secure(app))
+
+
+def _rotate_session(app, **extra):
+    if isinstance(app.session_interface, ServerSessionInterface):
+        app.session_interface.rotate(current_session._get_current_object())
+
+
+# FLASKY_SESSION_BACKEND is 'cookie' (Flask's signed cookie sessions),
+# 'sqlite' or 'redis'.
+class ServerSessions:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_SESSION_BACKEND', 'cookie')
+        app.config.setdefault('FLASKY_SESSION_SQLITE_PATH', ':memory:')
+        app.config.setdefault('FLASKY_SESSION_REDIS_URL', None)
+        app.config.setdefault('FLASKY_SESSION_CACHE_SIZE', 10000)
+        app.config.setdefault('FLASKY_SESSION_CACHE_TTL', 5)
+        app.config.setdefault('FLASKY_SESSION_SWEEP_INTERVAL', 300)
+        backend = app.config['FLASKY_SESSION_BACKEND']
+        if backend == 'cookie':
+            return
+        if backend == 'sqlite':
+            store = SQLiteStore(app.config['FLASKY_SESSION_SQLITE_PATH'])
+        elif backend == 'redis':
+            store = RedisStore(app.config['FLASKY_SESSION_REDIS_URL'])
+        else:
+            raise ValueError('Unknown session backend %r' % backend)
+        if store.shared:
+            cache = NullBackend()
+        else:
+            cache = SimpleBackend(app.config['FLASKY_SESSION_CACHE_SIZE'],
+                                  app.config['FLASKY_SESSION_CACHE_TTL'])
+        app.session_interface = ServerSessionInterface(
+            store, cache, app.config['FLASKY_SESSION_SWEEP_INTERVAL'])
+        user_logged_in.connect(_rotate_session, app)
+        user_logged_out.connect(_rotate_session, app)
@@ -0,0 +1,39 @@
+import os
+from jinja2 import FileSystemBytecodeCache
+
+
+# Every page extends base.html, which extends Flask-Bootstrap's
+# bootstrap/base.html, so the first page a new worker renders parses and
+# compiles the whole chain. With FLASKY_TEMPLATE_CACHE_DIR set, compiled
+# templates are written there and later workers only load the bytecode; a
+# template whose source changes gets a new entry. FLASKY_TEMPLATE_WARMUP
+# compiles every template the application can render as soon as the views
+# are loaded, so no request pays for it. It is skipped with lazy loading,
+# where it would only move the cost onto the first request.
+class TemplateCache:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_TEMPLATE_CACHE_DIR', None)
+        app.config.setdefault('FLASKY_TEMPLATE_WARMUP', False)
+        directory = app.config['FLASKY_TEMPLATE_CACHE_DIR']
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(directory)
+            app.jinja_options = dict(app.jinja_options,
+                                     bytecode_cache=bytecode_cache)
+            # The options only apply to an environment created from now on.
+            if 'jinja_env' in app.__dict__:
+                app.jinja_env.bytecode_cache = bytecode_cache
+
+    @staticmethod
+    def warm_up(app):
+        """Compile the templates of the application and of its blueprints
+        (Flask-Bootstrap's included) and return their names."""
+        env = app.jinja_env
+        names = env.list_templates()
+        for name in names:
+            env.get_template(name)
+        return names
@@ -0,0 +1,97 @@
+import binascii
+import os
+import time
+from collections import namedtuple
+from flask import current_app
+from itsdangerous import TimedJSONWebSignatureSerializer, BadData, \
+    SignatureExpired
+
+VALID = 'valid'
+EXPIRED = 'expired'
+BAD_SIGNATURE = 'bad_signature'
+
+
+class TokenResult(namedtuple('TokenResult', ['status', 'data', 'expires'])):
+    @property
+    def valid(self):
+        return self.status == VALID
+
+
+# itsdangerous derives the signing key from the secret every time a token is
+# signed or checked. This serializer derives it once, builds its signer once
+# and reads the time from an injectable clock, so tests can move time
+# forward instead of sleeping.
+class _Serializer(TimedJSONWebSignatureSerializer):
+    def __init__(self, secret_key, expires_in=None, clock=time.time):
+        super(_Serializer, self).__init__(secret_key, expires_in)
+        self.clock = clock
+        signer = super(_Serializer, self).make_signer()
+        self._signer = self.signer(signer.derive_key(), salt=self.salt,
+                                   sep='.', key_derivation='none',
+                                   algorithm=self.algorithm)
+
+    # dumps() and loads() pass the serializer's own algorithm.
+    def make_signer(self, salt=None, algorithm=None):
+        if salt in (None, self.salt) and algorithm in (None, self.algorithm):
+            return self._signer
+        return super(_Serializer, self).make_signer(salt, algorithm)
+
+    def now(self):
+        return int(self.clock())
+
+
+class _TokenState:
+    def __init__(self, secrets, clock):
+        self.secrets = secrets
+        self.clock = clock
+        self.serializers = {}
+
+    def serializer(self, secret, expires_in=None):
+        key = (secret, expires_in)
+        s = self.serializers.get(key)
+        if s is None:
+            s = self.serializers[key] = _Serializer(secret, expires_in,
+                                                    clock=self.clock)
+        return s
+
+
+# Tokens are signed with the first secret in FLASKY_TOKEN_SECRETS and
+# accepted if any of them verifies, which allows keys to be rotated without
+# invalidating tokens already sent out. SECRET_KEY is used when no token
+# secrets are configured. Single-use tokens carry a random 'jti' that the
+# token ledger records when the token is used.
+class TokenService:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, clock=time.time):
+        secrets = app.config.get('FLASKY_TOKEN_SECRETS') or \
+            [app.config['SECRET_KEY']]
+        app.extensions['tokens'] = _TokenState(list(secrets), clock)
+
+    @property
+    def _state(self):
+        return current_app.extensions['tokens']
+
+    def dumps(self, data, expiration=3600, single_use=False):
+        state = self._state
+        if single_use:
+            data = dict(data, jti=binascii.hexlify(os.urandom(12)).decode())
+        # itsdangerous returns bytes; tokens end up in URLs and JSON.
+        return state.serializer(state.secrets[0], expiration).dumps(data) \
+            .decode('ascii')
+
+    def loads(self, token):
+        """Return the status, the payload and the expiry time of token."""
+        state = self._state
+        for secret in state.secrets:
+            try:
+                data, header = state.serializer(secret).loads(
+                    token, return_header=True)
+                return TokenResult(VALID, data, header.get('exp'))
+            except SignatureExpired as e:
+                return TokenResult(EXPIRED, e.payload, None)
+            except BadData:
+                continue
+        return TokenResult(BAD_SIGNATURE, None, None)
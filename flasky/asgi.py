@@ -0,0 +1,10 @@
+"""ASGI entry point, e.g. 'uvicorn asgi:application'. The WSGI entry point
+is unchanged: 'python manage.py runserver' or any WSGI server on
+'manage:app'."""
+import os
+from app import create_app
+from app.asgi import ASGIAdapter
+
+app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+application = ASGIAdapter(app, app.config['FLASKY_ASGI_THREADS'],
+                          app.config['MAX_CONTENT_LENGTH'])
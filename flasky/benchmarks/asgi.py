@@ -0,0 +1,101 @@
+"""A model of how a threaded WSGI server and an ASGI server hold up under
+growing numbers of concurrent clients on a slow network: requests/sec and
+p95 latency with the same number of worker threads (a thread per
+connection for WSGI; for ASGI the event loop holds connections and threads
+only run views).
+
+Only the views are real: every request runs through the application, but
+there are no sockets or server processes. Each client sleeps LATENCY
+seconds to stand for sending its request and as long again for receiving
+the response, which is where a WSGI thread sits idle. The figures show the
+effect of that idle time, not what uvicorn or a WSGI server would measure.
+
+    python -m benchmarks.asgi [requests per client]
+"""
+import asyncio
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app import create_app, db
+from app.asgi import ASGIAdapter, _environ
+from app.models import Role
+
+THREADS = 8
+LATENCY = 0.05
+SCOPE = {'type': 'http', 'method': 'GET', 'path': '/auth/login',
+         'query_string': b'', 'headers': [], 'server': ('localhost', 80),
+         'client': ('127.0.0.1', 0)}
+
+
+def wsgi_round(app, clients, requests):
+    adapter = ASGIAdapter(app.wsgi_app)
+    latencies = []
+    lock = threading.Lock()
+
+    def client():
+        for i in range(requests):
+            start = time.perf_counter()
+            time.sleep(LATENCY)
+            adapter.run_wsgi(_environ(SCOPE, b''))
+            time.sleep(LATENCY)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    with ThreadPoolExecutor(THREADS) as executor:
+        for i in range(clients):
+            executor.submit(client)
+    return latencies
+
+
+def asgi_round(app, clients, requests):
+    adapter = ASGIAdapter(app.wsgi_app, THREADS)
+    latencies = []
+
+    async def receive():
+        await asyncio.sleep(LATENCY)
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        if message['type'] == 'http.response.body':
+            await asyncio.sleep(LATENCY)
+
+    async def client():
+        for i in range(requests):
+            start = time.perf_counter()
+            await adapter(SCOPE, receive, send)
+            latencies.append(time.perf_counter() - start)
+
+    async def main():
+        await asyncio.gather(*[client() for i in range(clients)])
+
+    asyncio.run(main())
+    adapter.executor.shutdown()
+    return latencies
+
+
+def run(requests=5):
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+    app.test_client().get(SCOPE['path'])
+    # WSGI latencies leave out the time a client waits for a free thread,
+    # so req/s is the figure to compare.
+    print('Modelled servers, %.0f ms of network time each way, %d threads' %
+          (LATENCY * 1000, THREADS))
+    print('%-5s %8s %8s %10s' % ('mode', 'clients', 'req/s', 'p95 ms'))
+    for clients in (THREADS, THREADS * 4, THREADS * 16):
+        for mode, round_ in (('wsgi', wsgi_round), ('asgi', asgi_round)):
+            start = time.perf_counter()
+            latencies = round_(app, clients, requests)
+            elapsed = time.perf_counter() - start
+            p95 = statistics.quantiles(latencies, n=20)[-1]
+            print('%-5s %8d %8.1f %10.1f' % (mode, clients,
+                                             len(latencies) / elapsed,
+                                             p95 * 1000))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
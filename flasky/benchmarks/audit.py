@@ -0,0 +1,64 @@
+"""Cost of recording auth events: an INSERT and commit per event against
+the buffered audit log, which only appends to a deque and writes batches
+with one executemany() INSERT and commit each. Runs against a SQLite file,
+so every commit reaches the disk.
+
+    python -m benchmarks.audit [events] [batch_size]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from app import create_app, db, audit_log
+from app.models import AuditEvent
+
+
+def run(events=5000, batch_size=500):
+    tmpdir = tempfile.mkdtemp()
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+        os.path.join(tmpdir, 'audit.sqlite')
+    app.config['FLASKY_AUDIT_BATCH_SIZE'] = batch_size
+    app.config['FLASKY_AUDIT_BUFFER_SIZE'] = events
+    audit_log.init_app(app)
+    try:
+        with app.test_request_context(environ_base={
+                'REMOTE_ADDR': '10.0.0.1'}):
+            db.create_all()
+
+            start = time.time()
+            for i in range(events):
+                db.session.add(AuditEvent(
+                    created_at=datetime.utcnow(), event='login',
+                    success=False, email='user%d@example.com' % (i % 100),
+                    ip='10.0.0.1'))
+                db.session.commit()
+            sync = time.time() - start
+
+            start = time.time()
+            for i in range(events):
+                audit_log.record('login', success=False,
+                                 email='user%d@example.com' % (i % 100))
+            record = time.time() - start
+            start = time.time()
+            audit_log.flush()
+            flush = time.time() - start
+
+            assert AuditEvent.query.count() == 2 * events
+            db.session.remove()
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(tmpdir)
+    print('%-24s %10s %14s' % ('mode', 'total s', 'us per event'))
+    for name, elapsed in (('insert per event', sync),
+                          ('buffered record', record),
+                          ('batched flush', flush),
+                          ('buffered total', record + flush)):
+        print('%-24s %10.3f %14.1f' % (name, elapsed,
+                                       elapsed / events * 1e6))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:3]])
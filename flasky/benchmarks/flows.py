@@ -0,0 +1,206 @@
+"""Throughput and latency of the authentication flows.
+
+Each simulated user registers, logs in, confirms the account, changes the
+password and logs out, against create_app('benchmark'): the production
+settings, on a database file of its own that is recreated for each run.
+Requests go either through the Flask test client or over HTTP to a local
+threaded WSGI server.
+Latency percentiles and requests/sec are reported per endpoint and can be
+saved as JSON and compared with an earlier run:
+
+    python manage.py bench -m server -c 8 -n 25 -o new.json --compare old.json
+"""
+import http.cookiejar
+import json
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from werkzeug.serving import WSGIRequestHandler, make_server
+from app import create_app, db
+from app.models import User, Role
+
+STEPS = ('register', 'login', 'confirm', 'change_password', 'logout')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class ClientSession:
+    """Requests through the Flask test client."""
+    def __init__(self, app, base_url=None):
+        self.client = app.test_client()
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+    def post(self, path, data):
+        return self.client.post(path, data=data).status_code
+
+
+class HTTPSession:
+    """Requests over HTTP, keeping cookies and not following redirects."""
+    def __init__(self, app, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect())
+
+    def open(self, path, data=None):
+        if data is not None:
+            data = urllib.parse.urlencode(data).encode()
+        try:
+            with self.opener.open(self.base_url + path, data) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def get(self, path):
+        return self.open(path)
+
+    def post(self, path, data):
+        return self.open(path, data)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(p / 100.0 * len(values))))]
+
+
+def confirmation_token(app, email):
+    with app.app_context():
+        token = User.query.filter_by(email=email) \
+            .first().generate_confirmation_token()
+        db.session.remove()
+    return token
+
+
+def user_flow(app, session, name, record):
+    email = '%s@example.com' % name
+
+    def step(step_name, func, *args):
+        start = time.perf_counter()
+        status = func(*args)
+        record(step_name, time.perf_counter() - start, status)
+
+    step('register', session.post, '/auth/register', {
+        'email': email, 'username': name,
+        'password': 'cat', 'password2': 'cat'})
+    step('login', session.post, '/auth/login',
+         {'email': email, 'password': 'cat'})
+    step('confirm', session.get,
+         '/auth/confirm/' + confirmation_token(app, email))
+    step('change_password', session.post, '/auth/change-password', {
+        'old_password': 'cat', 'password': 'dog', 'password2': 'dog'})
+    step('logout', session.get, '/auth/logout')
+
+
+def run(mode='client', concurrency=4, iterations=10, output=None,
+        compare=None):
+    app = create_app('benchmark')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        Role.insert_roles()
+        db.session.remove()
+
+    server = None
+    base_url = None
+    session_class = ClientSession
+    if mode == 'server':
+        server = make_server('127.0.0.1', 0, app, threaded=True,
+                             request_handler=_QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = 'http://127.0.0.1:%d' % server.server_port
+        session_class = HTTPSession
+
+    samples = dict((name, []) for name in STEPS)
+    errors = dict((name, 0) for name in STEPS)
+    lock = threading.Lock()
+
+    def record(step_name, elapsed, status):
+        with lock:
+            samples[step_name].append(elapsed)
+            if status >= 400:
+                errors[step_name] += 1
+
+    def worker(n):
+        for i in range(iterations):
+            user_flow(app, session_class(app, base_url), 'u%d_%d' % (n, i),
+                      record)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,))
+               for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    if server is not None:
+        server.shutdown()
+
+    results = {
+        'commit': _git_commit(),
+        'timestamp': time.time(),
+        'mode': mode,
+        'concurrency': concurrency,
+        'iterations': iterations,
+        'wall_time': wall,
+        'endpoints': dict((name, {
+            'requests': len(samples[name]),
+            'errors': errors[name],
+            'p50': percentile(samples[name], 50),
+            'p95': percentile(samples[name], 95),
+            'p99': percentile(samples[name], 99),
+            'rps': len(samples[name]) / wall,
+        }) for name in STEPS)
+    }
+    baseline = None
+    if compare:
+        with open(compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return results
+
+
+def report(results, baseline=None):
+    print('%s mode, concurrency %d, %.2fs' % (
+        results['mode'], results['concurrency'], results['wall_time']))
+    print('%-16s %6s %6s %9s %9s %9s %8s' % (
+        'endpoint', 'reqs', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s'))
+    for name in STEPS:
+        r = results['endpoints'][name]
+        line = '%-16s %6d %6d %9.2f %9.2f %9.2f %8.1f' % (
+            name, r['requests'], r['errors'], r['p50'] * 1000,
+            r['p95'] * 1000, r['p99'] * 1000, r['rps'])
+        if baseline is not None and name in baseline['endpoints']:
+            old = baseline['endpoints'][name]
+            line += '  p95 %+.1f%%  req/s %+.1f%%' % (
+                100.0 * (r['p95'] - old['p95']) / old['p95'],
+                100.0 * (r['rps'] - old['rps']) / old['rps'])
+        print(line)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
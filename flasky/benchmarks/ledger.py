@@ -0,0 +1,92 @@
+"""Memory and lookup cost of the single-use token ledger. Holds the ids
+of used tokens in the Bloom filter, a Python set and the consumed_tokens
+table of a SQLite file, scales memory to a million ids, and times lookups
+of ids that were never used, which is what nearly every check is.
+
+    python -m benchmarks.ledger [ids] [lookups]
+"""
+import binascii
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from app import create_app, db, token_ledger
+from app.ledger import BloomFilter
+from app.models import ConsumedToken
+
+
+def new_jti():
+    return binascii.hexlify(os.urandom(12)).decode()
+
+
+def timed(lookup, keys):
+    start = time.time()
+    for key in keys:
+        lookup(key)
+    return (time.time() - start) / len(keys) * 1e6
+
+
+def run(ids=1000000, lookups=20000):
+    jtis = [new_jti() for i in range(ids)]
+    unused = [new_jti() for i in range(lookups)]
+    scale = 1000000.0 / ids
+
+    tracemalloc.start()
+    f = BloomFilter(ids, 0.01)
+    for jti in jtis:
+        f.add(jti)
+    bloom_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    # New strings, so the set is charged for them as well.
+    ids_set = set(jti.encode().decode() for jti in jtis)
+    set_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tmpdir = tempfile.mkdtemp()
+    app = create_app('testing')
+    path = os.path.join(tmpdir, 'ledger.sqlite')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    try:
+        with app.app_context():
+            ConsumedToken.__table__.create(db.engine)
+            expires_at = datetime.utcfromtimestamp(time.time() + 3600)
+            with db.engine.begin() as conn:
+                conn.execute(ConsumedToken.__table__.insert(),
+                             [{'jti': jti, 'expires_at': expires_at}
+                              for jti in jtis])
+            table_bytes = os.path.getsize(path)
+
+            def select(jti):
+                return db.session.query(ConsumedToken.jti) \
+                    .filter_by(jti=jti).first() is not None
+
+            token_ledger.rebuild()
+            false_positives = sum(jti in f for jti in unused)
+            timings = [('bloom filter', timed(f.__contains__, unused)),
+                       ('python set', timed(ids_set.__contains__, unused)),
+                       ('table select', timed(select, unused)),
+                       ('is_consumed()', timed(token_ledger.is_consumed,
+                                               unused))]
+            db.session.remove()
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print('%d ids, %d hashes, %.2f%% false positives' % (
+        ids, f.hashes, 100.0 * false_positives / lookups))
+    print('%-16s %16s' % ('store', 'MB per million'))
+    for name, size in (('bloom filter', bloom_bytes), ('python set', set_bytes),
+                       ('sqlite table', table_bytes)):
+        print('%-16s %16.1f' % (name, size * scale / 2 ** 20))
+    print('%-16s %16s' % ('lookup', 'us per unused id'))
+    for name, us in timings:
+        print('%-16s %16.2f' % (name, us))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,94 @@
+"""Memory of 'manage.py serve' workers when the app is built once and
+shared copy-on-write (preload) and when every worker builds its own, after
+each has served some requests. RSS counts shared pages in every worker,
+PSS splits them between the processes that share them, so the PSS total
+is the memory the workers really cost.
+
+    python -m benchmarks.prefork [workers] [requests]
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from urllib.error import URLError
+from urllib.request import urlopen
+from app.prefork import memory_usage
+
+SNIPPET = '''
+from app.prefork import PreforkServer
+PreforkServer('testing', port=%d, workers=%d, preload=%r).run()
+'''
+PAGES = ['/', '/auth/login', '/auth/register', '/auth/reset', '/missing']
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def children(pid):
+    pids = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % name) as f:
+                # The command name may contain spaces, the ppid follows it.
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (IOError, OSError):
+            continue
+        if ppid == pid:
+            pids.append(int(name))
+    return pids
+
+
+def fetch(url):
+    try:
+        urlopen(url).read()
+    except URLError:
+        pass
+
+
+def measure(workers, requests, preload):
+    port = free_port()
+    master = subprocess.Popen(
+        [sys.executable, '-c', SNIPPET % (port, workers, preload)],
+        cwd=root, stderr=subprocess.DEVNULL)
+    try:
+        base = 'http://127.0.0.1:%d' % port
+        while True:
+            try:
+                urlopen(base + '/auth/login').read()
+                break
+            except (URLError, ConnectionError):
+                time.sleep(0.2)
+        for i in range(requests):
+            fetch(base + PAGES[i % len(PAGES)])
+        usage = [memory_usage(pid) for pid in children(master.pid)]
+        return [u for u in usage if u is not None]
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait()
+
+
+def run(workers=4, requests=400):
+    print('%-10s %8s %12s %12s %12s' % ('mode', 'workers', 'rss MB',
+                                        'pss MB', 'shared MB'))
+    for preload in (True, False):
+        usage = measure(workers, requests, preload)
+        print('%-10s %8d %12.1f %12.1f %12.1f' % (
+            'preload' if preload else 'separate', len(usage),
+            sum(u['rss'] for u in usage) / 1024.0,
+            sum(u['pss'] for u in usage) / 1024.0,
+            sum(u['shared'] for u in usage) / 1024.0))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,42 @@
+"""CPU time per login request, before and after the rate limiter starts
+rejecting a credential stuffing run against one account.
+
+    python -m benchmarks.ratelimit [attempts]
+"""
+import sys
+import time
+from app import create_app, db
+from app.models import User, Role
+
+
+def run(attempts=200):
+    app = create_app('testing')
+    app.config['FLASKY_RATELIMIT_PER_IP'] = attempts
+    limit = app.config['FLASKY_RATELIMIT_PER_ACCOUNT']
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(User(email='john@example.com', username='john',
+                            password='cat'))
+        db.session.commit()
+        client = app.test_client()
+        cpu = {200: [], 429: []}
+        for i in range(attempts):
+            start = time.process_time()
+            response = client.post('/auth/login', data={
+                'email': 'john@example.com', 'password': 'wrong'})
+            cpu.setdefault(response.status_code, []).append(
+                time.process_time() - start)
+        db.session.remove()
+        db.drop_all()
+    print('per-account limit: %d attempts' % limit)
+    for status, times in sorted(cpu.items()):
+        if times:
+            print('status %d: %4d requests, %.3f ms CPU each' %
+                  (status, len(times), 1000 * sum(times) / len(times)))
+    return cpu
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,46 @@
+"""Users constructed per second, with the role ids resolved from the cached
+role table and, for comparison, with the Role queries User.__init__ used to
+run for every new user (one for the administrator, one for the default role).
+
+Passwords are left out, so hashing does not hide the difference.
+
+    python -m benchmarks.roles [users]
+"""
+import sys
+import time
+from flask import current_app
+from app import create_app, db
+from app.models import Role, User
+
+
+def legacy_user(**kwargs):
+    user = User(role_id=0, **kwargs)
+    user.role_id = None
+    if user.email == current_app.config['FLASKY_ADMIN']:
+        user.role = Role.query.filter_by(permissions=0xFF).first()
+    if user.role is None:
+        user.role = Role.query.filter_by(default=True).first()
+    return user
+
+
+def construct(factory, count):
+    start = time.perf_counter()
+    for i in range(count):
+        factory(email='user%d@example.com' % i, username='user%d' % i)
+    return count / (time.perf_counter() - start)
+
+
+def run(count=5000):
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        for name, factory in (('queries', legacy_user), ('cached', User)):
+            with db.session.no_autoflush:
+                rate = construct(factory, count)
+            db.session.rollback()
+            print('%-8s %10.0f users/s' % (name, rate))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
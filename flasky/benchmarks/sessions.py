@@ -0,0 +1,44 @@
+"""Session cookie size and CPU time per logged-in request with Flask's
+cookie sessions and with the server-side SQLite store.
+
+    python -m benchmarks.sessions [requests]
+"""
+import sys
+import time
+from app import create_app, db, server_sessions
+from app.models import User, Role
+
+
+def measure(backend, requests):
+    app = create_app('testing')
+    app.config['FLASKY_SESSION_BACKEND'] = backend
+    server_sessions.init_app(app)
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(User(email='john@example.com', username='john',
+                            password='cat', confirmed=True))
+        db.session.commit()
+        client = app.test_client()
+        client.post('/auth/login', data={'email': 'john@example.com',
+                                         'password': 'cat'})
+        cookie = [c.value for c in client.cookie_jar
+                  if c.name == app.session_cookie_name][0]
+        start = time.process_time()
+        for i in range(requests):
+            client.get('/')
+        cpu = (time.process_time() - start) / requests
+        db.session.remove()
+        db.drop_all()
+    return len(cookie), cpu
+
+
+def run(requests=500):
+    for backend in ('cookie', 'sqlite'):
+        size, cpu = measure(backend, requests)
+        print('%-7s cookie %4d bytes  %.3f ms CPU per request' % (
+            backend, size, cpu * 1000))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,69 @@
+"""Cold start time with eager and lazy loading, each measured in a fresh
+interpreter: importing the app package and running create_app, then the
+first request. Followed by a -X importtime summary of the packages that
+take longest to import.
+
+    python -m benchmarks.startup [repeat]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SNIPPET = '''
+import json, time
+start = time.perf_counter()
+from app import create_app
+app = create_app('testing', lazy=%r)
+created = time.perf_counter()
+app.test_client().get('/auth/login')
+print(json.dumps([created - start, time.perf_counter() - created]))
+'''
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(lazy):
+    output = subprocess.check_output([sys.executable, '-c', SNIPPET % lazy],
+                                     cwd=root)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def import_times(lazy):
+    """Self time in seconds spent importing each top-level package."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         "from app import create_app; create_app('testing', lazy=%r)" % lazy],
+        cwd=root, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+        check=True)
+    totals = {}
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        totals[package] = totals.get(package, 0) + int(self_us) / 1e6
+    return totals
+
+
+def run(repeat=5):
+    for lazy in (False, True):
+        samples = [measure(lazy) for i in range(repeat)]
+        create = statistics.median(s[0] for s in samples)
+        first = statistics.median(s[1] for s in samples)
+        print('%-5s create_app %7.1f ms  first request %7.1f ms  '
+              'total %7.1f ms' % ('lazy' if lazy else 'eager',
+                                  create * 1000, first * 1000,
+                                  (create + first) * 1000))
+    for lazy in (False, True):
+        totals = import_times(lazy)
+        print('\nSlowest imports, %s (%.1f ms in all):' % (
+            'lazy' if lazy else 'eager', sum(totals.values()) * 1000))
+        for package, seconds in sorted(totals.items(),
+                                       key=lambda item: -item[1])[:12]:
+            print('  %-24s %7.1f ms' % (package, seconds * 1000))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,66 @@
+"""First-request latency of each page, and so of its template chain, in a
+fresh interpreter: compiling templates on first use, loading them from a
+primed bytecode cache, and with the warm-up step in create_app.
+
+    python -m benchmarks.templates [repeat]
+"""
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PAGES = [('/', 'index.html'),
+         ('/auth/login', 'auth/login.html'),
+         ('/auth/register', 'auth/register.html'),
+         ('/auth/reset', 'auth/reset_password.html'),
+         ('/no/such/page', '404.html')]
+
+SNIPPET = '''
+import json, time
+from config import config
+config['testing'].FLASKY_TEMPLATE_CACHE_DIR = %r
+config['testing'].FLASKY_TEMPLATE_WARMUP = %r
+from app import create_app
+app = create_app('testing', lazy=False)
+client = app.test_client()
+start = time.perf_counter()
+client.get(%r)
+print(json.dumps(time.perf_counter() - start))
+'''
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def first_request(path, cache_dir, warm_up):
+    output = subprocess.check_output(
+        [sys.executable, '-c', SNIPPET % (cache_dir, warm_up, path)],
+        cwd=root)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def run(repeat=3):
+    cache_dir = tempfile.mkdtemp()
+    try:
+        # Fill the bytecode cache once, as a previous worker would have.
+        first_request('/', cache_dir, True)
+        modes = (('compile', None, False), ('bytecode', cache_dir, False),
+                 ('warm-up', cache_dir, True))
+        print('%-26s' % 'template' +
+              ''.join('%12s' % (name + ' ms') for name, d, w in modes))
+        for path, template in PAGES:
+            row = '%-26s' % template
+            for name, directory, warm_up in modes:
+                latency = statistics.median(
+                    first_request(path, directory, warm_up)
+                    for i in range(repeat))
+                row += '%12.1f' % (latency * 1000)
+            print(row)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,41 @@
+"""Tokens per second for the token service, compared with building a new
+serializer for every call as the models used to do.
+
+    python -m benchmarks.tokens [count]
+"""
+import sys
+import time
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+from app import create_app, tokens
+
+
+def rate(func, count):
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return count / (time.perf_counter() - start)
+
+
+def run(count=20000):
+    app = create_app('testing')
+    secret = app.config['SECRET_KEY']
+    with app.app_context():
+        token = tokens.dumps({'confirm': 1})
+        results = {
+            'dumps_per_call_serializer': rate(
+                lambda i: Serializer(secret, 3600).dumps({'confirm': i}),
+                count),
+            'dumps_token_service': rate(
+                lambda i: tokens.dumps({'confirm': i}), count),
+            'loads_per_call_serializer': rate(
+                lambda i: Serializer(secret).loads(token), count),
+            'loads_token_service': rate(
+                lambda i: tokens.loads(token), count),
+        }
+    for name, value in results.items():
+        print('%-28s %10.0f tokens/s' % (name, value))
+    return results
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
@@ -4,8 +4,28 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'hard to guess string'
-    SQLALCHEMY_COMMIT_ON_TEARDOWN = True
+    FLASKY_TOKEN_SECRETS = [secret for secret in
+                            os.environ.get('FLASKY_TOKEN_SECRETS', '').split(',')
+                            if secret]
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    MAX_CONTENT_LENGTH = 1024 * 1024
+    FLASKY_DB_POOL = {
+        'pool_size': 5,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+        'pool_recycle': 3600,
+        'pool_pre_ping': True
+    }
+    FLASKY_SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'temp_store': 'MEMORY'
+    }
+    FLASKY_DB_REPLICAS = [uri for uri in
+                          os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                          if uri]
+    FLASKY_DB_REPLICA_STICKY_SECONDS = 5
     MAIL_SERVER = 'smtp.gmail.com'
     MAIL_PORT = 587
     MAIL_USE_TLS = True
@@ -14,6 +34,58 @@ class Config:
     FLASKY_MAIL_SUBJECT_PREFIX = '[Flasky]'
     FLASKY_MAIL_SENDER = 'someone@gmail.com'
     FLASKY_ADMIN = os.environ.get('FLASKY_ADMIN')
+    FLASKY_USER_CACHE_TYPE = os.environ.get('FLASKY_USER_CACHE_TYPE') or \
+        'simple'
+    FLASKY_USER_CACHE_SIZE = 1024
+    FLASKY_USER_CACHE_TTL = 300
+    FLASKY_USER_CACHE_REDIS_URL = os.environ.get('REDIS_URL')
+    FLASKY_PASSWORD_HASH_METHOD = 'pbkdf2:sha256:150000'
+    FLASKY_PASSWORD_SALT_LENGTH = 8
+    FLASKY_HASH_WORKERS = os.cpu_count()
+    FLASKY_HASH_QUEUE_SIZE = 32
+    FLASKY_MAIL_QUEUE_WORKERS = 2
+    FLASKY_MAIL_QUEUE_BATCH_SIZE = 20
+    FLASKY_MAIL_QUEUE_POLL_INTERVAL = 1.0
+    FLASKY_MAIL_QUEUE_MAX_ATTEMPTS = 6
+    FLASKY_MAIL_QUEUE_RETRY_DELAY = 30
+    FLASKY_MAIL_QUEUE_LEASE = 300
+    FLASKY_MAIL_QUEUE_IDLE_TIMEOUT = 60
+    FLASKY_RATELIMIT_ENABLED = True
+    # 'local' counts in each process: with 'manage.py serve -w N' a client
+    # gets N times the limits below. 'redis' shares the counts.
+    FLASKY_RATELIMIT_BACKEND = os.environ.get('FLASKY_RATELIMIT_BACKEND') or \
+        'local'
+    FLASKY_RATELIMIT_REDIS_URL = os.environ.get('REDIS_URL')
+    FLASKY_RATELIMIT_WINDOW = 60
+    FLASKY_RATELIMIT_PER_IP = 20
+    FLASKY_RATELIMIT_PER_ACCOUNT = 5
+    FLASKY_AUDIT_BACKEND = os.environ.get('FLASKY_AUDIT_BACKEND', 'database')
+    FLASKY_AUDIT_JSONL_PATH = os.path.join(basedir, 'audit.jsonl')
+    FLASKY_AUDIT_BUFFER_SIZE = 10000
+    FLASKY_AUDIT_BATCH_SIZE = 500
+    FLASKY_AUDIT_FLUSH_INTERVAL = 1.0
+    FLASKY_TOKEN_LEDGER_CAPACITY = 100000
+    FLASKY_TOKEN_LEDGER_ERROR_RATE = 0.01
+    FLASKY_TOKEN_LEDGER_REBUILD_INTERVAL = 600
+    FLASKY_TOKEN_LEDGER_COMPACT_INTERVAL = 3600
+    FLASKY_SESSION_BACKEND = os.environ.get('FLASKY_SESSION_BACKEND', 'cookie')
+    FLASKY_SESSION_SQLITE_PATH = os.path.join(basedir, 'data-sessions.sqlite')
+    FLASKY_SESSION_REDIS_URL = os.environ.get('FLASKY_SESSION_REDIS_URL')
+    FLASKY_PAGE_CACHE = os.environ.get('FLASKY_PAGE_CACHE') == '1'
+    FLASKY_PAGE_CACHE_TTL = 60
+    FLASKY_STATIC_MAX_AGE = 365 * 24 * 3600
+    FLASKY_ASGI_THREADS = int(os.environ.get('FLASKY_ASGI_THREADS', 8))
+    FLASKY_LAZY_LOADING = os.environ.get('FLASKY_LAZY_LOADING') == '1'
+    FLASKY_TEMPLATE_CACHE_DIR = os.environ.get('FLASKY_TEMPLATE_CACHE_DIR') or \
+        os.path.join(basedir, 'template-cache')
+    FLASKY_TEMPLATE_WARMUP = False
+    FLASKY_INSTRUMENTATION = os.environ.get('FLASKY_INSTRUMENTATION') == '1'
+    FLASKY_SLOW_REQUEST_THRESHOLD = 0.5
+    FLASKY_PROFILE_SAMPLE_RATE = 0.01
+    FLASKY_PROFILE_DIR = os.path.join(basedir, 'profiles')
+    FLASKY_REQUEST_LOG = os.environ.get('FLASKY_REQUEST_LOG')
+    FLASKY_METRICS_ALLOWED_IPS = os.environ.get(
+        'FLASKY_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
 
     @staticmethod
     def init_app(app):
@@ -22,24 +94,58 @@ class Config:
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    FLASKY_DB_POOL = {
+        'pool_size': 2,
+        'max_overflow': 5,
+        'pool_timeout': 30,
+        'pool_recycle': 3600,
+        'pool_pre_ping': True
+    }
     SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite')
 
 
 class TestingConfig(Config):
     TESTING = True
+    WTF_CSRF_ENABLED = False
+    FLASKY_HASH_WORKERS = 0
+    FLASKY_PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1'
+    FLASKY_SESSION_SQLITE_PATH = ':memory:'
+    FLASKY_TEMPLATE_CACHE_DIR = None
+    FLASKY_AUDIT_BACKGROUND = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
-        'sqlite:///' + os.path.join(basedir, 'data-test.sqlite')
+        'sqlite://'
 
 
 class ProductionConfig(Config):
+    FLASKY_DB_POOL = {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 10,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True
+    }
+    FLASKY_SQLITE_PRAGMAS = dict(Config.FLASKY_SQLITE_PRAGMAS,
+                                 busy_timeout=15000, cache_size=-16000)
+    FLASKY_TEMPLATE_WARMUP = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data.sqlite')
 
 
+# What manage.py bench runs against: the production settings, password
+# hashing included, on a database file of its own. The flows post forms
+# without CSRF tokens and come from a single address.
+class BenchmarkConfig(ProductionConfig):
+    WTF_CSRF_ENABLED = False
+    FLASKY_RATELIMIT_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = os.environ.get('BENCH_DATABASE_URL') or \
+        'sqlite:///' + os.path.join(basedir, 'data-bench.sqlite')
+
+
 config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
     'production': ProductionConfig,
+    'benchmark': BenchmarkConfig,
     'default': DevelopmentConfig
 }
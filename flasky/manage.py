@@ -1,29 +1,235 @@
 #!/usr/bin/env python
 import os
-from flask_script import Manager, Shell
+import sys
+import time
+from flask_script import Command, Manager, Option, Server, Shell
 from flask_migrate import Migrate, MigrateCommand
-from app import create_app, db
-from app.models import User, Role
+from app import create_app, db, template_cache
 
-
-app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+# Commands import what they use themselves, and the views are only set up
+# if a command serves requests, so 'db' and 'mail' start quickly. That
+# includes 'shell', which never warms up the templates.
+app = create_app(os.getenv('FLASK_CONFIG') or 'default', lazy=True)
 manager = Manager(app)
 migrate = Migrate(app, db)
 
 
+class Runserver(Server):
+    """Loads the views before serving, unless FLASKY_LAZY_LOADING is set,
+    and compiles the templates if FLASKY_TEMPLATE_WARMUP is set, as
+    create_app would for an application that is not loaded lazily."""
+    def __call__(self, app, *args, **kwargs):
+        if not app.config['FLASKY_LAZY_LOADING']:
+            app.extensions['lazy_views'].ensure_loaded()
+            if app.config['FLASKY_TEMPLATE_WARMUP']:
+                template_cache.warm_up(app)
+        return super(Runserver, self).__call__(app, *args, **kwargs)
+
+
 def make_shell_context():
+    from app.models import User, Role
     return dict(app=app, db=db, User=User, Role=Role)
 
 manager.add_command("shell", Shell(make_context=make_shell_context))
+manager.add_command('runserver', Runserver())
 manager.add_command('db', MigrateCommand)
 
+mail_manager = Manager(usage='Run or inspect the outgoing mail queue.')
+manager.add_command('mail', mail_manager)
+
+
+@mail_manager.option('-w', '--workers', dest='workers', type=int,
+                     default=None, help='Number of worker threads.')
+@mail_manager.option('--once', dest='once', action='store_true',
+                     default=False, help='Exit when the queue is empty.')
+def run(workers, once):
+    """Deliver queued mail."""
+    from app.mail_queue import MailWorkerPool
+    pool = MailWorkerPool(app, workers=workers, once=once)
+    start = time.time()
+    pool.run()
+    elapsed = time.time() - start
+    print('Sent %d messages in %.2fs (%.1f/s)' %
+          (pool.sent, elapsed, pool.sent / elapsed if elapsed else 0))
+
+
+@mail_manager.command
+def status():
+    """Show the number of queued and dead messages."""
+    from app.mail_queue import queue_status
+    for key, value in sorted(queue_status().items()):
+        print('%-8s %d' % (key, value))
+
+
+@mail_manager.command
+def retry():
+    """Move dead letters back into the queue."""
+    from app.mail_queue import requeue_dead
+    print('Requeued %d messages' % requeue_dead())
+
+
+audit_manager = Manager(usage='Inspect or prune the security audit log.')
+manager.add_command('audit', audit_manager)
+
+
+@audit_manager.option('-e', '--email', dest='email', default=None)
+@audit_manager.option('-i', '--ip', dest='ip', default=None)
+@audit_manager.option('--within', dest='within', type=int, default=3600,
+                      help='Look back this many seconds.')
+def failures(email, ip, within):
+    """Show recent failed auth events."""
+    from app.audit import recent_failures
+    for event in recent_failures(email=email, ip=ip, within=within):
+        print('%s %-24s %-32s %-15s %s' % (
+            event.created_at.strftime('%Y-%m-%d %H:%M:%S'), event.event,
+            event.email or '-', event.ip or '-', event.detail or ''))
+
+
+@audit_manager.option('-d', '--days', dest='days', type=int, default=90,
+                      help='Delete events older than this many days.')
+def prune(days):
+    """Delete old audit events."""
+    from app.audit import prune
+    print('Deleted %d audit events' % prune(days))
+
+
+users_manager = Manager(usage='Import or export users in bulk.')
+manager.add_command('users', users_manager)
 
-@manager.command
-def test():
+
+def report_progress(count, rate):
+    sys.stderr.write('\r%d users, %.0f rows/s' % (count, rate))
+    sys.stderr.flush()
+
+
+class ImportUsers(Command):
+    """Import users from a CSV or JSONL file ('-' for stdin)."""
+    option_list = (
+        Option('path'),
+        Option('-f', '--format', dest='fmt', choices=['csv', 'jsonl'],
+               default=None, help='Default: from the file extension.'),
+        Option('-b', '--batch-size', dest='batch_size', type=int,
+               default=1000, help='Rows per insert and commit.'),
+    )
+
+    def run(self, path, fmt, batch_size):
+        from app.bulk import guess_format, import_users
+        fmt = fmt or guess_format(path)
+        skipped = []
+
+        def skip(number, reason):
+            skipped.append(number)
+            sys.stderr.write('\nSkipped row %d: %s\n' % (number, reason))
+        if path == '-':
+            count = import_users(sys.stdin, fmt, batch_size, report_progress,
+                                 skip)
+        else:
+            with open(path, newline='') as f:
+                count = import_users(f, fmt, batch_size, report_progress,
+                                     skip)
+        sys.stderr.write('\nImported %d users' % count)
+        if skipped:
+            sys.stderr.write(', skipped %d' % len(skipped))
+        sys.stderr.write('\n')
+
+
+class ExportUsers(Command):
+    """Export users to a CSV or JSONL file ('-' for stdout)."""
+    option_list = (
+        Option('path'),
+        Option('-f', '--format', dest='fmt', choices=['csv', 'jsonl'],
+               default=None, help='Default: from the file extension.'),
+        Option('-b', '--batch-size', dest='batch_size', type=int,
+               default=1000, help='Rows fetched at a time.'),
+    )
+
+    def run(self, path, fmt, batch_size):
+        from app.bulk import guess_format, export_users
+        fmt = fmt or guess_format(path)
+        if path == '-':
+            count = export_users(sys.stdout, fmt, batch_size, report_progress)
+        else:
+            with open(path, 'w', newline='') as f:
+                count = export_users(f, fmt, batch_size, report_progress)
+        sys.stderr.write('\nExported %d users\n' % count)
+
+users_manager.add_command('import', ImportUsers())
+users_manager.add_command('export', ExportUsers())
+
+
+@manager.option('-p', '--parallel', dest='parallel', type=int, nargs='?',
+                const=os.cpu_count(), default=0,
+                help='Run test cases in this many processes '
+                     '(default: one per core).')
+def test(parallel):
     """Run the unit tests."""
     import unittest
     tests = unittest.TestLoader().discover('tests')
-    unittest.TextTestRunner(verbosity=2).run(tests)
+    if parallel:
+        from tests.base import run_parallel
+        run_parallel(tests, parallel)
+    else:
+        unittest.TextTestRunner(verbosity=2).run(tests)
+
+
+@manager.option('-f', '--file', dest='log_file', default=None,
+                help='Request log to replay (default: FLASKY_REQUEST_LOG).')
+@manager.option('-n', '--repeat', dest='repeat', type=int, default=1,
+                help='Number of times to replay the log.')
+@manager.option('-s', '--sort', dest='sort', default='cumulative',
+                help='pstats sort key.')
+@manager.option('-o', '--output', dest='output', default=None,
+                help='Write the raw profile to this file.')
+def profile(log_file, repeat, sort, output):
+    """Replay recorded requests under the profiler."""
+    from app.instrumentation import replay
+    stats = replay(app, log_file or app.config['FLASKY_REQUEST_LOG'], repeat)
+    if output:
+        stats.dump_stats(output)
+    stats.sort_stats(sort).print_stats(30)
+
+
+@manager.option('-H', '--host', dest='host', default='127.0.0.1')
+@manager.option('-P', '--port', dest='port', type=int, default=5000)
+@manager.option('-w', '--workers', dest='workers', type=int, default=None,
+                help='Number of worker processes (default: one per core).')
+@manager.option('--max-requests', dest='max_requests', type=int,
+                default=1000, help='Requests before a worker is replaced.')
+@manager.option('--max-requests-jitter', dest='max_requests_jitter',
+                type=int, default=50,
+                help='Random extra requests per worker, so they are not '
+                     'all replaced at once.')
+@manager.option('--no-preload', dest='preload', action='store_false',
+                default=True, help='Build the app in every worker instead '
+                                   'of once before forking.')
+@manager.option('--memory-report', dest='memory_report', type=float,
+                default=0, help='Print worker memory every this many '
+                                'seconds (also on SIGUSR1).')
+def serve(host, port, workers, max_requests, max_requests_jitter, preload,
+          memory_report):
+    """Serve the app with a pool of preforked worker processes. With more
+    than one, FLASKY_USER_CACHE_TYPE has to be redis or null."""
+    from app.prefork import PreforkServer
+    PreforkServer(os.getenv('FLASK_CONFIG') or 'default', host, port,
+                  workers, max_requests, max_requests_jitter, preload,
+                  memory_report).run()
+
+
+@manager.option('-m', '--mode', dest='mode', default='client',
+                choices=['client', 'server'],
+                help='Use the test client or a local WSGI server.')
+@manager.option('-c', '--concurrency', dest='concurrency', type=int,
+                default=4, help='Number of simulated users at a time.')
+@manager.option('-n', '--iterations', dest='iterations', type=int,
+                default=10, help='Flows run by each simulated user.')
+@manager.option('-o', '--output', dest='output', default=None,
+                help='Save the results as JSON.')
+@manager.option('--compare', dest='compare', default=None,
+                help='JSON results of an earlier run to compare with.')
+def bench(mode, concurrency, iterations, output, compare):
+    """Benchmark the authentication flows."""
+    from benchmarks.flows import run
+    run(mode, concurrency, iterations, output, compare)
 
 
 if __name__ == '__main__':
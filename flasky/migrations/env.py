@@ -41,7 +41,9 @@ def run_migrations_offline():
 
     """
     url = config.get_main_option("sqlalchemy.url")
-    context.configure(url=url)
+    context.configure(url=url,
+                      render_as_batch=url.startswith('sqlite'),
+                      transaction_per_migration=True)
 
     with context.begin_transaction():
         context.run_migrations()
@@ -70,10 +72,22 @@ def run_migrations_online():
                                 poolclass=pool.NullPool)
 
     connection = engine.connect()
+    # SQLite cannot alter most columns or constraints in place, so changes
+    # are generated as batch operations, which copy the table. Each revision
+    # runs in its own transaction, so a long backfill or an online index
+    # build (see app/migration.py) does not keep earlier revisions open.
+    configure_args = dict(current_app.extensions['migrate'].configure_args)
+    configure_args.setdefault('render_as_batch',
+                              connection.dialect.name == 'sqlite')
+    configure_args.setdefault('transaction_per_migration', True)
+    # 'manage.py db upgrade -x batch_size=N' sets the backfill batch size.
+    x_args = context.get_x_argument(as_dictionary=True)
+    if 'batch_size' in x_args:
+        configure_args['backfill_batch_size'] = int(x_args['batch_size'])
     context.configure(connection=connection,
                       target_metadata=target_metadata,
                       process_revision_directives=process_revision_directives,
-                      **current_app.extensions['migrate'].configure_args)
+                      **configure_args)
 
     try:
         with context.begin_transaction():
@@ -0,0 +1,156 @@
+import io
+import os
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import event
+from app import create_app, db, rate_limiter, token_ledger, tokens, \
+    user_cache
+from app.models import Role, User
+
+
+SAVEPOINT_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT',
+                        'ROLLBACK TO SAVEPOINT')
+
+
+class Clock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+# pysqlite opens transactions on its own and ignores SAVEPOINT, so the
+# engine used by FlaskyTestCase lets SQLAlchemy emit BEGIN itself.
+def _begin_explicitly(engine):
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def on_begin(conn):
+        conn.execute('BEGIN')
+
+
+# The application and its schema are created once per test case class.
+# Every test runs inside a transaction on a single connection that is
+# rolled back afterwards; commits made by the code under test only release
+# a savepoint. The configuration, caches, rate limiter counters, the token
+# ledger and the token clock are reset for each test.
+class FlaskyTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_app('testing')
+        with cls.app.app_context():
+            _begin_explicitly(db.engine)
+            db.create_all()
+            Role.insert_roles()
+            db.session.remove()
+
+    @classmethod
+    def tearDownClass(cls):
+        with cls.app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.engine.dispose()
+
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.config = dict(self.app.config)
+        self.clock = Clock()
+        tokens.init_app(self.app, clock=self.clock)
+        token_ledger.init_app(self.app)
+        user_cache.clear()
+        rate_limiter.clear()
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self.session = db.session
+        db.session = db.create_scoped_session(
+            options={'bind': self.connection, 'binds': {}})
+        db.session.begin_nested()
+
+        @event.listens_for(db.session(), 'after_transaction_end')
+        def restart_savepoint(session, transaction):
+            if transaction.nested and not transaction._parent.nested:
+                session.expire_all()
+                session.begin_nested()
+        self.restart_savepoint = (db.session(), restart_savepoint)
+
+    def tearDown(self):
+        # The last savepoint is rolled back without starting another one,
+        # so the outer transaction is the one left to roll back.
+        session, restart_savepoint = self.restart_savepoint
+        event.remove(session, 'after_transaction_end', restart_savepoint)
+        session.rollback()
+        db.session.remove()
+        db.session = self.session
+        self.transaction.rollback()
+        self.connection.close()
+        self.app_context.pop()
+        self.app.config.clear()
+        self.app.config.update(self.config)
+
+    def record_queries(self):
+        """Return a list that collects the statements run from now on,
+        leaving out the savepoints of the test transaction."""
+        queries = []
+
+        def record(conn, cursor, statement, *args):
+            if not statement.startswith(SAVEPOINT_STATEMENTS):
+                queries.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, db.engine, 'before_cursor_execute',
+                        record)
+        return queries
+
+    def add_user(self, email='john@example.com', username='john',
+                 password='cat', **kwargs):
+        user = User(email=email, username=username, password=password,
+                    **kwargs)
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+
+def _run_tests(name):
+    stream = io.StringIO()
+    suite = unittest.defaultTestLoader.loadTestsFromName(name)
+    result = unittest.TextTestRunner(stream=stream, verbosity=2).run(suite)
+    return (stream.getvalue(), result.testsRun, len(result.failures),
+            len(result.errors))
+
+
+def _test_case_names(suite):
+    names = []
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            names.extend(n for n in _test_case_names(test) if n not in names)
+        else:
+            name = '%s.%s' % (type(test).__module__, type(test).__name__)
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def run_parallel(suite, processes=None):
+    """Run each test case class of suite in a pool of processes and return
+    True if all of them passed. Every process has its own in-memory
+    database."""
+    start = time.time()
+    names = _test_case_names(suite)
+    processes = processes or os.cpu_count()
+    with ProcessPoolExecutor(processes) as executor:
+        results = list(executor.map(_run_tests, names))
+    runs = failures = errors = 0
+    for output, tests_run, test_failures, test_errors in results:
+        print(output.rstrip())
+        runs += tests_run
+        failures += test_failures
+        errors += test_errors
+    print('\nRan %d tests in %.3fs across %d processes: %s' % (
+        runs, time.time() - start, processes,
+        'OK' if failures == errors == 0 else
+        'FAILED (failures=%d, errors=%d)' % (failures, errors)))
+    return failures == errors == 0
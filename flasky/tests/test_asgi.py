@@ -0,0 +1,92 @@
+import asyncio
+from urllib.parse import urlencode
+from app.asgi import ASGIAdapter, _environ
+from tests.base import FlaskyTestCase
+
+
+class ASGIAdapterTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(ASGIAdapterTestCase, self).setUp()
+        self.add_user(confirmed=True)
+        self.adapter = ASGIAdapter(self.app.wsgi_app, max_workers=2)
+
+    def tearDown(self):
+        self.adapter.executor.shutdown()
+        super(ASGIAdapterTestCase, self).tearDown()
+
+    def request(self, method, path, body=b'', headers=()):
+        scope = {'type': 'http', 'method': method, 'path': path,
+                 'query_string': b'', 'headers': list(headers),
+                 'server': ('localhost', 80), 'client': ('10.0.0.1', 1234)}
+        chunks = [body[:5], body[5:]]
+        sent = []
+
+        async def receive():
+            chunk = chunks.pop(0)
+            return {'type': 'http.request', 'body': chunk,
+                    'more_body': bool(chunks)}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.adapter(scope, receive, send))
+        return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+    def test_get(self):
+        status, headers, body = self.request('GET', '/')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'text/html; charset=utf-8')
+        self.assertIn(b'Hello, Stranger!', body)
+
+    def test_post_form(self):
+        form = urlencode({'email': 'john@example.com',
+                          'password': 'cat'}).encode()
+        status, headers, body = self.request(
+            'POST', '/auth/login', form,
+            [(b'content-type', b'application/x-www-form-urlencoded'),
+             (b'content-length', str(len(form)).encode())])
+        self.assertEqual(status, 302)
+        self.assertIn(b'set-cookie', headers)
+
+    def test_post_form_without_content_length(self):
+        form = urlencode({'email': 'john@example.com',
+                          'password': 'cat'}).encode()
+        status, headers, body = self.request(
+            'POST', '/auth/login', form,
+            [(b'content-type', b'application/x-www-form-urlencoded'),
+             (b'transfer-encoding', b'chunked')])
+        self.assertEqual(status, 302)
+
+    def test_body_over_limit(self):
+        self.adapter.max_body_size = 8
+        form = b'email=john%40example.com'
+        status, headers, body = self.request('POST', '/auth/login', form)
+        self.assertEqual(status, 413)
+        status, headers, body = self.request(
+            'POST', '/auth/login', form,
+            [(b'content-length', str(len(form)).encode())])
+        self.assertEqual(status, 413)
+        status, headers, body = self.request('POST', '/auth/login', b'a=b')
+        self.assertEqual(status, 200)
+
+    def test_cookie_headers_are_joined(self):
+        environ = _environ({'method': 'GET', 'path': '/', 'headers': [
+            (b'cookie', b'a=1'), (b'cookie', b'b=2'),
+            (b'accept', b'text/html'), (b'accept', b'*/*')]}, b'')
+        self.assertEqual(environ['HTTP_COOKIE'], 'a=1; b=2')
+        self.assertEqual(environ['HTTP_ACCEPT'], 'text/html,*/*')
+
+    def test_lifespan(self):
+        messages = [{'type': 'lifespan.startup'},
+                    {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(self.adapter({'type': 'lifespan'}, receive, send))
+        self.assertEqual(sent, ['lifespan.startup.complete',
+                                'lifespan.shutdown.complete'])
@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from app import db, audit_log
+from app.audit import DatabaseSink, recent_events, recent_failures, prune
+from app.models import AuditEvent
+from tests.base import FlaskyTestCase
+
+
+class AuditLogTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(AuditLogTestCase, self).setUp()
+        self.app.config['FLASKY_AUDIT_BUFFER_SIZE'] = 5
+        self.app.config['FLASKY_AUDIT_BATCH_SIZE'] = 2
+        audit_log.init_app(self.app)
+        # Batches are written inside the test transaction.
+        self.app.extensions['audit_log'].sink = DatabaseSink(
+            self.app, self.connection)
+        self.user = self.add_user()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        super(AuditLogTestCase, self).tearDown()
+        audit_log.init_app(self.app)
+
+    def test_events_are_buffered_until_flushed(self):
+        audit_log.record('login', user=self.user)
+        audit_log.record('login', success=False, email=' John@Example.com')
+        audit_log.record('password_reset_request', email='nobody@example.com')
+        self.assertEqual(AuditEvent.query.count(), 0)
+        self.assertEqual(audit_log.stats()['buffered'], 3)
+        audit_log.flush()
+        self.assertEqual(audit_log.stats(),
+                         {'buffered': 0, 'dropped': 0, 'written': 3})
+        events = AuditEvent.query.order_by(AuditEvent.id).all()
+        self.assertEqual([(e.event, e.success, e.user_id, e.email)
+                          for e in events],
+                         [('login', True, self.user.id, 'john@example.com'),
+                          ('login', False, None, 'john@example.com'),
+                          ('password_reset_request', True, None,
+                           'nobody@example.com')])
+
+    def test_full_buffer_drops_events(self):
+        results = [audit_log.record('login', email='a@example.com')
+                   for i in range(7)]
+        self.assertEqual(results, [True] * 5 + [False] * 2)
+        audit_log.flush()
+        self.assertEqual(audit_log.stats(),
+                         {'buffered': 0, 'dropped': 2, 'written': 5})
+        self.assertEqual(AuditEvent.query.count(), 5)
+
+    def test_jsonl_backend(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'audit.jsonl')
+            self.app.config['FLASKY_AUDIT_BACKEND'] = 'jsonl'
+            self.app.config['FLASKY_AUDIT_JSONL_PATH'] = path
+            audit_log.init_app(self.app)
+            audit_log.record('login', user=self.user)
+            audit_log.record('login', success=False, email='x@example.com')
+            audit_log.flush()
+            with open(path) as f:
+                events = [json.loads(line) for line in f]
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual([(e['email'], e['success']) for e in events],
+                         [('john@example.com', True),
+                          ('x@example.com', False)])
+        self.assertEqual(AuditEvent.query.count(), 0)
+
+    def test_login_is_recorded(self):
+        for password in ('dog', 'cat'):
+            self.client.post('/auth/login', data={
+                'email': 'john@example.com', 'password': password})
+        db.session.commit()
+        audit_log.flush()
+        failures = recent_failures(email='john@example.com')
+        self.assertEqual([(e.event, e.ip) for e in failures],
+                         [('login', '127.0.0.1')])
+        self.assertEqual(len(recent_events(ip='127.0.0.1', success=True)),
+                         1)
+
+    def test_recent_failures_and_prune(self):
+        now = datetime.utcnow()
+        db.session.add_all([
+            AuditEvent(created_at=now - timedelta(days=days), event='login',
+                       success=False, email='john@example.com')
+            for days in (0, 1, 40, 100)])
+        db.session.commit()
+        self.assertEqual(len(recent_failures(email='john@example.com')), 1)
+        events = recent_failures(email='john@example.com',
+                                 within=365 * 24 * 3600)
+        self.assertEqual(len(events), 4)
+        self.assertEqual(events, sorted(events, key=lambda e: e.created_at,
+                                        reverse=True))
+        self.assertEqual(prune(30, batch_size=1), 2)
+        self.assertEqual(AuditEvent.query.count(), 2)
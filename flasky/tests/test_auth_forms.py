@@ -0,0 +1,58 @@
+from unittest import mock
+from app.auth.forms import RegistrationForm, ChangeEmailForm
+from app.models import User
+from tests.base import FlaskyTestCase
+
+
+class AuthFormsTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(AuthFormsTestCase, self).setUp()
+        self.add_user()
+        self.queries = self.record_queries()
+
+    def registration_form(self, email, username):
+        return RegistrationForm(data={'email': email, 'username': username,
+                                      'password': 'cat', 'password2': 'cat'})
+
+    def test_taken(self):
+        self.assertEqual(User.taken(email='john@example.com',
+                                    username='susan'), {'email'})
+        self.assertEqual(User.taken(), set())
+
+    def test_registration_single_query(self):
+        with self.app.test_request_context(method='POST'):
+            form = self.registration_form('john@example.com', 'john')
+            self.assertFalse(form.validate())
+        self.assertEqual(len(self.queries), 1)
+        self.assertIn('EXISTS', self.queries[0])
+        self.assertEqual(form.email.errors, ['Email already registered.'])
+        self.assertEqual(form.username.errors, ['Username already in use.'])
+
+    def test_registration_valid(self):
+        with self.app.test_request_context(method='POST'):
+            form = self.registration_form('susan@example.com', 'susan')
+            self.assertTrue(form.validate())
+
+    def test_invalid_field_is_not_checked(self):
+        with self.app.test_request_context(method='POST'):
+            form = self.registration_form('not an email', 'john')
+            self.assertFalse(form.validate())
+        self.assertEqual(len(form.email.errors), 1)
+        self.assertEqual(form.username.errors, ['Username already in use.'])
+
+    def test_change_email(self):
+        with self.app.test_request_context(method='POST'):
+            form = ChangeEmailForm(data={'email': 'john@example.com',
+                                         'password': 'cat'})
+            self.assertFalse(form.validate())
+        self.assertEqual(form.email.errors, ['Email already registered.'])
+
+    def test_register_race(self):
+        client = self.app.test_client()
+        # The form is validated before this duplicate is inserted.
+        with mock.patch.object(User, 'taken', return_value=set()):
+            response = client.post('/auth/register', data={
+                'email': 'john@example.com', 'username': 'john2',
+                'password': 'cat', 'password2': 'cat'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'already registered', response.data)
@@ -0,0 +1,85 @@
+import io
+import json
+from app import password_hasher
+from app.bulk import import_users, export_users
+from app.models import User
+from tests.base import FlaskyTestCase
+
+
+class BulkUsersTestCase(FlaskyTestCase):
+    def jsonl(self, count):
+        return io.StringIO(''.join(
+            json.dumps({'email': 'u%d@example.com' % i, 'username': 'u%d' % i,
+                        'password': 'pw%d' % i, 'confirmed': i % 2 == 0}) +
+            '\n' for i in range(count)))
+
+    def test_import_jsonl(self):
+        self.app.config['FLASKY_ADMIN'] = 'u3@example.com'
+        statements = self.record_queries()
+        progress = []
+        count = import_users(self.jsonl(10), batch_size=4,
+                             progress=lambda n, rate: progress.append(n))
+        self.assertEqual(count, 10)
+        self.assertEqual(progress, [4, 8, 10])
+        self.assertEqual(len([s for s in statements
+                              if s.startswith('INSERT')]), 3)
+        u = User.query.filter_by(email='u2@example.com').first()
+        self.assertTrue(u.verify_password('pw2'))
+        self.assertTrue(u.confirmed)
+        self.assertEqual(u.role.name, 'User')
+        admin = User.query.filter_by(email='u3@example.com').first()
+        self.assertTrue(admin.is_administrator())
+
+    def test_export_and_import_csv(self):
+        import_users(self.jsonl(3))
+        out = io.StringIO()
+        self.assertEqual(export_users(out, 'csv', batch_size=2), 3)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0],
+                         'email,username,role,confirmed,password_hash')
+        User.query.delete()
+        rows = io.StringIO(out.getvalue().replace('u1@', 'v1@'))
+        self.assertEqual(import_users(rows, 'csv'), 3)
+        u = User.query.filter_by(email='v1@example.com').first()
+        self.assertTrue(u.verify_password('pw1'))
+        self.assertFalse(u.confirmed)
+
+    def test_rows_with_unknown_roles_are_skipped(self):
+        rows = [json.loads(line) for line in self.jsonl(5)]
+        rows[3]['role'] = 'Nobody'
+        rows[4]['role'] = 'Moderator'
+        skipped = []
+        count = import_users(
+            io.StringIO(''.join(json.dumps(row) + '\n' for row in rows)),
+            batch_size=2, skip=lambda number, reason: skipped.append(
+                (number, reason)))
+        self.assertEqual(count, 4)
+        self.assertEqual(skipped, [(4, "unknown role 'Nobody'")])
+        self.assertIsNone(User.query.filter_by(email='u3@example.com').first())
+        self.assertEqual(User.query.filter_by(email='u4@example.com')
+                         .first().role.name, 'Moderator')
+
+    def test_missing_fields_and_duplicates_are_skipped(self):
+        self.add_user(email='u0@example.com', username='taken')
+        rows = [json.loads(line) for line in self.jsonl(6)]
+        rows[1]['username'] = 'taken'
+        rows[2]['email'] = rows[3]['email']
+        del rows[4]['email']
+        del rows[5]['password']
+        skipped = []
+        count = import_users(
+            io.StringIO(''.join(json.dumps(row) + '\n' for row in rows)),
+            batch_size=3, skip=lambda number, reason: skipped.append(
+                (number, reason)))
+        self.assertEqual(count, 1)
+        self.assertEqual(skipped, [
+            (1, "email 'u0@example.com' already registered"),
+            (2, "username 'taken' already taken"),
+            (4, "email 'u3@example.com' already registered"),
+            (5, 'no email'), (6, 'no password')])
+        self.assertEqual(User.query.filter_by(email='u3@example.com')
+                         .first().username, 'u2')
+
+    def test_hash_many_uses_configured_method(self):
+        hashes = password_hasher.hash_many(['a', 'b'])
+        self.assertTrue(all(h.startswith('pbkdf2:sha256:1$') for h in hashes))
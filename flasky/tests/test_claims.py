@@ -0,0 +1,117 @@
+from app import db, user_cache
+from app.cache import NullBackend
+from app.claims import CLAIMS_KEY
+from app.decorators import permission_required
+from app.models import Role, Permission, version_key
+from tests.base import FlaskyTestCase
+
+
+class ClaimsTestCase(FlaskyTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(ClaimsTestCase, cls).setUpClass()
+        cls.app.add_url_rule(
+            '/moderate', 'moderate',
+            permission_required(Permission.MODERATE_COMMENTS)(lambda: 'ok'))
+
+    def setUp(self):
+        super(ClaimsTestCase, self).setUp()
+        self.user = self.add_user()
+        self.client = self.app.test_client()
+        self.queries = self.record_queries()
+
+    def login(self):
+        self.client.post('/auth/login', data={'email': 'john@example.com',
+                                              'password': 'cat'})
+        del self.queries[:]
+
+    def test_unconfirmed_user_is_redirected_without_queries(self):
+        self.login()
+        response = self.client.get('/moderate')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.location.endswith('/auth/unconfirmed'))
+        self.assertEqual(self.queries, [])
+
+    def test_auth_endpoints_are_exempt(self):
+        self.assertIn('auth.unconfirmed',
+                      self.app.extensions['unconfirmed_endpoints'])
+        self.assertIn('static', self.app.extensions['unconfirmed_endpoints'])
+        self.login()
+        response = self.client.get('/auth/unconfirmed')
+        self.assertEqual(response.status_code, 200)
+
+    def test_confirmation_updates_claims(self):
+        self.login()
+        token = self.user.generate_confirmation_token()
+        self.client.get('/auth/confirm/' + token)
+        # Requests share the test's app context, which is what commits.
+        db.session.commit()
+        response = self.client.get('/moderate')
+        self.assertEqual(response.status_code, 403)
+        with self.client.session_transaction() as session:
+            self.assertTrue(session[CLAIMS_KEY]['confirmed'])
+
+    def test_changed_user_row_invalidates_claims(self):
+        self.user.confirmed = True
+        db.session.commit()
+        self.login()
+        self.assertEqual(self.client.get('/moderate').status_code, 403)
+        version = self.user.version
+        self.user.role = Role.query.filter_by(name='Moderator').first()
+        db.session.commit()
+        self.assertEqual(self.user.version, version + 1)
+        self.assertEqual(self.client.get('/moderate').status_code, 200)
+
+    def test_uncached_version_is_read_from_database(self):
+        self.user.confirmed = True
+        db.session.commit()
+        self.login()
+        self.assertEqual(self.client.get('/moderate').status_code, 403)
+        user_cache.invalidate(version_key(self.user.id))
+        del self.queries[:]
+        self.assertEqual(self.client.get('/moderate').status_code, 403)
+        self.assertEqual(len(self.queries), 1)
+        self.assertIn('users.version', self.queries[0])
+        del self.queries[:]
+        self.client.get('/moderate')
+        self.assertEqual(self.queries, [])
+
+    def test_confirmation_without_cache_does_not_loop(self):
+        self.app.extensions['user_cache'].backend = NullBackend()
+        self.addCleanup(user_cache.init_app, self.app)
+        self.login()
+        token = self.user.generate_confirmation_token()
+        response = self.client.get('/auth/confirm/' + token)
+        self.assertTrue(response.location.endswith('/'))
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        with self.client.session_transaction() as session:
+            self.assertTrue(session[CLAIMS_KEY]['confirmed'])
+
+    def test_role_permission_change_is_picked_up(self):
+        self.user.confirmed = True
+        db.session.commit()
+        self.login()
+        self.assertEqual(self.client.get('/moderate').status_code, 403)
+        role = Role.query.filter_by(default=True).first()
+        role.permissions |= Permission.MODERATE_COMMENTS
+        db.session.commit()
+        self.assertEqual(self.client.get('/moderate').status_code, 200)
+
+    def test_logout_clears_claims(self):
+        self.login()
+        self.client.get('/auth/logout')
+        with self.client.session_transaction() as session:
+            self.assertNotIn(CLAIMS_KEY, session)
+        self.assertEqual(self.client.get('/moderate').status_code, 403)
+
+    def test_session_protection_applies(self):
+        self.user.confirmed = True
+        self.user.role = Role.query.filter_by(name='Moderator').first()
+        db.session.commit()
+        self.login()
+        self.assertEqual(self.client.get('/moderate').status_code, 200)
+        # Strong session protection drops a session used by another client.
+        response = self.client.get('/moderate',
+                                   headers={'User-Agent': 'elsewhere'})
+        self.assertEqual(response.status_code, 403)
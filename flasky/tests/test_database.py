@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy import event
+from app import create_app, db
+from app.database import TimedQueuePool, pool_checkout_wait
+from app.models import Role
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        # Pool profiles and pragmas only apply to file databases.
+        self.tmpdir = tempfile.mkdtemp()
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(self.tmpdir, 'data-test.sqlite')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.commits = 0
+        event.listen(db.engine, 'commit', self.count_commit)
+
+    def tearDown(self):
+        event.remove(db.engine, 'commit', self.count_commit)
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+        self.app_context.pop()
+        shutil.rmtree(self.tmpdir)
+
+    def count_commit(self, conn):
+        self.commits += 1
+
+    def test_engine_profile(self):
+        self.assertIsInstance(db.engine.pool, TimedQueuePool)
+        self.assertEqual(db.engine.pool.size(),
+                         self.app.config['FLASKY_DB_POOL']['pool_size'])
+        count = pool_checkout_wait.count
+        db.session.execute('SELECT 1')
+        self.assertGreater(pool_checkout_wait.count, count)
+
+    def test_sqlite_pragmas(self):
+        mode = db.session.execute('PRAGMA journal_mode').scalar()
+        self.assertEqual(mode.lower(), 'wal')
+        timeout = db.session.execute('PRAGMA busy_timeout').scalar()
+        self.assertEqual(timeout, 5000)
+
+    def test_read_only_request_does_not_commit(self):
+        with self.app.app_context():
+            Role.query.all()
+        self.assertEqual(self.commits, 0)
+
+    def test_dirty_session_is_committed(self):
+        with self.app.app_context():
+            Role.query.filter_by(name='User').first().permissions = 0
+        self.assertEqual(self.commits, 1)
+        self.assertEqual(Role.query.filter_by(name='User').first()
+                         .permissions, 0)
+
+    def test_flushed_changes_are_committed(self):
+        with self.app.app_context():
+            db.session.add(Role(name='Guest'))
+            Role.query.all()
+        self.assertEqual(self.commits, 1)
+        self.assertIsNotNone(Role.query.filter_by(name='Guest').first())
@@ -0,0 +1,35 @@
+from app import create_app, password_hasher
+from app.hashing import HashingBusy
+from app.models import User
+from tests.base import FlaskyTestCase
+
+
+class PasswordHasherTestCase(FlaskyTestCase):
+    def test_configured_method(self):
+        self.app.config['FLASKY_PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        u = User(password='cat')
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertFalse(u.password_needs_rehash())
+
+    def test_outdated_hash_needs_rehash(self):
+        u = User(password='cat')
+        self.app.config['FLASKY_PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        self.assertTrue(u.password_needs_rehash())
+        self.assertTrue(u.verify_password('cat'))
+
+    def test_full_queue_fails_fast(self):
+        state = self.app.extensions['password_hasher']
+        for i in range(self.app.config['FLASKY_HASH_QUEUE_SIZE']):
+            state.slots.acquire()
+            self.addCleanup(state.slots.release)
+        with self.assertRaises(HashingBusy):
+            password_hasher.hash('cat')
+
+    def test_process_pool(self):
+        app = create_app('testing')
+        app.config['FLASKY_HASH_WORKERS'] = 1
+        password_hasher.init_app(app)
+        with app.app_context():
+            password_hash = password_hasher.hash('cat')
+            self.assertTrue(password_hasher.verify(password_hash, 'cat'))
+        app.extensions['password_hasher'].executor.shutdown()
@@ -0,0 +1,90 @@
+import json
+import os
+import shutil
+import tempfile
+from app import instrumentation
+from app.instrumentation import replay
+from app.metrics import Counter, Histogram
+from tests.base import FlaskyTestCase
+
+
+class InstrumentationTestCase(FlaskyTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(InstrumentationTestCase, cls).setUpClass()
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.app.config.update(
+            FLASKY_INSTRUMENTATION=True,
+            FLASKY_PROFILE_SAMPLE_RATE=1.0,
+            FLASKY_SLOW_REQUEST_THRESHOLD=0,
+            FLASKY_PROFILE_DIR=os.path.join(cls.tmpdir, 'profiles'),
+            FLASKY_REQUEST_LOG=os.path.join(cls.tmpdir, 'requests.jsonl'))
+        instrumentation.init_app(cls.app)
+
+    @classmethod
+    def tearDownClass(cls):
+        super(InstrumentationTestCase, cls).tearDownClass()
+        shutil.rmtree(cls.tmpdir)
+
+    def setUp(self):
+        super(InstrumentationTestCase, self).setUp()
+        if os.path.exists(self.app.config['FLASKY_REQUEST_LOG']):
+            os.remove(self.app.config['FLASKY_REQUEST_LOG'])
+        self.client = self.app.test_client()
+
+    def metric(self, cls, name, endpoint):
+        return cls.labelled(name, '', endpoint=endpoint)
+
+    def test_request_metrics(self):
+        duration = self.metric(Histogram, 'flasky_request_duration_seconds',
+                               'auth.login')
+        queries = self.metric(Counter, 'flasky_request_sql_queries_total',
+                              'auth.login')
+        render = self.metric(Histogram, 'flasky_request_render_seconds',
+                             'auth.login')
+        count, query_count = duration.count, queries.value
+        self.client.post('/auth/login', data={'email': 'john@example.com',
+                                              'password': 'cat'})
+        self.assertEqual(duration.count, count + 1)
+        self.assertGreater(queries.value, query_count)
+        self.assertGreater(render.sum, 0)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.get_data(as_text=True)
+        self.assertIn('# TYPE flasky_request_duration_seconds histogram', text)
+        self.assertIn('flasky_request_duration_seconds_count'
+                      '{endpoint="main.index"}', text)
+
+    def test_metrics_endpoint_is_local_only(self):
+        response = self.client.get('/metrics', environ_base={
+            'REMOTE_ADDR': '10.0.0.1'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_slow_request_profile(self):
+        self.client.get('/')
+        self.assertTrue(any(name.startswith('main.index-') for name in
+                            os.listdir(self.app.config['FLASKY_PROFILE_DIR'])))
+
+    def test_tokens_are_not_recorded(self):
+        self.client.get('/auth/reset/secret-token?next=/secret')
+        with open(self.app.config['FLASKY_REQUEST_LOG']) as f:
+            recorded = f.read()
+        self.assertNotIn('secret', recorded)
+        self.assertEqual(json.loads(recorded)['path'],
+                         '/auth/reset/redacted')
+
+    def test_record_and_replay(self):
+        self.client.post('/auth/login', data={'email': 'john@example.com',
+                                              'password': 'cat',
+                                              'csrf_token': 'secret',
+                                              'remember_me': 'y'})
+        with open(self.app.config['FLASKY_REQUEST_LOG']) as f:
+            recorded = json.loads(f.readline())
+        self.assertEqual(recorded['path'], '/auth/login')
+        self.assertEqual(recorded['form'], {'email': 'redacted@example.com',
+                                            'remember_me': 'redacted'})
+        stats = replay(self.app, self.app.config['FLASKY_REQUEST_LOG'])
+        self.assertGreater(stats.total_calls, 0)
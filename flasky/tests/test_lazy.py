@@ -0,0 +1,44 @@
+import unittest
+from flask import url_for
+from werkzeug.routing import BuildError
+from app import create_app
+from app.email import render_email
+
+
+# Each test needs an application whose views have not been loaded yet, so
+# these do not share one. None of them touches the database.
+class LazyLoadingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing', lazy=True)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_views_load_on_first_request(self):
+        self.assertNotIn('auth', self.app.blueprints)
+        response = self.app.test_client().get('/auth/login')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('auth', self.app.blueprints)
+        self.assertIn('bootstrap', self.app.blueprints)
+
+    def test_views_load_when_building_urls(self):
+        with self.app.test_request_context():
+            self.assertEqual(url_for('auth.login'), '/auth/login')
+        self.assertIn('main', self.app.blueprints)
+
+    def test_unknown_endpoint(self):
+        with self.app.test_request_context():
+            url_for('main.index')
+            with self.assertRaises(BuildError):
+                url_for('no.such_endpoint')
+
+    def test_mail_setup_is_deferred(self):
+        self.assertNotIn('mail', self.app.extensions)
+        self.assertNotIn('email_templates', self.app.extensions)
+        body, html = render_email(
+            'auth/email/confirm', {'user': {'username': 'john'},
+                                   'token': 'abc'}, 'http://localhost/')
+        self.assertIn('/auth/confirm/abc', body)
+        self.assertIn('email_templates', self.app.extensions)
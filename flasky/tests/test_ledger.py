@@ -0,0 +1,89 @@
+import unittest
+from datetime import datetime
+from app import db, token_ledger, tokens
+from app.ledger import BloomFilter
+from app.models import ConsumedToken, User
+from tests.base import FlaskyTestCase
+
+
+class BloomFilterTestCase(unittest.TestCase):
+    def test_no_false_negatives(self):
+        f = BloomFilter(1000, 0.01)
+        keys = ['%024x' % i for i in range(1000)]
+        for key in keys:
+            f.add(key)
+        self.assertTrue(all(key in f for key in keys))
+        self.assertEqual(len(f), 1000)
+        false_positives = sum('other%d' % i in f for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_sizing(self):
+        f = BloomFilter(1000000, 0.01)
+        # About 9.6 bits and 7 hashes per id for a 1% error rate.
+        self.assertEqual(f.hashes, 7)
+        self.assertLess(len(f.bits), 1250000)
+
+
+class TokenLedgerTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(TokenLedgerTestCase, self).setUp()
+        self.user = User(email='john@example.com', password='cat')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def test_reset_token_is_single_use(self):
+        token = self.user.generate_reset_token()
+        self.assertTrue(self.user.reset_password(token, 'dog'))
+        db.session.commit()
+        self.assertFalse(self.user.reset_password(token, 'horse'))
+        self.assertTrue(self.user.verify_password('dog'))
+
+    def test_email_change_token_is_single_use(self):
+        token = self.user.generate_email_change_token('susan@example.org')
+        self.assertTrue(self.user.change_email(token))
+        db.session.commit()
+        self.user.email = 'john@example.com'
+        db.session.commit()
+        self.assertFalse(self.user.change_email(token))
+        self.assertEqual(self.user.email, 'john@example.com')
+
+    def test_token_without_jti_is_refused(self):
+        token = tokens.dumps({'reset': self.user.id})
+        self.assertFalse(self.user.reset_password(token, 'dog'))
+        self.assertTrue(self.user.verify_password('cat'))
+
+    def test_unused_tokens_do_not_query(self):
+        token_ledger.rebuild()
+        queries = self.record_queries()
+        self.assertFalse(token_ledger.is_consumed('0' * 24))
+        self.assertEqual(queries, [])
+
+    def test_concurrent_use_is_refused(self):
+        token = self.user.generate_reset_token()
+        result = tokens.loads(token)
+        token_ledger.rebuild()
+        # Used by another process, which this filter has not seen.
+        db.session.add(ConsumedToken(
+            jti=result.data['jti'],
+            expires_at=datetime.utcfromtimestamp(result.expires)))
+        db.session.commit()
+        self.assertFalse(self.user.reset_password(token, 'dog'))
+        self.assertTrue(self.user.verify_password('cat'))
+
+    def test_expired_rows_are_compacted(self):
+        self.app.config['FLASKY_TOKEN_LEDGER_COMPACT_INTERVAL'] = 60
+        token_ledger.init_app(self.app)
+        self.assertTrue(self.user.reset_password(
+            self.user.generate_reset_token(10), 'dog'))
+        self.assertTrue(self.user.reset_password(
+            self.user.generate_reset_token(3600), 'horse'))
+        db.session.commit()
+        self.assertEqual(ConsumedToken.query.count(), 2)
+        self.clock.now += 61
+        self.assertTrue(self.user.reset_password(
+            self.user.generate_reset_token(), 'cow'))
+        db.session.commit()
+        self.assertEqual(ConsumedToken.query.count(), 2)
+        self.assertEqual(token_ledger.stats()['ids'], 0)
+        token_ledger.is_consumed('0' * 24)
+        self.assertEqual(token_ledger.stats()['ids'], 2)
@@ -0,0 +1,161 @@
+import os
+import re
+import shutil
+import socket
+import tempfile
+import unittest
+from unittest import mock
+from app import create_app, db, mail
+from app.email import send_email
+from app.mail_queue import MailWorkerPool, queue_status, requeue_dead, \
+    to_message
+from app.models import OutgoingMail, DeadMail, User, Role
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+
+class MailQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['SERVER_NAME'] = 'localhost'
+        # Workers run in their own threads, which must not share the single
+        # connection of the in-memory test database.
+        self.tmpdir = tempfile.mkdtemp()
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(self.tmpdir, 'data-test.sqlite')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+        self.app_context.pop()
+        shutil.rmtree(self.tmpdir)
+
+    def queue_messages(self, count):
+        with self.app.test_request_context():
+            for i in range(count):
+                send_email('john@example.com', 'Confirm Your Account',
+                           'auth/email/confirm', user=self.user, token='t')
+        db.session.commit()
+
+    def test_send_email_is_queued(self):
+        self.queue_messages(1)
+        row = OutgoingMail.query.one()
+        self.assertEqual(row.recipients, 'john@example.com')
+        self.assertEqual(row.template, 'auth/email/confirm')
+        self.assertIsNone(row.body)
+        self.assertNotIn('password', row.context)
+
+    def test_queued_message_is_rendered(self):
+        token = self.user.generate_confirmation_token()
+        with self.app.test_request_context():
+            send_email('john@example.com', 'Confirm Your Account',
+                       'auth/email/confirm', user=self.user, token=token)
+        msg = to_message(OutgoingMail.query.one())
+        self.assertIn('Dear john', msg.body)
+        url = re.search(r'http://localhost/auth/confirm/(\S+)',
+                        msg.body).group(1)
+        self.assertIn('http://localhost/auth/confirm/' + url, msg.html)
+        self.assertTrue(self.user.confirm(url))
+
+    def test_send_email_leaves_the_commit_to_the_caller(self):
+        with self.app.test_request_context():
+            send_email('john@example.com', 'Confirm Your Account',
+                       'auth/email/confirm', user=self.user, token='t')
+        self.user.username = 'johnny'
+        db.session.rollback()
+        self.assertEqual(OutgoingMail.query.count(), 0)
+        self.assertEqual(User.query.one().username, 'john')
+
+    def test_templates_are_precompiled(self):
+        templates = self.app.extensions['email_templates']
+        self.assertIn('auth/email/confirm.txt', templates)
+        self.assertIn('auth/email/reset_password.html', templates)
+
+    def test_workers_drain_queue(self):
+        self.queue_messages(5)
+        pool = MailWorkerPool(self.app, workers=2, once=True)
+        with mail.record_messages() as outbox:
+            pool.run()
+        self.assertEqual(len(outbox), 5)
+        self.assertEqual(pool.sent, 5)
+        self.assertEqual(queue_status()['queued'], 0)
+
+    def test_failure_is_retried_then_dead_lettered(self):
+        self.app.config['FLASKY_MAIL_QUEUE_RETRY_DELAY'] = 0
+        self.app.config['FLASKY_MAIL_QUEUE_MAX_ATTEMPTS'] = 2
+        self.queue_messages(1)
+        with mock.patch('flask_mail.Connection.send',
+                        side_effect=socket.error('refused')):
+            MailWorkerPool(self.app, workers=1, once=True).run()
+        self.assertEqual(OutgoingMail.query.count(), 0)
+        dead = DeadMail.query.one()
+        self.assertEqual(dead.attempts, 2)
+        self.assertEqual(dead.last_error, 'refused')
+        self.assertEqual(requeue_dead(), 1)
+        self.assertEqual(queue_status()['dead'], 0)
+
+    def test_unexpected_errors_do_not_stop_the_worker(self):
+        self.app.config['FLASKY_MAIL_QUEUE_RETRY_DELAY'] = 0
+        self.app.config['FLASKY_MAIL_QUEUE_MAX_ATTEMPTS'] = 2
+        self.queue_messages(2)
+        # The first message fails twice with an error that is not an SMTP
+        # one; the second is sent in between.
+        with mock.patch('flask_mail.Connection.send', side_effect=[
+                ValueError('bad header'), None,
+                ValueError('bad header')]) as conn_send:
+            pool = MailWorkerPool(self.app, workers=1, once=True)
+            pool.run()
+        self.assertEqual(pool.sent, 1)
+        self.assertEqual(conn_send.call_count, 3)
+        dead = DeadMail.query.one()
+        self.assertEqual((dead.attempts, dead.last_error), (2, 'bad header'))
+        self.assertEqual(OutgoingMail.query.count(), 0)
+
+    def test_database_errors_count_as_attempts(self):
+        self.app.config['FLASKY_MAIL_QUEUE_RETRY_DELAY'] = 0
+        self.app.config['FLASKY_MAIL_QUEUE_MAX_ATTEMPTS'] = 1
+        self.queue_messages(1)
+        with mock.patch('app.mail_queue.MailWorker.deliver_one',
+                        side_effect=RuntimeError('database is locked')):
+            MailWorkerPool(self.app, workers=1, once=True).run()
+        self.assertEqual(DeadMail.query.one().last_error,
+                         'database is locked')
+
+    @unittest.skipIf(Controller is None, 'aiosmtpd is not installed')
+    def test_local_smtp_server(self):
+        class Handler:
+            messages = []
+
+            async def handle_DATA(self, server, session, envelope):
+                self.messages.append(envelope)
+                return '250 OK'
+
+        handler = Handler()
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        controller = Controller(handler, hostname='127.0.0.1', port=port)
+        controller.start()
+        try:
+            self.app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=port,
+                                   MAIL_USE_TLS=False,
+                                   MAIL_SUPPRESS_SEND=False)
+            mail.init_app(self.app)
+            self.queue_messages(3)
+            MailWorkerPool(self.app, workers=1, once=True).run()
+        finally:
+            controller.stop()
+        self.assertEqual(len(handler.messages), 3)
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+import sqlalchemy as sa
+from alembic import op
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from app.migration import backfill, create_index_online, drop_index_online
+
+
+class MigrationHelpersTestCase(unittest.TestCase):
+    def setUp(self):
+        # The backfill commits on a second connection, so it needs a file.
+        self.tmpdir = tempfile.mkdtemp()
+        self.engine = sa.create_engine('sqlite:///' + os.path.join(
+            self.tmpdir, 'migration.sqlite'))
+        self.engine.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, '
+                            'email VARCHAR(64))')
+        self.engine.execute(
+            sa.text('INSERT INTO users (id, email) VALUES (:id, :email)'),
+            [{'id': i * 3, 'email': 'User%d@Example.com' % i}
+             for i in range(1, 26)])
+        self.connection = self.engine.connect()
+        context = MigrationContext.configure(
+            self.connection, opts={'backfill_batch_size': 10})
+        self.operations = Operations.context(context)
+        self.operations.__enter__()
+
+    def tearDown(self):
+        self.operations.__exit__(None, None, None)
+        self.connection.close()
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def users(self):
+        return sa.table('users', sa.column('id'), sa.column('email'),
+                        sa.column('email_lower'))
+
+    def test_backfill_commits_every_batch(self):
+        op.add_column('users', sa.Column('email_lower', sa.String(64)))
+        users = self.users()
+        progress = []
+
+        def report(*args):
+            # Every batch is already committed when it is reported.
+            progress.append(args + (self.engine.scalar(
+                'SELECT count(*) FROM users WHERE email_lower IS NOT NULL'),))
+        done = backfill(users, {'email_lower': sa.func.lower(users.c.email)},
+                        where=users.c.email_lower.is_(None), progress=report)
+        self.assertEqual(done, 25)
+        self.assertEqual([(args[0], args[1], args[4]) for args in progress],
+                         [(10, 25, 10), (20, 25, 20), (25, 25, 25),
+                          (25, 25, 25)])
+        self.assertEqual(progress[-1][3], 0)
+        rows = self.engine.execute('SELECT email, email_lower FROM users')
+        for email, email_lower in rows:
+            self.assertEqual(email_lower, email.lower())
+
+    def test_backfill_skips_rows_already_done(self):
+        op.add_column('users', sa.Column('email_lower', sa.String(64)))
+        self.engine.execute("UPDATE users SET email_lower = 'done' "
+                            "WHERE id <= 30")
+        users = self.users()
+        done = backfill(users, {'email_lower': sa.func.lower(users.c.email)},
+                        where=users.c.email_lower.is_(None), batch_size=100)
+        self.assertEqual(done, 15)
+        self.assertEqual(self.engine.scalar(
+            "SELECT count(*) FROM users WHERE email_lower = 'done'"), 10)
+
+    def test_index_builds(self):
+        create_index_online('ix_users_email', 'users', ['email'],
+                            unique=True)
+        indexes = sa.inspect(self.engine).get_indexes('users')
+        self.assertEqual([(index['name'], index['unique'])
+                          for index in indexes],
+                         [('ix_users_email', 1)])
+        drop_index_online('ix_users_email', 'users')
+        self.assertEqual(sa.inspect(self.engine).get_indexes('users'), [])
@@ -0,0 +1,94 @@
+import re
+from flask import g, template_rendered, url_for
+from app import page_cache
+from app.pagecache import CSRF_PLACEHOLDER
+from tests.base import FlaskyTestCase
+
+
+class PageCacheTestCase(FlaskyTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(PageCacheTestCase, cls).setUpClass()
+        cls.app.config['FLASKY_PAGE_CACHE'] = True
+        page_cache.init_app(cls.app)
+
+    def setUp(self):
+        super(PageCacheTestCase, self).setUp()
+        page_cache.clear()
+        self.add_user(confirmed=True)
+        self.client = self.app.test_client()
+        self.rendered = []
+        template_rendered.connect(self.record_render, self.app)
+
+    def tearDown(self):
+        template_rendered.disconnect(self.record_render, self.app)
+        super(PageCacheTestCase, self).tearDown()
+
+    def record_render(self, sender, template, context, **extra):
+        self.rendered.append(template.name)
+
+    def test_anonymous_page_is_cached(self):
+        first = self.client.get('/')
+        self.assertEqual(self.rendered, ['index.html'])
+        second = self.client.get('/')
+        self.assertEqual(self.rendered, ['index.html'])
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+        self.assertIn('Last-Modified', second.headers)
+
+    def test_conditional_request(self):
+        etag = self.client.get('/').headers['ETag']
+        response = self.client.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+    def test_logged_in_user_is_not_served_cached_page(self):
+        self.client.get('/')
+        self.client.post('/auth/login', data={'email': 'john@example.com',
+                                              'password': 'cat'})
+        response = self.client.get('/')
+        self.assertIn(b'Hello, john!', response.data)
+
+    def test_not_found_page_is_cached(self):
+        self.client.get('/no/such/page')
+        response = self.client.get('/another/missing/page')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.rendered, ['404.html'])
+
+    def test_csrf_token_is_punched_through(self):
+        self.app.config['WTF_CSRF_ENABLED'] = True
+        self.client.get('/auth/login')
+        # Requests share the test's application context, and with it the
+        # token Flask-WTF keeps on g.
+        g.pop('csrf_token')
+        client = self.app.test_client()
+        response = client.get('/auth/login')
+        self.assertEqual(self.rendered.count('auth/login.html'), 1)
+        token = re.search(rb'name="csrf_token" type="hidden" value="([^"]+)"',
+                          response.data).group(1).decode()
+        self.assertIn(CSRF_PLACEHOLDER, self.page_cache_body())
+        g.pop('csrf_token')
+        response = client.post('/auth/login', data={
+            'email': 'john@example.com', 'password': 'cat',
+            'csrf_token': token})
+        self.assertEqual(response.status_code, 302)
+
+    def page_cache_body(self):
+        return self.app.extensions['page_cache'].get(
+            'page:/auth/login?').body
+
+    def test_static_urls_are_versioned(self):
+        with self.app.test_request_context():
+            url = url_for('static', filename='favicon.ico')
+        self.assertRegex(url, r'/static/favicon.ico\?v=[0-9a-f]{12}$')
+        response = self.client.get(url)
+        self.assertEqual(response.cache_control.max_age,
+                         self.app.config['FLASKY_STATIC_MAX_AGE'])
+        response.close()
+
+    def test_only_current_static_version_is_cached_for_good(self):
+        response = self.client.get('/static/favicon.ico?v=000000000000')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.cache_control.max_age,
+                            self.app.config['FLASKY_STATIC_MAX_AGE'])
+        response.close()
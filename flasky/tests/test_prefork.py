@@ -0,0 +1,92 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import unittest
+from unittest import mock
+from urllib.error import URLError
+from urllib.request import urlopen
+from config import config
+from app import create_app, db
+from app.prefork import check_config, memory_usage, share_between_workers
+
+SNIPPET = '''
+from app.prefork import PreforkServer
+PreforkServer('testing', port=%d, workers=1, max_requests=2,
+              max_requests_jitter=0).run()
+'''
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class PreforkTestCase(unittest.TestCase):
+    @unittest.skipUnless(os.path.exists('/proc/self/smaps_rollup'),
+                         'needs /proc/<pid>/smaps_rollup')
+    def test_memory_usage(self):
+        usage = memory_usage(os.getpid())
+        self.assertGreater(usage['rss'], 0)
+        self.assertLessEqual(usage['pss'], usage['rss'])
+        self.assertIsNone(memory_usage(2 ** 22 + 1))
+
+    def test_dispose_engines(self):
+        app = create_app('testing')
+        with app.app_context():
+            engine = db.engine
+            db.dispose_engines(app)
+            self.assertIsNot(db.engine, engine)
+
+    def test_check_config(self):
+        class Settings(config['testing']):
+            FLASKY_SESSION_BACKEND = 'sqlite'
+            FLASKY_USER_CACHE_TYPE = 'simple'
+        with self.assertRaises(ValueError):
+            check_config(Settings, 1)
+        Settings.FLASKY_SESSION_SQLITE_PATH = '/tmp/sessions.sqlite'
+        check_config(Settings, 1)
+        with self.assertRaises(ValueError):
+            check_config(Settings, 2)
+        Settings.FLASKY_USER_CACHE_TYPE = 'null'
+        with mock.patch('app.prefork.log') as log:
+            check_config(Settings, 2)
+        self.assertIn('rate limiter', log.call_args[0][0])
+        Settings.FLASKY_RATELIMIT_BACKEND = 'redis'
+        with mock.patch('app.prefork.log') as log:
+            check_config(Settings, 2)
+        self.assertFalse(log.called)
+
+    def test_share_between_workers(self):
+        app = create_app('testing', lazy=True)
+        app.config['FLASKY_HASH_WORKERS'] = 8
+        share_between_workers(app, 1)
+        self.assertEqual(app.config['FLASKY_HASH_WORKERS'], 8)
+        share_between_workers(app, 3)
+        self.assertEqual(app.config['FLASKY_USER_CACHE_TYPE'], 'simple')
+        self.assertEqual(app.extensions['password_hasher'].workers, 2)
+
+    def test_workers_are_recycled_and_stopped(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        master = subprocess.Popen([sys.executable, '-c', SNIPPET % port],
+                                  cwd=root, stderr=subprocess.PIPE)
+        try:
+            url = 'http://127.0.0.1:%d/auth/login' % port
+            deadline = time.time() + 30
+            while True:
+                try:
+                    statuses = [urlopen(url).status]
+                    break
+                except (URLError, ConnectionError):
+                    self.assertLess(time.time(), deadline)
+                    time.sleep(0.1)
+            statuses += [urlopen(url).status for i in range(4)]
+            self.assertEqual(statuses, [200] * 5)
+        finally:
+            master.send_signal(signal.SIGTERM)
+            output = master.communicate(timeout=30)[1].decode()
+        self.assertEqual(master.returncode, 0)
+        self.assertEqual(output.count('served 2 requests, recycling'), 2)
+        self.assertIn('stopping 1 workers', output)
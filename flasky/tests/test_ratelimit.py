@@ -0,0 +1,82 @@
+import unittest
+from unittest import mock
+from app.auth.views import account_key
+from app.ratelimit import LocalBackend, RedisBackend
+from tests.base import FlaskyTestCase
+
+
+class LocalBackendTestCase(unittest.TestCase):
+    def test_sliding_window(self):
+        backend = LocalBackend()
+        with mock.patch('time.time', return_value=1000.0):
+            for i in range(4):
+                backend.hit('a', 10)
+            self.assertEqual(backend.count('a', 10), 4)
+        # Halfway through the next window, half of the old count remains.
+        with mock.patch('time.time', return_value=1015.0):
+            self.assertEqual(backend.hit('a', 10), 3)
+        with mock.patch('time.time', return_value=1030.0):
+            self.assertEqual(backend.count('a', 10), 0)
+
+    def test_stale_keys_are_swept(self):
+        backend = LocalBackend(shards=1, max_keys=2)
+        with mock.patch('time.time', return_value=1000.0):
+            backend.hit('a', 10)
+            backend.hit('b', 10)
+        with mock.patch('time.time', return_value=1100.0):
+            backend.hit('c', 10)
+        self.assertEqual(list(backend._shards[0]), ['c'])
+
+
+    def test_redis_reset_deletes_window_keys(self):
+        backend = RedisBackend.__new__(RedisBackend)
+        backend.prefix = 'p:'
+        backend._redis = mock.Mock()
+        with mock.patch('time.time', return_value=1000.0):
+            backend.reset('a', 10)
+        backend._redis.delete.assert_called_once_with('p:a:100', 'p:a:99')
+        self.assertFalse(backend._redis.keys.called)
+
+    def test_account_keys_are_normalized(self):
+        self.assertEqual(account_key('auth.login', ' John@Example.com '),
+                         account_key('auth.login', 'john@example.com'))
+
+
+class LoginRateLimitTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(LoginRateLimitTestCase, self).setUp()
+        self.app.config['FLASKY_RATELIMIT_PER_ACCOUNT'] = 3
+        self.add_user()
+        self.client = self.app.test_client()
+
+    def login(self, password, email='john@example.com'):
+        return self.client.post('/auth/login', data={
+            'email': email, 'password': password})
+
+    def test_account_is_throttled(self):
+        for i in range(3):
+            self.assertEqual(self.login('dog').status_code, 200)
+        queries = self.record_queries()
+        response = self.login('cat')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '60')
+        self.assertEqual(queries, [])
+        self.assertEqual(self.login('dog', 'susan@example.com').status_code,
+                         200)
+
+    def test_ip_is_throttled(self):
+        self.app.config['FLASKY_RATELIMIT_PER_IP'] = 2
+        self.login('dog', 'a@example.com')
+        self.login('dog', 'b@example.com')
+        self.assertEqual(self.login('dog', 'c@example.com').status_code, 429)
+
+    def test_success_resets_account(self):
+        self.login('dog')
+        self.login('dog')
+        self.assertEqual(self.login('cat').status_code, 302)
+        self.assertEqual(self.login('dog').status_code, 200)
+
+    def test_disabled(self):
+        self.app.config['FLASKY_RATELIMIT_ENABLED'] = False
+        for i in range(5):
+            self.assertEqual(self.login('dog').status_code, 200)
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from flask import session
+from app import create_app, db
+from app.models import Role
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.app = create_app('testing')
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = \
+            'sqlite:///' + os.path.join(self.tmpdir, 'primary.sqlite')
+        self.app.config['FLASKY_DB_REPLICAS'] = [
+            'sqlite:///' + os.path.join(self.tmpdir, 'replica.sqlite')]
+        db.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.primary = db.get_engine(self.app)
+        self.replica = db.get_engine(self.app, bind='replica0')
+        for engine in self.primary, self.replica:
+            db.Model.metadata.create_all(bind=engine)
+        # Rows that only exist on one side show where a query was sent.
+        self.replica.execute(Role.__table__.insert(), name='Replica')
+        self.primary.execute(Role.__table__.insert(), name='Primary')
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
+        for engine in self.primary, self.replica:
+            engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def names(self):
+        return [role.name for role in Role.query.all()]
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.names(), ['Replica'])
+
+    def test_writes_go_to_primary(self):
+        db.session.add(Role(name='New'))
+        db.session.commit()
+        self.assertEqual(self.primary.execute(
+            'SELECT count(*) FROM roles').scalar(), 2)
+        self.assertEqual(self.replica.execute(
+            'SELECT count(*) FROM roles').scalar(), 1)
+
+    def test_read_your_writes(self):
+        db.session.add(Role(name='New'))
+        db.session.commit()
+        self.assertEqual(sorted(self.names()), ['New', 'Primary'])
+        db.session.remove()
+        self.assertEqual(self.names(), ['Replica'])
+
+    def test_bulk_update_goes_to_primary(self):
+        Role.query.filter_by(name='Primary').update({'permissions': 1})
+        db.session.commit()
+        self.assertEqual(self.names(), ['Primary'])
+
+    def test_next_request_sticks_to_primary(self):
+        with self.app.test_request_context():
+            db.session.add(Role(name='New'))
+            self.app.process_response(self.app.response_class())
+            self.assertGreater(session['_db_primary_until'], time.time())
+            db.session.commit()
+            db.session.remove()
+            self.assertEqual(sorted(self.names()), ['New', 'Primary'])
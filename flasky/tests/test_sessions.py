@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+from app import create_app, server_sessions
+from app.cache import NullBackend, SimpleBackend
+from app.sessions import ServerSessionInterface, SQLiteStore
+from tests.base import FlaskyTestCase
+
+
+class ServerSessionTestCase(FlaskyTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(ServerSessionTestCase, cls).setUpClass()
+        cls.app.config['FLASKY_SESSION_BACKEND'] = 'sqlite'
+        server_sessions.init_app(cls.app)
+
+    def setUp(self):
+        super(ServerSessionTestCase, self).setUp()
+        self.interface = self.app.session_interface
+        self.interface.cache.clear()
+        self.add_user(confirmed=True)
+        self.client = self.app.test_client()
+
+    def login(self):
+        return self.client.post('/auth/login', data={
+            'email': 'john@example.com', 'password': 'cat'})
+
+    def session_cookie(self):
+        for cookie in self.client.cookie_jar:
+            if cookie.name == self.app.session_cookie_name:
+                return cookie.value
+
+    def sid(self):
+        return self.session_cookie().split('.')[0]
+
+    def test_cookie_holds_only_session_id(self):
+        self.assertIsInstance(self.interface, ServerSessionInterface)
+        self.login()
+        cookie = self.session_cookie()
+        sid = cookie.split('.')[0]
+        self.assertLess(len(cookie), 64)
+        self.assertIsNotNone(self.interface.store.get(sid))
+        response = self.client.get('/')
+        self.assertIn(b'Hello, john!', response.data)
+
+    def test_session_loaded_from_store(self):
+        self.login()
+        self.interface.cache.clear()
+        response = self.client.get('/')
+        self.assertIn(b'Hello, john!', response.data)
+
+    def test_tampered_cookie_starts_new_session(self):
+        self.login()
+        cookie = self.session_cookie()
+        self.client.set_cookie('localhost', self.app.session_cookie_name,
+                               'x' + cookie[1:])
+        response = self.client.get('/')
+        self.assertIn(b'Hello, Stranger!', response.data)
+
+    def test_unchanged_session_is_not_written(self):
+        self.login()
+        self.client.get('/')
+        with mock.patch.object(self.interface.store, 'set') as store_set:
+            self.client.get('/')
+            self.assertFalse(store_set.called)
+
+    def test_logout_keeps_only_flash(self):
+        self.login()
+        self.client.get('/auth/logout')
+        self.interface.cache.clear()
+        data = self.interface.store.get(self.sid())[0]
+        self.assertNotIn(b'user_id', data)
+
+    def test_login_moves_session_to_new_id(self):
+        with self.client.session_transaction() as session:
+            session['next'] = '/'
+        cookie = self.session_cookie()
+        sid = self.sid()
+        self.assertIsNotNone(self.interface.store.get(sid))
+        self.login()
+        self.assertNotEqual(self.sid(), sid)
+        self.assertIsNone(self.interface.store.get(sid))
+        self.assertIsNone(self.interface.cache.get(sid))
+        # Whoever planted the first id is not logged in by it.
+        self.client.set_cookie('localhost', self.app.session_cookie_name,
+                               cookie)
+        response = self.client.get('/')
+        self.assertIn(b'Hello, Stranger!', response.data)
+
+    def test_logout_moves_session_to_new_id(self):
+        self.login()
+        sid = self.sid()
+        self.client.get('/auth/logout')
+        self.assertNotEqual(self.sid(), sid)
+        self.assertIsNone(self.interface.store.get(sid))
+        self.assertIsNone(self.interface.cache.get(sid))
+
+    def test_deleted_session_is_not_written_back(self):
+        self.login()
+        sid = self.sid()
+        # Another process logs the session out; this one still caches it.
+        self.interface.store.delete(sid)
+        self.assertIsNotNone(self.interface.cache.get(sid))
+        with self.client.session_transaction() as session:
+            session['next'] = '/'
+        self.assertIsNone(self.interface.store.get(sid))
+        self.assertIsNone(self.interface.cache.get(sid))
+        self.assertIsNone(self.session_cookie())
+
+
+class SharedStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_shared_store_is_not_cached(self):
+        app = create_app('testing', lazy=True)
+        app.config['FLASKY_SESSION_BACKEND'] = 'sqlite'
+        server_sessions.init_app(app)
+        self.assertIsInstance(app.session_interface.cache, SimpleBackend)
+        app.config['FLASKY_SESSION_SQLITE_PATH'] = os.path.join(
+            self.tmpdir, 'sessions.sqlite')
+        server_sessions.init_app(app)
+        self.assertIsInstance(app.session_interface.cache, NullBackend)
+
+
+class SQLiteStoreTestCase(unittest.TestCase):
+    def test_sweep(self):
+        store = SQLiteStore(':memory:')
+        store.set('old', b'data', time.time() - 1)
+        store.set('new', b'data', time.time() + 60)
+        self.assertIsNone(store.get('old'))
+        self.assertEqual(store.sweep(time.time()), 1)
+        self.assertEqual(store.get('new')[0], b'data')
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from config import config
+from app import create_app, template_cache
+
+
+class TemplateCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def create_app(self, lazy=None):
+        app = create_app('testing', lazy=lazy)
+        app.config['FLASKY_TEMPLATE_CACHE_DIR'] = self.tmpdir
+        template_cache.init_app(app)
+        return app
+
+    def test_compiled_templates_are_reused(self):
+        app = self.create_app()
+        self.assertIsNotNone(app.jinja_env.bytecode_cache)
+        before = len(os.listdir(self.tmpdir))
+        app.jinja_env.get_template('index.html')
+        self.assertEqual(len(os.listdir(self.tmpdir)), before + 1)
+        other = self.create_app()
+        compiled = []
+        bucket_load = other.jinja_env.bytecode_cache.load_bytecode
+
+        def load_bytecode(bucket):
+            bucket_load(bucket)
+            compiled.append(bucket.code is None)
+        other.jinja_env.bytecode_cache.load_bytecode = load_bytecode
+        other.jinja_env.get_template('index.html')
+        self.assertEqual(compiled, [False])
+
+    def test_warm_up_compiles_every_template(self):
+        app = self.create_app(lazy=False)
+        # The email templates were compiled before the cache was set up.
+        app.jinja_env.cache.clear()
+        names = template_cache.warm_up(app)
+        cached = set(name for loader, name in app.jinja_env.cache.keys())
+        self.assertEqual(cached, set(names))
+        templates = os.path.join(app.root_path, 'templates')
+        for root, dirs, files in os.walk(templates):
+            for filename in files:
+                name = os.path.relpath(os.path.join(root, filename),
+                                       templates).replace(os.sep, '/')
+                self.assertIn(name, cached)
+        self.assertIn('bootstrap/base.html', cached)
+        self.assertGreaterEqual(len(os.listdir(self.tmpdir)), len(cached))
+
+    def test_warm_up_is_skipped_when_loading_lazily(self):
+        # create_app decides before there is an app.config to change.
+        with mock.patch.multiple(config['testing'],
+                                 FLASKY_TEMPLATE_CACHE_DIR=self.tmpdir,
+                                 FLASKY_TEMPLATE_WARMUP=True):
+            app = create_app('testing', lazy=True)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        self.assertNotIn('auth', app.blueprints)
+
+    def test_no_cache_by_default(self):
+        app = create_app('testing')
+        self.assertIsNone(app.jinja_env.bytecode_cache)
+        self.assertIn('index.html', template_cache.warm_up(app))
@@ -0,0 +1,50 @@
+from unittest import mock
+from itsdangerous import TimedJSONWebSignatureSerializer
+from app import tokens
+from app.tokens import VALID, EXPIRED, BAD_SIGNATURE
+from tests.base import FlaskyTestCase
+
+
+class TokenServiceTestCase(FlaskyTestCase):
+    def test_valid_token(self):
+        result = tokens.loads(tokens.dumps({'confirm': 1}))
+        self.assertEqual(result.status, VALID)
+        self.assertTrue(result.valid)
+        self.assertEqual(result.data, {'confirm': 1})
+
+    def test_expired_token(self):
+        token = tokens.dumps({'confirm': 1}, expiration=10)
+        self.clock.now += 11
+        result = tokens.loads(token)
+        self.assertEqual(result.status, EXPIRED)
+        self.assertFalse(result.valid)
+        self.assertEqual(result.data, {'confirm': 1})
+
+    def test_tampered_token(self):
+        token = tokens.dumps({'confirm': 1})
+        self.assertEqual(tokens.loads(token[:-2]).status, BAD_SIGNATURE)
+        self.assertEqual(tokens.loads('garbage').status, BAD_SIGNATURE)
+
+    def test_key_rotation(self):
+        token = tokens.dumps({'confirm': 1})
+        self.app.config['FLASKY_TOKEN_SECRETS'] = [
+            'new secret', self.app.config['SECRET_KEY']]
+        tokens.init_app(self.app)
+        self.assertTrue(tokens.loads(token).valid)
+        self.app.config['FLASKY_TOKEN_SECRETS'] = ['new secret']
+        tokens.init_app(self.app)
+        self.assertEqual(tokens.loads(token).status, BAD_SIGNATURE)
+
+    def test_signer_is_reused(self):
+        token = tokens.dumps({'confirm': 1})
+        tokens.loads(token)
+        with mock.patch.object(TimedJSONWebSignatureSerializer,
+                               'make_signer') as make_signer:
+            self.assertTrue(tokens.loads(tokens.dumps({'confirm': 1})).valid)
+            self.assertTrue(tokens.loads(token).valid)
+        self.assertFalse(make_signer.called)
+
+    def test_compatible_with_itsdangerous(self):
+        s = TimedJSONWebSignatureSerializer(self.app.config['SECRET_KEY'])
+        self.assertEqual(s.loads(tokens.dumps({'reset': 2})), {'reset': 2})
+        self.assertTrue(tokens.loads(s.dumps({'reset': 2})).valid)
@@ -0,0 +1,83 @@
+from app import db, user_cache
+from app.cache import NullBackend
+from app.models import Role, Permission, load_user, role_table
+from tests.base import FlaskyTestCase
+
+
+# Each request starts with an empty session, which expunge_all() stands in
+# for.
+class UserCacheTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(UserCacheTestCase, self).setUp()
+        self.queries = self.record_queries()
+
+    def add_user(self):
+        user_id = super(UserCacheTestCase, self).add_user().id
+        db.session.expunge_all()
+        return user_id
+
+    def test_cached_load_does_not_query(self):
+        user_id = self.add_user()
+        load_user(str(user_id)).can(Permission.FOLLOW)
+        db.session.expunge_all()
+        del self.queries[:]
+        u = load_user(str(user_id))
+        self.assertTrue(u.can(Permission.WRITE_ARTICLES))
+        self.assertEqual(u.email, 'john@example.com')
+        self.assertEqual(self.queries, [])
+        self.assertEqual(user_cache.stats()['hits'], 1)
+
+    def test_uncached_load_queries_only_the_user(self):
+        user_id = self.add_user()
+        role_table()
+        del self.queries[:]
+        self.assertTrue(load_user(str(user_id)).can(Permission.FOLLOW))
+        self.assertEqual(len(self.queries), 1)
+        self.assertIn('FROM users', self.queries[0])
+
+    def test_missing_user(self):
+        self.assertIsNone(load_user('42'))
+        self.assertEqual(user_cache.stats()['misses'], 1)
+
+    def test_confirm_invalidates(self):
+        user_id = self.add_user()
+        u = load_user(str(user_id))
+        self.assertTrue(u.confirm(u.generate_confirmation_token()))
+        db.session.commit()
+        db.session.expunge_all()
+        self.assertTrue(load_user(str(user_id)).confirmed)
+
+    def test_role_change_invalidates(self):
+        user_id = self.add_user()
+        load_user(str(user_id))
+        role = Role.query.filter_by(name='User').first()
+        role.permissions = Permission.FOLLOW
+        db.session.commit()
+        db.session.expunge_all()
+        u = load_user(str(user_id))
+        self.assertFalse(u.can(Permission.WRITE_ARTICLES))
+
+    def test_null_backend_keeps_version_stamps(self):
+        self.app.extensions['user_cache'].backend = NullBackend()
+        self.addCleanup(user_cache.init_app, self.app)
+        version = user_cache.version('roles')
+        self.assertEqual(user_cache.version('roles'), version)
+        role_table()
+        # A new request gets the table without reading the roles again.
+        self.app_context.g.pop('role_table')
+        del self.queries[:]
+        role_table()
+        self.assertEqual(self.queries, [])
+        self.assertNotEqual(user_cache.bump_version('roles'), version)
+        self.assertNotEqual(user_cache.version('roles'), version)
+
+    def test_rollback_keeps_cache(self):
+        user_id = self.add_user()
+        u = load_user(str(user_id))
+        u.username = 'john'
+        db.session.flush()
+        db.session.rollback()
+        db.session.expunge_all()
+        del self.queries[:]
+        load_user(str(user_id))
+        self.assertEqual(self.queries, [])
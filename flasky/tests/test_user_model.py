@@ -1,22 +1,11 @@
-import unittest
-import time
-from app import create_app, db
-from app.models import User, AnonymousUser, Role, Permission
-
-
-class UserModelTestCase(unittest.TestCase):
-    def setUp(self):
-        self.app = create_app('testing')
-        self.app_context = self.app.app_context()
-        self.app_context.push()
-        db.create_all()
-        Role.insert_roles()
+from unittest import mock
+from app import db
+from app.models import User, AnonymousUser, Role, Permission, \
+    permission_table, role_table
+from tests.base import FlaskyTestCase
 
-    def tearDown(self):
-        db.session.remove()
-        db.drop_all()
-        self.app_context.pop()
 
+class UserModelTestCase(FlaskyTestCase):
     def test_password_setter(self):
         u = User(password='cat')
         self.assertTrue(u.password_hash is not None)
@@ -57,7 +46,7 @@ class UserModelTestCase(unittest.TestCase):
         db.session.add(u)
         db.session.commit()
         token = u.generate_confirmation_token(1)
-        time.sleep(2)
+        self.clock.now += 2
         self.assertFalse(u.confirm(token))
 
     def test_valid_reset_token(self):
@@ -106,6 +95,18 @@ class UserModelTestCase(unittest.TestCase):
         self.assertFalse(u2.change_email(token))
         self.assertTrue(u2.email == 'susan@example.org')
 
+    def test_email_change_race(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        db.session.add(u1)
+        db.session.add(u2)
+        db.session.commit()
+        token = u2.generate_email_change_token('john@example.com')
+        # The address was free when it was checked.
+        with mock.patch.object(User, 'taken', return_value=set()):
+            self.assertFalse(u2.change_email(token))
+        self.assertEqual(u2.email, 'susan@example.org')
+
     def test_roles_and_permissions(self):
         u = User(email='john@example.com', password='cat')
         self.assertTrue(u.can(Permission.WRITE_ARTICLES))
@@ -114,3 +115,44 @@ class UserModelTestCase(unittest.TestCase):
     def test_anonymous_user(self):
         u = AnonymousUser()
         self.assertFalse(u.can(Permission.FOLLOW))
+
+    def test_permission_table(self):
+        table = permission_table()
+        admin = Role.query.filter_by(name='Administrator').first()
+        self.assertEqual(table[admin.id], 0xFF)
+        with self.assertRaises(TypeError):
+            table[admin.id] = 0
+
+    def test_permission_table_refresh(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        self.assertFalse(u.can(Permission.MODERATE_COMMENTS))
+        u.role.permissions |= Permission.MODERATE_COMMENTS
+        db.session.commit()
+        self.assertTrue(u.can(Permission.MODERATE_COMMENTS))
+
+    def test_new_users_get_role_ids_without_queries(self):
+        self.app.config['FLASKY_ADMIN'] = 'admin@example.com'
+        role_table()
+        queries = self.record_queries()
+        u = User(email='john@example.com')
+        admin = User(email='admin@example.com')
+        self.assertEqual(queries, [])
+        self.assertEqual(u.role_id,
+                         Role.query.filter_by(default=True).first().id)
+        self.assertEqual(admin.role_id,
+                         Role.query.filter_by(name='Administrator').first().id)
+
+    def test_insert_roles_refreshes_role_ids(self):
+        moderator = Role.query.filter_by(name='Moderator').first()
+        self.assertNotEqual(User(email='john@example.com').role_id,
+                            moderator.id)
+        Role.query.filter_by(default=True).first().default = False
+        moderator.default = True
+        db.session.commit()
+        self.assertEqual(User(email='john@example.com').role_id,
+                         moderator.id)
+        Role.insert_roles()
+        self.assertNotEqual(User(email='john@example.com').role_id,
+                            moderator.id)